@@ -0,0 +1,481 @@
+import argparse
+import contextlib
+import itertools
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from shepherd_game import jit, obstacles, parameters
+from shepherd_game.game import Game
+from shepherd_game.policies import StrombomShepherd
+
+# Default grid of scale parameters
+NUM_SHEEP = [5, 50, 200]
+NUM_DOG = [1, 2]
+NUM_OBSTACLES = [0, 4, 100]
+FIELD_LENGTHS = [150, 300]
+# Herd updates, the compiled one only if numba is installed
+BACKENDS = ['numpy', 'jit'] if jit.AVAILABLE else ['numpy']
+
+# Slowdown over the baseline that counts as a regression
+TOLERANCE = 0.2
+# Untimed calls before timing, so one-time setup such as compiling the
+# numba kernels is not measured
+WARMUP = 5
+
+
+@contextlib.contextmanager
+def field_length(length: int):
+    """
+    Temporarily change FIELD_LENGTH in every module that uses it.
+
+    Args:
+        length (int): Width and height of the field
+    """
+    modules = [module for name, module in list(sys.modules.items())
+               if name.startswith('shepherd_game') and
+               hasattr(module, 'FIELD_LENGTH')]
+    old = parameters.FIELD_LENGTH
+    for module in modules:
+        module.FIELD_LENGTH = length
+    try:
+        yield
+    finally:
+        for module in modules:
+            module.FIELD_LENGTH = old
+
+
+@contextlib.contextmanager
+def random_obstacles(num: int, length: int, seed: int = 0):
+    """
+    Temporarily replace the obstacles with random lines and circles.
+
+    Half of the obstacles are lines and half circles, kept out of the
+    sheep spawn corner so no sheep starts inside a circle.
+
+    Args:
+        num (int): Number of obstacles
+        length (int): Width and height of the field
+        seed (int): Seed of the obstacle layout. Defaults to 0
+    """
+    rng = np.random.default_rng(seed)
+    old = obstacles.lines[:], obstacles.circles[:]
+    obstacles.lines[:] = [
+        obstacles.Line(start=list(rng.random(2) * length/2),
+                       end=list(rng.random(2) * length/2))
+        for _ in range(num // 2)]
+    obstacles.circles[:] = [
+        obstacles.Circle(center=tuple(rng.random(2) * length/2),
+                         radius=float(rng.uniform(2, 10)))
+        for _ in range(num - num // 2)]
+    try:
+        yield
+    finally:
+        obstacles.lines[:], obstacles.circles[:] = old
+
+
+def summarize(times: List[float], peak: int) -> Dict[str, float]:
+    """
+    Turn call times into rates and latency percentiles.
+
+    Args:
+        times (List[float]): Seconds taken by each call
+        peak (int): Peak traced memory in bytes
+
+    Returns:
+        Dict[str, float]: Calls per second, latency percentiles in ms and
+            peak memory in KiB
+    """
+    times = np.array(times)
+    p50, p90, p99 = np.percentile(times, [50, 90, 99]) * 1e3
+    return {
+        'per_sec': len(times) / times.sum(),
+        'p50_ms': p50,
+        'p90_ms': p90,
+        'p99_ms': p99,
+        'peak_kib': peak / 1024,
+    }
+
+
+def measure(call: Callable[[], None], repeat: int,
+            warmup: int = WARMUP) -> Dict[str, float]:
+    """
+    Time a call, then run it again under tracemalloc for peak memory.
+
+    Args:
+        call (Callable): Work to time, called with no arguments
+        repeat (int): Number of timed calls
+        warmup (int): Untimed calls made first. Defaults to WARMUP
+
+    Returns:
+        Dict[str, float]: Output of summarize
+    """
+    for _ in range(warmup):
+        call()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+
+    # Memory is traced in a separate pass so it does not slow the timing
+    tracemalloc.start()
+    for _ in range(min(repeat, 20)):
+        call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summarize(times, peak)
+
+
+def driven_game(**kwargs) -> Tuple[Game, Callable[[], None]]:
+    """
+    Make a headless game and a call that steps it with the scripted
+    shepherd, resetting when the sheep reach the goal.
+
+    Args:
+        **kwargs: Arguments for Game
+
+    Returns:
+        Tuple[Game, Callable]: The game and its step call
+    """
+    game = Game(headless=True, seed=0, **kwargs)
+    policy = StrombomShepherd(np.random.default_rng(0))
+
+    def step():
+        if game.step(policy.act(game.dog, game.sheep, game.target)):
+            game.reset()
+    return game, step
+
+
+def bench_step(num_sheep: int, num_dog: int, steps: int, jit: bool):
+    """Game.step, including the scripted shepherd."""
+    game, step = driven_game(num_sheep=num_sheep, num_dog=num_dog, jit=jit)
+    return dict(measure(step, steps), jit=game.jit)
+
+
+def bench_render(num_sheep: int, num_dog: int, steps: int, jit: bool):
+    """Game.render into the off-screen surface."""
+    game, step = driven_game(num_sheep=num_sheep, num_dog=num_dog, jit=jit)
+    for _ in range(20):
+        step()
+    return dict(measure(lambda: game.render(draw=False), steps),
+                jit=game.jit)
+
+
+def bench_observe(num_sheep: int, num_dog: int, steps: int, jit: bool):
+    """Game.observe with the NumPy rasterizer at the field size."""
+    game, step = driven_game(num_sheep=num_sheep, num_dog=num_dog,
+                             frame_scale=1, jit=jit)
+    for _ in range(20):
+        step()
+    return dict(measure(game.observe, steps), jit=game.jit)
+
+
+def bench_calculate_movement(num_sheep: int, num_dog: int, steps: int,
+                             jit: bool):
+    """Game.calculate_movement for random moves across the field."""
+    game = Game(headless=True, seed=0, num_sheep=num_sheep, num_dog=num_dog,
+                jit=jit)
+    rng = np.random.default_rng(0)
+    starts = rng.random((steps, 2)) * parameters.FIELD_LENGTH
+    moves = rng.random((steps, 2)) * 4 - 2
+    calls = iter(zip(itertools.cycle(starts), itertools.cycle(moves)))
+    return dict(measure(lambda: game.calculate_movement(*next(calls)),
+                        steps), jit=game.jit)
+
+
+def bench_cannot_see(num_sheep: int, num_dog: int, steps: int, jit: bool):
+    """Game.cannot_see for random pairs of points in the field."""
+    game = Game(headless=True, seed=0, num_sheep=num_sheep, num_dog=num_dog,
+                jit=jit)
+    rng = np.random.default_rng(0)
+    points = rng.random((steps, 2, 2)) * parameters.FIELD_LENGTH
+    calls = iter(itertools.cycle(points))
+    return dict(measure(lambda: game.cannot_see(*next(calls)), steps),
+                jit=game.jit)
+
+
+def bench_save_data(num_sheep: int, num_dog: int, steps: int, jit: bool,
+                    episode_steps: int = 50):
+    """
+    Recording episodes of episode_steps steps with frames and finishing
+    them with Game.save_data, including the wait for the writer.
+    """
+    with tempfile.TemporaryDirectory() as save_dir:
+        game = Game(save_dir=save_dir + '/', headless=True, seed=0,
+                    num_sheep=num_sheep, num_dog=num_dog, frame_scale=1,
+                    jit=jit)
+        policy = StrombomShepherd(np.random.default_rng(0))
+
+        def episode():
+            for _ in range(episode_steps):
+                game.step(policy.act(game.dog, game.sheep, game.target))
+            game.save_data()
+            game.recorder.flush()
+
+        result = dict(measure(episode, max(steps // episode_steps, 1)),
+                      jit=game.jit)
+        game.close()
+    return result
+
+
+BENCHMARKS = {
+    'step': bench_step,
+    'render': bench_render,
+    'observe': bench_observe,
+    'calculate_movement': bench_calculate_movement,
+    'cannot_see': bench_cannot_see,
+    'save_data': bench_save_data,
+}
+
+
+# Cases of the trajectory check: the dense update with no, few and many
+# obstacles, teams of dogs in every multi_dog mode and the spatial grid used
+# by large flocks
+TRAJECTORY_CASES = [
+    {'num_sheep': 5, 'num_dog': 1, 'num_obstacles': 0},
+    {'num_sheep': 20, 'num_dog': 2, 'num_obstacles': 0,
+     'multi_dog': 'sequential'},
+    {'num_sheep': 20, 'num_dog': 3, 'num_obstacles': 0,
+     'multi_dog': 'sum'},
+    {'num_sheep': 20, 'num_dog': 1, 'num_obstacles': 4},
+    {'num_sheep': 20, 'num_dog': 4, 'num_obstacles': 100},
+    {'num_sheep': 150, 'num_dog': 1, 'num_obstacles': 0},
+    {'num_sheep': 150, 'num_dog': 4, 'num_obstacles': 0,
+     'multi_dog': 'sequential'},
+]
+# State copied from the reference game before every lockstep step
+LOCKSTEP_STATE = ['sheep', 'dog', 'heading', 'target']
+
+
+def lockstep_errors(reference: Game, fast: list, steps: int,
+                    seed: int = 0) -> List[float]:
+    """
+    Step fast games in lockstep with a reference game, driven by the
+    scripted shepherd.
+
+    The fast games are put in the state of the reference game before
+    every step, so rounding differences are not amplified by the chaotic
+    herd and each step is compared on its own. A fast game can also be a
+    VecGame, whose games all get the reference state and action. Positions
+    are compared after every step that does not end the episode, and a
+    fast game that disagrees on the end gets an infinite error.
+
+    Args:
+        reference (Game): Game the others are compared to
+        fast (list): Games or VecGames to compare
+        steps (int): Steps to compare
+        seed (int): Seed of the shepherd. Defaults to 0
+
+    Returns:
+        List[float]: Largest position difference of each fast game
+    """
+    policy = StrombomShepherd(np.random.default_rng(seed))
+    errors = [0.0] * len(fast)
+    for _ in range(steps):
+        for game in fast:
+            for name in LOCKSTEP_STATE:
+                np.copyto(getattr(game, name), getattr(reference, name))
+
+        action = policy.act(reference.dog, reference.sheep, reference.target)
+        ended = reference.step(action.copy())
+        for k, game in enumerate(fast):
+            done = game.step(np.broadcast_to(action, game.dog.shape).copy())
+            if not np.all(done == ended):
+                errors[k] = np.inf
+            elif not ended:
+                errors[k] = max(errors[k],
+                                np.abs(game.sheep - reference.sheep).max(),
+                                np.abs(game.dog - reference.dog).max())
+        if ended:
+            reference.reset()
+    return errors
+
+
+def trajectory_check(steps: int = 200, seed: int = 0, tol: float = 1e-9,
+                     cases: List[Dict] = TRAJECTORY_CASES,
+                     backends: List[str] = BACKENDS) -> List[Dict]:
+    """
+    Check that the NumPy and compiled updates move the herd like the
+    reference loop for the same seed, with lockstep_errors.
+
+    Args:
+        steps (int): Steps to compare. Defaults to 200
+        seed (int): Seed of the games and obstacles. Defaults to 0
+        tol (float): Largest allowed position difference after a step.
+            Defaults to 1e-9
+        cases (List[Dict]): Flock, team and obstacle setups. Defaults to
+            TRAJECTORY_CASES
+        backends (List[str]): Updates to check, 'numpy' or 'jit'. Defaults
+            to BACKENDS
+
+    Returns:
+        List[Dict]: One result per case and update, with the largest
+            difference and whether it passed
+    """
+    results = []
+    for case in cases:
+        with random_obstacles(case['num_obstacles'],
+                              parameters.FIELD_LENGTH, seed):
+            kwargs = dict(headless=True, seed=seed,
+                          num_sheep=case['num_sheep'],
+                          num_dog=case['num_dog'],
+                          multi_dog=case.get('multi_dog', 'nearest'))
+            reference = Game(vectorized=False, **kwargs)
+            fast = [Game(jit=backend == 'jit', **kwargs)
+                    for backend in backends]
+            errors = lockstep_errors(reference, fast, steps, seed)
+
+        for backend, error in zip(backends, errors):
+            results.append(dict(case, backend=backend,
+                                max_error=float(error),
+                                passed=bool(error <= tol)))
+    return results
+
+
+def run(benchmarks: Optional[List[str]] = None,
+        num_sheep: List[int] = NUM_SHEEP,
+        num_dog: List[int] = NUM_DOG,
+        num_obstacles: List[int] = NUM_OBSTACLES,
+        field_lengths: List[int] = FIELD_LENGTHS,
+        steps: int = 200,
+        backends: List[str] = BACKENDS) -> Dict:
+    """
+    Run benchmarks over the grid of scale parameters.
+
+    Args:
+        benchmarks (Optional[List[str]]): Names from BENCHMARKS. If None,
+            run all of them. Defaults to None.
+        num_sheep (List[int]): Flock sizes. Defaults to NUM_SHEEP
+        num_dog (List[int]): Dog counts. Defaults to NUM_DOG
+        num_obstacles (List[int]): Obstacle counts. Defaults to
+            NUM_OBSTACLES
+        field_lengths (List[int]): Field sizes. Defaults to FIELD_LENGTHS
+        steps (int): Timed calls per case. Defaults to 200
+        backends (List[str]): Herd updates, 'numpy' or 'jit'. Defaults to
+            BACKENDS
+
+    Returns:
+        Dict: Machine info and one result per benchmark and case, with
+            'jit' telling which herd update the games used
+    """
+    results = []
+    for name in benchmarks or BENCHMARKS:
+        for length, obstacle_count, sheep, dogs, backend in \
+                itertools.product(field_lengths, num_obstacles, num_sheep,
+                                  num_dog, backends):
+            with field_length(length), \
+                    random_obstacles(obstacle_count, length):
+                stats = BENCHMARKS[name](sheep, dogs, steps,
+                                         jit=backend == 'jit')
+            case = {'benchmark': name, 'field_length': length,
+                    'num_obstacles': obstacle_count, 'num_sheep': sheep,
+                    'num_dog': dogs}
+            results.append(dict(case, **stats))
+            print(format_result(results[-1]))
+
+    return {
+        'machine': {'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'platform': platform.platform(),
+                    'processor': platform.processor()},
+        'results': results,
+    }
+
+
+def case_key(result: Dict) -> tuple:
+    """Parameters and backend that identify a benchmark case."""
+    return (result['benchmark'], result['field_length'],
+            result['num_obstacles'], result['num_sheep'], result['num_dog'],
+            result.get('jit'))
+
+
+def format_result(result: Dict) -> str:
+    """One line summary of a benchmark result."""
+    return (f"{result['benchmark']:>18} field={result['field_length']:<4}"
+            f" obstacles={result['num_obstacles']:<3}"
+            f" sheep={result['num_sheep']:<4} dogs={result['num_dog']:<2}"
+            f" jit={result.get('jit')!s:<5}"
+            f" {result['per_sec']:10.1f}/s p50={result['p50_ms']:.3f}ms"
+            f" p99={result['p99_ms']:.3f}ms peak={result['peak_kib']:.0f}KiB")
+
+
+def compare(results: Dict, baseline: Dict,
+            tolerance: float = TOLERANCE) -> List[Dict]:
+    """
+    Find cases that got slower than a baseline.
+
+    Args:
+        results (Dict): Output of run
+        baseline (Dict): Earlier output of run
+        tolerance (float): Allowed slowdown as a fraction. Defaults to
+            TOLERANCE
+
+    Returns:
+        List[Dict]: Regressed results, with 'ratio' of the new rate to the
+            baseline rate
+    """
+    old = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        base = old.get(case_key(result))
+        if base is None:
+            continue
+        ratio = result['per_sec'] / base['per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append(dict(result, ratio=ratio))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the game headlessly over scale parameters")
+    parser.add_argument('--bench', nargs='+', choices=list(BENCHMARKS))
+    parser.add_argument('--sheep', nargs='+', type=int, default=NUM_SHEEP)
+    parser.add_argument('--dogs', nargs='+', type=int, default=NUM_DOG)
+    parser.add_argument('--obstacles', nargs='+', type=int,
+                        default=NUM_OBSTACLES)
+    parser.add_argument('--field', nargs='+', type=int,
+                        default=FIELD_LENGTHS)
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--backend', nargs='+', choices=['numpy', 'jit'],
+                        default=BACKENDS)
+    parser.add_argument('--save', help="write the results as a baseline")
+    parser.add_argument('--compare', help="baseline to check against")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--skip-check', action='store_true',
+                        help="skip the fixed-seed trajectory check")
+    args = parser.parse_args(argv)
+
+    failed = False
+    if not args.skip_check:
+        for result in trajectory_check():
+            print(f"trajectory check {result}")
+            failed |= not result['passed']
+
+    results = run(args.bench, args.sheep, args.dogs, args.obstacles,
+                  args.field, args.steps, args.backend)
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for result in regressions:
+            print(f"REGRESSION x{result['ratio']:.2f} "
+                  f"{format_result(result)}")
+        failed |= bool(regressions)
+
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
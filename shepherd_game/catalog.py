@@ -0,0 +1,262 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+
+from shepherd_game.parameters import TARGET_RADIUS
+from shepherd_game.recorder import SPAWN_ARRAYS
+
+CATALOG_VERSION = 2
+
+
+def trial_names(data_dir: str) -> list:
+    """Finished trial folders in data_dir, sorted by run number."""
+    return sorted((name for name in os.listdir(data_dir) if name.isdigit()),
+                  key=int)
+
+
+def load_trial(trial_path: str,
+               headings: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Read the CSVs of one trial folder.
+
+    Args:
+        trial_path (str): Path of the trial folder
+        headings (bool): Also read the headings, for trials that logged
+            them. Defaults to False
+
+    Returns:
+        Dict[str, np.ndarray]: 'dog' and 'sheep' positions, shape (T, D*2)
+            and (T, S*2), the 'target' position and the 'spawn' state as a
+            dict of (N, 2) arrays, if the trial has it. With headings, also
+            'dog_dir' and 'sheep_dir' shaped like the positions
+    """
+    def read(name):
+        return np.loadtxt(os.path.join(trial_path, name), delimiter=',',
+                          ndmin=2)
+
+    data = {
+        'dog': read('pos.csv'),
+        'sheep': read('sheep_pos.csv'),
+        'target': read('target_pos.csv')[0],
+    }
+    spawn_path = os.path.join(trial_path, 'spawn.csv')
+    if not os.path.exists(spawn_path):
+        return data
+
+    # Rows of the dogs and the sheep have different lengths
+    with open(spawn_path) as file:
+        rows = [np.array(row, dtype=float).reshape(-1, 2)
+                for row in csv.reader(file)]
+    data['spawn'] = dict(zip(SPAWN_ARRAYS, rows))
+    if headings:
+        for name in ['dog', 'sheep']:
+            data[name + '_dir'] = read(name + '_dir.csv').reshape(
+                data[name].shape)
+    return data
+
+
+class Catalog:
+    def __init__(self,
+                 data_dir: str,
+                 cache_file: Optional[str] = None,
+                 workers: Optional[int] = None):
+        """
+        Cached index of the trial folders in a data directory.
+
+        The trials are parsed once, in parallel, and stored in a cache file
+        with per-episode metadata and every trajectory in one array. The
+        cache is reused while the modification time of data_dir and of the
+        trials is unchanged, and only new or changed trials are parsed again.
+
+        Trajectories of every episode are stacked along the step axis, padded
+        with NaN up to the largest number of dogs and sheep. start_dog and
+        start_sheep hold the spawn positions, or the first saved positions
+        for trials saved before spawn.csv, padded the same way. success is
+        True where every sheep ends within TARGET_RADIUS of the target.
+
+        Args:
+            data_dir (str): Directory with one folder per trial
+            cache_file (Optional[str]): Where to keep the cache. Defaults to
+                <data_dir>.catalog.npz next to data_dir, so the data
+                directory itself only holds trials.
+            workers (Optional[int]): Processes used to parse trials. Defaults
+                to the number of CPUs.
+        """
+        self.data_dir = data_dir
+        self.cache_file = cache_file or \
+            os.path.normpath(data_dir) + '.catalog.npz'
+        self.workers = workers
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.trials)
+
+    def refresh(self):
+        """Load the cache, parsing any trials that are new or changed."""
+        dir_mtime = os.stat(self.data_dir).st_mtime_ns
+        cached = self._load_cache()
+        if cached is not None and cached['dir_mtime'] == dir_mtime:
+            self._set(cached)
+            return
+
+        names = trial_names(self.data_dir)
+        mtimes = np.array([
+            os.stat(os.path.join(self.data_dir, name)).st_mtime_ns
+            for name in names], dtype=np.int64)
+
+        # Reuse trials whose folder did not change
+        old = {}
+        if cached is not None:
+            for i, trial in enumerate(cached['trials']):
+                old[int(trial)] = (cached['mtimes'][i], i)
+
+        episodes = [None] * len(names)
+        stale = []
+        for i, name in enumerate(names):
+            if old.get(int(name), (None,))[0] == mtimes[i]:
+                episodes[i] = self._episode(cached, old[int(name)][1])
+            else:
+                stale.append(i)
+
+        paths = [os.path.join(self.data_dir, names[i]) for i in stale]
+        if len(paths) > 1:
+            with ProcessPoolExecutor(self.workers) as pool:
+                loaded = list(pool.map(load_trial, paths, chunksize=16))
+        else:
+            loaded = [load_trial(path) for path in paths]
+        for i, episode in zip(stale, loaded):
+            episodes[i] = episode
+
+        data = self._consolidate(episodes)
+        data['trials'] = np.array([int(name) for name in names], dtype=int)
+        data['mtimes'] = mtimes
+        data['dir_mtime'] = dir_mtime
+        self._save_cache(data)
+        self._set(data)
+
+    def select(self, start: int = 0, end: Optional[int] = None,
+               target: Optional[np.ndarray] = None,
+               radius: float = 1) -> np.ndarray:
+        """
+        Pick episodes by position in the sorted trial list and goal location.
+
+        Args:
+            start (int): First episode, as used by the visualizers.
+                Defaults to 0
+            end (Optional[int]): Episode to stop at. If None, go to the end.
+                Defaults to None.
+            target (Optional[np.ndarray]): Only keep episodes with their
+                target within radius of this location. Defaults to None.
+            radius (float): Distance used with target. Defaults to 1
+
+        Returns:
+            np.ndarray: Episode indices
+        """
+        idx = np.arange(len(self))[start:end]
+        if target is not None:
+            close = np.linalg.norm(self.targets[idx] - target, axis=1)
+            idx = idx[close <= radius]
+        return idx
+
+    def dog(self, idx: int) -> np.ndarray:
+        """Dog trajectory of one episode, shape (T, D, 2)."""
+        steps = self.dog_pos[self.offsets[idx]:self.offsets[idx+1]]
+        return steps[:, :2*self.num_dog[idx]].reshape(len(steps), -1, 2)
+
+    def sheep(self, idx: int) -> np.ndarray:
+        """Sheep trajectory of one episode, shape (T, S, 2)."""
+        steps = self.sheep_pos[self.offsets[idx]:self.offsets[idx+1]]
+        return steps[:, :2*self.num_sheep[idx]].reshape(len(steps), -1, 2)
+
+    def _set(self, data: Dict[str, np.ndarray]):
+        """Expose the arrays of the catalog as attributes."""
+        self.trials = data['trials']
+        self.mtimes = data['mtimes']
+        self.offsets = data['offsets']
+        self.lengths = np.diff(self.offsets)
+        self.num_dog = data['num_dog']
+        self.num_sheep = data['num_sheep']
+        self.targets = data['targets']
+        self.dog_pos = data['dog_pos']
+        self.sheep_pos = data['sheep_pos']
+        self.start_dog = data['start_dog']
+        self.start_sheep = data['start_sheep']
+
+        # Final sheep positions, NaN padding counts as in the target
+        last = self.sheep_pos[np.maximum(self.offsets[1:] - 1, 0)]
+        last = last.reshape(len(last), -1 if len(last) else 0, 2) - \
+            self.targets[:, None]
+        outside = np.hypot(last[..., 0], last[..., 1]) > TARGET_RADIUS
+        self.success = (self.lengths > 0) & ~outside.any(axis=1)
+
+    def _episode(self, data: Dict[str, np.ndarray],
+                 idx: int) -> Dict[str, np.ndarray]:
+        """Take one episode back out of consolidated arrays."""
+        steps = slice(data['offsets'][idx], data['offsets'][idx+1])
+        widths = {'dog': 2*data['num_dog'][idx],
+                  'sheep': 2*data['num_sheep'][idx]}
+        episode = {name: data[name + '_pos'][steps, :width]
+                   for name, width in widths.items()}
+        episode['target'] = data['targets'][idx]
+        episode['spawn'] = {
+            name: data['start_' + name][idx, :width].reshape(-1, 2)
+            for name, width in widths.items()}
+        return episode
+
+    def _consolidate(self, episodes: list) -> Dict[str, np.ndarray]:
+        """Stack per-episode arrays into catalog arrays."""
+        lengths = [len(episode['dog']) for episode in episodes]
+        data = {
+            'offsets': np.concatenate([[0], np.cumsum(lengths)]).astype(int),
+            'num_dog': np.array([episode['dog'].shape[1] // 2
+                                 for episode in episodes], dtype=int),
+            'num_sheep': np.array([episode['sheep'].shape[1] // 2
+                                   for episode in episodes], dtype=int),
+            'targets': np.array([episode['target'] for episode in episodes],
+                                dtype=float).reshape(-1, 2),
+        }
+        for name in ['dog', 'sheep']:
+            width = max([episode[name].shape[1] for episode in episodes],
+                        default=0)
+            stacked = np.full((sum(lengths), width), np.nan)
+            starts = np.full((len(episodes), width), np.nan)
+            for i, (start, episode) in enumerate(zip(data['offsets'],
+                                                     episodes)):
+                values = episode[name]
+                stacked[start:start+len(values), :values.shape[1]] = values
+                # Trials saved before spawn.csv start at their first sample
+                if 'spawn' in episode:
+                    first = episode['spawn'][name].ravel()
+                else:
+                    first = values[0] if len(values) else []
+                starts[i, :len(first)] = first
+            data[name + '_pos'] = stacked
+            data['start_' + name] = starts
+        return data
+
+    def _load_cache(self) -> Optional[Dict[str, np.ndarray]]:
+        """Read the cache file, if it exists and is for this version."""
+        if not os.path.exists(self.cache_file):
+            return None
+        with np.load(self.cache_file) as cache:
+            data = dict(cache)
+        info = json.loads(str(data.pop('info')))
+        if info['version'] != CATALOG_VERSION:
+            return None
+        data['dir_mtime'] = info['dir_mtime']
+        return data
+
+    def _save_cache(self, data: Dict[str, np.ndarray]):
+        """Write the cache file in one step."""
+        arrays = {key: value for key, value in data.items()
+                  if key != 'dir_mtime'}
+        arrays['info'] = json.dumps({'version': CATALOG_VERSION,
+                                     'dir_mtime': data['dir_mtime']})
+        tmp = self.cache_file + '.tmp'
+        with open(tmp, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(tmp, self.cache_file)
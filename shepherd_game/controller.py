@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+
+def state_observation(game) -> Dict[str, np.ndarray]:
+    """
+    Copy the positions of a game for a policy.
+
+    Args:
+        game (Game): Game to observe
+
+    Returns:
+        Dict[str, np.ndarray]: 'dog', 'sheep' and 'target' positions
+    """
+    return {
+        'dog': game.dog.copy(),
+        'sheep': game.sheep.copy(),
+        'target': np.array(game.target, dtype=float),
+    }
+
+
+class Controller:
+    """
+    Source of dog actions for Game.run.
+
+    Pass an instance as Game(controller=...) to replace the joystick or
+    keyboard input.
+    """
+
+    def reset(self):
+        """Start a new episode. Called by Game.reset."""
+
+    def get_input(self, game):
+        """
+        Get the action for the next step.
+
+        Args:
+            game (Game): Game being played
+
+        Returns:
+            Dog movements, shape (D, 2), or False to stop the game
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release anything the controller holds. Called by Game.close."""
+
+
+class PolicyController(Controller):
+    def __init__(self,
+                 policy: Callable[[Any], np.ndarray],
+                 observe: Callable[[Any], Any] = state_observation,
+                 ensemble: Optional[float] = None,
+                 wait_first: bool = True):
+        """
+        Run a policy that predicts action chunks in a background thread.
+
+        Each step the latest observation is handed to the policy thread,
+        replacing any observation it has not started on yet, and the game
+        carries on right away. The policy returns a chunk of actions for the
+        steps starting at the step it observed. Actions for steps that
+        already passed while the policy was running are skipped, so the game
+        keeps its own rate whatever the inference time.
+
+        Args:
+            policy (Callable): Maps an observation to an action chunk, shape
+                (H, D, 2). Runs in the policy thread, so it should release
+                the GIL for heavy work, as NumPy and torch do
+            observe (Callable): Makes the observation from the game, run in
+                the game thread. Defaults to state_observation
+            ensemble (Optional[float]): If given, average the actions of
+                every chunk covering a step with weights exp(-ensemble * i),
+                i = 0 being the oldest chunk (temporal ensembling). If None,
+                use the newest chunk only. Defaults to None.
+            wait_first (bool): Wait for the first chunk of each episode
+                instead of standing still. Defaults to True
+        """
+        self.policy = policy
+        self.observe = observe
+        self.ensemble = ensemble
+        self.wait_first = wait_first
+
+        self.lock = threading.Condition()
+        self.request = None
+        self.chunks = deque()
+        self.episode = 0
+        self.steps = 0
+        self.latency = None
+        self.error = None
+        self.running = True
+
+        self.thread = threading.Thread(target=self._infer, daemon=True)
+        self.thread.start()
+
+    def reset(self):
+        """Drop the chunks of the last episode."""
+        with self.lock:
+            self.episode += 1
+            self.steps = 0
+            self.request = None
+            self.chunks.clear()
+
+    def get_input(self, game) -> np.ndarray:
+        """
+        Hand the current observation to the policy and get the next action.
+
+        Args:
+            game (Game): Game being played
+
+        Returns:
+            np.ndarray: Dog movements, shape (D, 2). Zero if no chunk covers
+                this step
+        """
+        observation = self.observe(game)
+        with self.lock:
+            self._check()
+            step = self.steps
+            self.steps += 1
+            self.request = (self.episode, step, observation)
+            self.lock.notify_all()
+
+            if self.wait_first and step == 0:
+                while not self.chunks and self.error is None:
+                    self.lock.wait()
+                self._check()
+
+            # Forget chunks that end before this step
+            while self.chunks and \
+                    self.chunks[0][0] + len(self.chunks[0][1]) <= step:
+                self.chunks.popleft()
+
+            actions = [chunk[step - start] for start, chunk in self.chunks
+                       if start <= step]
+
+        if not actions:
+            return np.zeros_like(game.dog)
+        if self.ensemble is None:
+            return np.array(actions[-1], dtype=float)
+
+        weights = np.exp(-self.ensemble * np.arange(len(actions)))
+        return np.tensordot(weights / weights.sum(), np.array(actions), 1)
+
+    def close(self):
+        """Stop the policy thread."""
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+        self.thread.join()
+
+    def _check(self):
+        """Raise errors from the policy thread in the game thread."""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _infer(self):
+        """Policy thread loop."""
+        while True:
+            with self.lock:
+                while self.running and self.request is None:
+                    self.lock.wait()
+                if not self.running:
+                    return
+                episode, step, observation = self.request
+                self.request = None
+
+            try:
+                start = time.perf_counter()
+                chunk = np.asarray(self.policy(observation), dtype=float)
+                latency = time.perf_counter() - start
+            except Exception as error:
+                with self.lock:
+                    self.error = error
+                    self.lock.notify_all()
+                continue
+
+            with self.lock:
+                # Chunks from before a reset are dropped
+                if episode == self.episode:
+                    self.chunks.append((step, chunk))
+                    self.latency = latency
+                    self.lock.notify_all()
@@ -1,25 +1,64 @@
-import csv
+import functools
+import importlib.util
+import json
 import math
 import os
 import time
-from typing import Optional
+from typing import Dict, List, Optional, Union
 
 import numpy as np
 import pygame
-from pygame.locals import *
 
 from shepherd_game import obstacles
+from shepherd_game.controller import Controller
 from shepherd_game.parameters import *
+from shepherd_game.profiler import PhaseTimer
+from shepherd_game.raster import BLACK, Rasterizer
+from shepherd_game.recorder import (EpisodeRecorder, TrajectoryLog,
+                                    TrialWriter)
+from shepherd_game.spatial import SpatialGrid
+from shepherd_game.sprites import SpriteRenderer
+from shepherd_game.state import GameState, HerdState, herd_property
+from shepherd_game.storage import ChunkWriter
+from shepherd_game.strombom import (MULTI_DOG, FlockScratch, combine_headings,
+                                    dog_repulsion, flock_headings, react_mask)
 from shepherd_game.utils import *
 
 FPS = 15
-fpsClock = pygame.time.Clock()
-OBSTACLE_COLOR = (139, 69, 19)
-WHITE = (255, 255, 255)
-BLACK = (0, 0, 0)
+GRID_MIN_SHEEP = 100  # flock size where the spatial grid beats a dense matrix
+GRAZE_BLOCK = 64  # dog passes to draw grazing for at once
+PROFILE_FILE = 'profile.jsonl'
+# numba is only imported once a compiled update runs
+JIT_AVAILABLE = importlib.util.find_spec('numba') is not None
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(size: int, bold: bool = False) -> pygame.font.Font:
+    """
+    Load the overlay font once per process.
+
+    Args:
+        size (int): Font size
+        bold (bool): Use the bold face. Defaults to False
+
+    Returns:
+        pygame.font.Font: The font
+    """
+    if not pygame.font.get_init():
+        pygame.font.init()
+    return pygame.font.SysFont('Consolas', size, bold)
 
 
 class Game:
+    # State arrays, kept in self.herd and only ever written in place
+    sheep = herd_property('sheep')
+    dog = herd_property('dog')
+    target = herd_property('target')
+    heading = herd_property('heading')
+    next_heading = herd_property('next_heading')
+    sheep_dir = herd_property('sheep_dir')
+    dog_dir = herd_property('dog_dir')
+
     def __init__(self,
                  save_dir: str = None,
                  display_time: bool = False,
@@ -30,7 +69,19 @@ class Game:
                  sheep_top_right: bool = True,
                  num_dog: int = 1,
                  num_sheep: int = 5,
-                 scaling: int = 5):
+                 scaling: int = 5,
+                 vectorized: bool = True,
+                 headless: bool = False,
+                 frame_scale: Optional[float] = None,
+                 save_format: str = 'trials',
+                 controller: Optional[Controller] = None,
+                 profile: bool = False,
+                 profile_overlay: bool = False,
+                 sample_every: int = 1,
+                 jit: Optional[bool] = None,
+                 multi_dog: str = 'nearest',
+                 save_frames: bool = True,
+                 dtype: type = np.float64):
         """
         Create a shepherding game instance.
 
@@ -41,7 +92,10 @@ class Game:
                 Defaults to False.
             start_run (Optional[int]): Which run number to start on.
                 Used with save_dir. Defaults to None.
-            seed (Optional[int]): Seed the sheep position. Defaults to None.
+            seed (Optional[int]): Seed the game. The sheep spawn at the same
+                position every episode, and the targets, dog spawns and
+                grazing follow their own reproducible streams. Defaults to
+                None.
             random_goal (bool): Randomize the goal location. Defaults to False.
             start_in_goal (bool): Start the shepherd in the goal location. If
                 False, the shepherd will spawn in the bottom left. Defaults to True.
@@ -50,24 +104,92 @@ class Game:
             num_dog (int): The number of dogs to spawn. Defaults to 1
             num_agents (int): The number of sheep to spawn. Defaults to 5
             scaling (int): Scaling factor for the pygame display. Defaults to 5
+            vectorized (bool): Update the whole herd at once with NumPy. If
+                False, use the per-sheep reference loop. Defaults to True
+            headless (bool): Run without initializing pygame, a window or any
+                input device. The game is driven by calling step, and frames
+                are drawn to an off-screen surface. Defaults to False
+            frame_scale (Optional[float]): Draw saved frames and observations
+                with the NumPy rasterizer at this many pixels per field unit,
+                1 being the original field size. If None, they are captured
+                from the pygame screen. Defaults to None.
+            save_format (str): How save_dir is written. 'trials' writes a
+                folder of CSVs and BMPs per trial, 'chunks' writes chunked
+                arrays readable with storage.EpisodeReader and
+                'chunks_compressed' also compresses them. Defaults to 'trials'
+            controller (Optional[Controller]): Source of actions for run,
+                such as a controller.PolicyController. If None, the joystick
+                or keyboard is used. Defaults to None.
+            profile (bool): Time the phases of the game loop with a
+                profiler.PhaseTimer, kept as self.profiler. The summary of
+                the last ended episode is kept as self.profile_summary, and
+                each saved one is appended to <save_dir>/profile.jsonl.
+                Defaults to False
+            profile_overlay (bool): Draw the rolling phase timings on the
+                window under the time. Turns on profile. Defaults to False
+            sample_every (int): Save one sample every this many steps, so
+                the dataset rate stays fixed when the simulation runs
+                faster. Defaults to 1
+            jit (Optional[bool]): Update the herd with the numba compiled
+                kernels in jit.py, falling back to NumPy for large flocks
+                without obstacles. The kernel runs as one 'herd' phase, so
+                its neighbors, visibility, graze and move phases are not
+                timed. The first compiled step of every process, worker
+                processes included, imports numba and loads the kernels
+                cached next to jit.py, about 0.25 s, or compiles them, a
+                few seconds, if there is no cache yet. If None, they are
+                used when numba is installed and profiling is off. Only
+                used if vectorized. Defaults to None.
+            multi_dog (str): How sheep react to several dogs. 'nearest'
+                flees the nearest dog that is within R_S and in sight, 'sum'
+                adds up the repulsion of all of them, both updating each
+                sheep once per step. 'sequential' updates the flock once per
+                dog, the original behavior. The same for one dog. Defaults
+                to 'nearest'
+            save_frames (bool): Save a frame with every sample. If False,
+                only the positions are saved and frames can be drawn again
+                from them with replay.EpisodeReplay. Defaults to True
+            dtype (type): Float type of the positions and headings.
+                np.float32 halves their size but no longer matches the
+                float64 reference exactly. Defaults to np.float64
         """
-        pygame.init()
         self.padding = np.array(PADDING)
+        self.headless = headless
+        self.show = RENDER and not headless
 
-        # Try to get the joystick, use keyboard if error
-        try:
-            self.joystick = pygame.joystick.Joystick(0)
-            self.get_input = self.get_joy_input
-        except pygame.error:
-            self.get_input = self.get_keyboard_input
-
-        if RENDER:
-            self.scale = scaling
-            x_size = FIELD_LENGTH+2*self.padding[0]
-            y_size = FIELD_LENGTH+2*self.padding[1]
+        self.controller = controller
+        if headless:
+            self.get_input = None
+        else:
+            # Only what the window and input need, pygame.init would also
+            # start audio. Fonts are loaded when the overlays first draw
+            pygame.display.init()
+            pygame.joystick.init()
+
+            # Try to get the joystick, use keyboard if error
+            try:
+                self.joystick = pygame.joystick.Joystick(0)
+                self.get_input = self.get_joy_input
+            except pygame.error:
+                self.get_input = self.get_keyboard_input
+
+        if controller is not None:
+            self.get_input = lambda: controller.get_input(self)
+
+        self.scale = scaling
+        x_size = FIELD_LENGTH+2*self.padding[0]
+        y_size = FIELD_LENGTH+2*self.padding[1]
+        self.rasterizer = None if frame_scale is None \
+            else Rasterizer(frame_scale)
+        if self.show:
             self.screen =\
                 pygame.display.set_mode((x_size * self.scale,
                                          y_size * self.scale))
+        else:
+            # Frames can still be drawn and saved without a display
+            self.screen = pygame.Surface((x_size * self.scale,
+                                          y_size * self.scale))
+        self.sprites = SpriteRenderer(self.screen, self.scale, self.padding)
 
         self.save = True if save_dir is not None else False
         self.trial = 0 if not start_run else start_run
@@ -78,95 +200,511 @@ class Game:
         self.num_agents = num_sheep
         self.num_nearest = self.num_agents-1
         self.num_dog = num_dog
+        if multi_dog not in MULTI_DOG:
+            raise ValueError(f"Unknown multi_dog mode {multi_dog}")
+        self.multi_dog = multi_dog
+        self.sheep_spawn = None
+        self.seed_rngs(seed)
+        self.vectorized = vectorized
+        if jit and not JIT_AVAILABLE:
+            raise ImportError("jit=True needs numba to be installed")
+        # Profiling keeps the NumPy update for its per phase timings
+        if jit is None:
+            jit = JIT_AVAILABLE and not (profile or profile_overlay)
+        self.jit = jit
+        self.grid = SpatialGrid(R_A)
         self.dir = save_dir
+        self.save_format = save_format
+        self.sample_every = sample_every
+        self.save_frames = save_frames
         if save_dir is not None:
             if not os.path.exists(self.dir):
                 os.mkdir(self.dir)
+            if save_format == 'trials':
+                writer = TrialWriter(self.dir)
+            elif save_format in ['chunks', 'chunks_compressed']:
+                writer = ChunkWriter(
+                    self.dir, compress=save_format == 'chunks_compressed')
+            else:
+                raise ValueError(f"Unknown save format {save_format}")
+            self.recorder = EpisodeRecorder(writer)
+        # Whether a trial has been started and not finished or dropped
+        self.recording = False
 
         self.display_time = display_time
+        self.profiler = PhaseTimer(profile or profile_overlay)
+        self.profile_summary = None
+        self.profile_overlay = profile_overlay
+
+        # State and scratch arrays are allocated once and updated in place
+        self.dtype = np.dtype(dtype)
+        self.herd = HerdState(num_dog, num_sheep, self.dtype)
+        self.sheep_idx = np.arange(num_sheep)
+        # Pairs of the dense update, grown to what the steps need
+        self.scratch = FlockScratch(self.dtype)
+        self.trajectory = TrajectoryLog(num_dog, num_sheep, self.dtype)
         self.reset()
 
     def reset(self):
         """Reset the game by randomizing locations."""
+        # Obstacle grid, only rebuilt if the obstacles changed
+        self.broadphase = obstacles.broadphase()
+
         # Score and data tracking
-        self.pos = []
-        self.img_list = []
-        self.sheep_pos = []
+        self.trajectory.clear()
+        self.sample_step = 0
+        self.screen_fresh = False
         self.start_time = time.time()
 
-        # Time display
-        self.font = pygame.font.SysFont('Consolas', 20, True)
-        self.start_time = pygame.time.get_ticks()
-
-        np.random.seed(self.seed)
+        # Same sheep spawn every episode when seeded
+        if self.seed is not None:
+            if self.sheep_spawn is None:
+                self.sheep_spawn = np.random.default_rng(
+                    np.random.SeedSequence(self.seed).spawn(1)[0]
+                ).bit_generator.state
+            self.sheep_rng.bit_generator.state = self.sheep_spawn
         if self.sheep_top_right:
             # Randomely place the sheep in the top right quarter
-            self.sheep = np.random.rand(self.num_agents, 2)*FIELD_LENGTH/2
+            self.sheep[:] = self.sheep_rng.random((self.num_agents, 2)) * \
+                FIELD_LENGTH/2
             self.sheep[:, 0] += FIELD_LENGTH/2
         else:
             # Randomly place the sheep anywhere
-            self.sheep = np.random.rand(self.num_agents, 2)*FIELD_LENGTH
+            self.sheep[:] = self.sheep_rng.random((self.num_agents, 2)) * \
+                FIELD_LENGTH
         CoM = np.mean(self.sheep, axis=0)
-        np.random.seed(None)  # Reset the seed
 
         # Place the target
         if self.random_goal:
             # Randomize but make sure the game isn't "won"
-            self.target = np.random.rand(2)*FIELD_LENGTH/2
+            self.target[:] = self.target_rng.random(2)*FIELD_LENGTH/2
             self.target[1] += FIELD_LENGTH/2
-            while dist(CoM, self.target) < TARGET_RADIUS:
-                self.target = np.random.rand(2)*FIELD_LENGTH
+            while math.hypot(*(CoM - self.target)) < TARGET_RADIUS:
+                self.target[:] = self.target_rng.random(2)*FIELD_LENGTH
         else:
             # Bottom left corner
-            self.target = np.array([0, FIELD_LENGTH-1])
+            self.target[:] = [0, FIELD_LENGTH-1]
 
         if self.start_in_goal:
             # Randomly place the dog target circle
-            th = np.random.uniform(0, 2*np.pi)
-            r = TARGET_RADIUS * np.sqrt(np.random.uniform(0, 1))
-            self.dog = np.array([np.array([
-                r * np.cos(th) + self.target[0],  # x position
-                r * np.sin(th) + self.target[1]   # y position
-            ]) for _ in range(self.num_dog)])
+            th = self.dog_rng.uniform(0, 2*np.pi)
+            r = TARGET_RADIUS * np.sqrt(self.dog_rng.uniform(0, 1))
+            self.dog[:] = self.target + [r * math.cos(th), r * math.sin(th)]
         else:
             # Randomly place the dog in the bottom left corner
-            self.dog = np.random.rand(self.num_dog, 2)*FIELD_LENGTH/2
+            self.dog[:] = self.dog_rng.random((self.num_dog, 2)) * \
+                FIELD_LENGTH/2
             self.dog[:, 1] += FIELD_LENGTH/2
 
         # Heading arrays for sheep movement
-        self.heading = np.zeros_like(self.sheep)
+        self.heading.fill(0)
+        self.dog_dir.fill(0)
+        self.sheep_dir.fill(0)
 
-        self.dog_dir = np.zeros_like(self.dog)
-        self.sheep_dir = np.zeros_like(self.sheep)
+        # Drop an unfinished trial, the next one starts on the next step
+        if self.save and self.recording:
+            self.recorder.discard()
+        self.recording = False
+
+        if self.controller is not None:
+            self.controller.reset()
+
+        # Timings of an unfinished episode are not summarized
+        self.profiler.reset_episode()
 
     def step(self, direction):
         """
         Calculate one game step.
 
+        When saving, a sample is recorded every sample_every steps with the
+        frame from before its first step, the positions after its last step
+        and the dog movement summed over its steps.
+
         Args:
             direction (List): Movement direction of the dog
+
+        Returns:
+            bool: True if all the sheep are in the target
         """
         assert direction.shape == self.dog.shape, "Wrong number of actions"
-        next_heading = np.zeros_like(self.heading)
 
-        # Iterate for each dog
+        # Start streaming a trial from the state before its first step
+        if self.save and not self.recording:
+            self.recorder.start(self.trial, self._spawn())
+            self.recording = True
+
+        # Frame showing the state before this sample
+        if self.save and self.sample_step == 0:
+            self.sample_frame = None
+            if self.save_frames:
+                with self.profiler.phase('capture'):
+                    self.sample_frame = self.capture()
+            self.sample_action = np.zeros_like(self.dog)
+
+        with self.profiler.phase('herd'):
+            if self.vectorized:
+                self.update_herd(direction)
+            else:
+                self.update_herd_reference(direction)
+
+        if CLIP:
+            # Clip the locations to within the field
+            np.clip(self.dog, 0, FIELD_LENGTH-1, out=self.dog)
+            np.clip(self.sheep, 0, FIELD_LENGTH-1, out=self.sheep)
+
+        # Remember the last movement direction of each dog
+        moving = np.hypot(direction[:, 0], direction[:, 1]) > 0.1
+        self.dog_dir[moving] = direction[moving]
+
+        # The window no longer shows the current state
+        self.screen_fresh = False
+
+        # End game if all the sheep are inside the target radius
+        offsets = np.subtract(self.sheep, self.target, out=self.herd.offsets)
+        ended = bool(np.all(np.hypot(offsets[:, 0], offsets[:, 1])
+                            <= TARGET_RADIUS))
+
+        # Record positions and save frame once per sample, or when the
+        # episode ends part way through one
+        if self.save:
+            self.sample_action += direction
+            self.sample_step += 1
+            if self.sample_step == self.sample_every or ended:
+                self.trajectory.append(self.dog, self.sheep, self.dog_dir,
+                                       self.sheep_dir)
+                with self.profiler.phase('record'):
+                    self.recorder.record(self.dog, self.sheep,
+                                         self.sample_frame,
+                                         self.sample_action, self.dog_dir,
+                                         self.sheep_dir)
+                self.sample_step = 0
+
+        return ended
+
+    def seed_rngs(self,
+                  seed: Optional[Union[int, np.random.SeedSequence]] = None):
+        """
+        Give the sheep spawn, target, dog spawn and grazing their own
+        random generators.
+
+        Args:
+            seed (Optional[Union[int, np.random.SeedSequence]]): Seed of all
+                the generators. If None, they are seeded from the OS.
+                Defaults to None.
+        """
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        sheep, target, dog, graze = seed.spawn(4)
+        self.sheep_rng = np.random.default_rng(sheep)
+        self.target_rng = np.random.default_rng(target)
+        self.dog_rng = np.random.default_rng(dog)
+        self.graze_rng = np.random.default_rng(graze)
+
+        # Grazing draws are made for GRAZE_BLOCK dog passes at a time
+        self.graze_block = np.zeros((0, self.num_agents), dtype=bool)
+        self.graze_dir_block = np.zeros((0, self.num_agents, 2))
+        self.graze_pass = 0
+
+    def snapshot(self) -> GameState:
+        """
+        Copy the simulation state, random generators included.
+
+        Costs as much as copying the positions and headings, so a game can be
+        forked many times per decision. Restoring the snapshot into this or
+        another game with the same number of sheep and dogs gives the same
+        steps as the original. Obstacles, recording and pygame state are not
+        part of it.
+
+        Returns:
+            GameState: Copy of the state
+        """
+        return GameState.capture(
+            self, graze=(self.graze_block[self.graze_pass:].copy(),
+                         self.graze_dir_block[self.graze_pass:].copy()))
+
+    def restore(self, state: GameState):
+        """
+        Go back to a snapshot.
+
+        A trial being saved is not rewound, steps after the restore are
+        recorded after the ones before it.
+
+        Args:
+            state (GameState): Snapshot taken with snapshot
+        """
+        if state.graze is None or state.sheep.ndim != 2:
+            raise ValueError("Not a snapshot of a Game")
+        state.apply(self)
+        state.apply_rngs(self)
+        self.graze_block = state.graze[0].copy()
+        self.graze_dir_block = state.graze[1].copy()
+        self.graze_pass = 0
+        self.screen_fresh = False
+
+    def dog_passes(self) -> List[np.ndarray]:
+        """
+        Groups of dogs the flock is updated for, one pass per group.
+
+        Returns:
+            List[np.ndarray]: Dog indices of each pass, one pass per dog if
+                multi_dog is 'sequential', otherwise one pass for all dogs
+        """
+        if self.multi_dog == 'sequential':
+            return [np.array([idx]) for idx in range(self.num_dog)]
+        return [np.arange(self.num_dog)]
+
+    def threats(self, dogs: np.ndarray) -> np.ndarray:
+        """
+        Find which dogs each sheep reacts to.
+
+        Args:
+            dogs (np.ndarray): Dog positions, shape (D, 2)
+
+        Returns:
+            np.ndarray: True where the dog is within R_S of the sheep and in
+                sight, shape (S, D)
+        """
+        threat = react_mask(self.sheep, dogs).T
+
+        # Only sheep close enough to react need a sight check
+        sheep_i, dog_i = np.nonzero(threat)
+        seen = self.visibility(self.sheep[sheep_i], dogs[dog_i])
+        if seen is not None:
+            threat[sheep_i, dog_i] = seen
+        return threat
+
+    def graze_draws(self):
+        """
+        Get the grazing draws for one pass over the flock.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Whether each sheep grazes if it
+                does not react, shape (S,), and its unit grazing
+                direction, shape (S, 2)
+        """
+        if self.graze_pass == len(self.graze_block):
+            shape = (GRAZE_BLOCK, self.num_agents)
+            self.graze_block = self.graze_rng.random(shape) < GRAZE
+            self.graze_dir_block = unit_vects(
+                self.graze_rng.random(shape + (2,)) - .5)
+            self.graze_pass = 0
+
+        self.graze_pass += 1
+        return self.graze_block[self.graze_pass-1], \
+            self.graze_dir_block[self.graze_pass-1]
+
+    def update_herd(self, direction: np.ndarray):
+        """
+        Move the dogs and the sheep, updating the whole herd at once.
+
+        Gives the same result as update_herd_reference for the same seed, up
+        to floating point rounding. Grazing still moves the sheep
+        in index order, so a reacting sheep sees the grazed position of every
+        sheep before it. Large flocks without obstacles use the spatial grid
+        instead of a distance matrix for neighbor searches, other herds use
+        the compiled kernel when jit is on.
+
+        Args:
+            direction (np.ndarray): Movement direction of each dog
+        """
+        sheep_idx = self.sheep_idx
+        use_grid = self.num_agents >= GRID_MIN_SHEEP and \
+            self.broadphase.num == 0
+        if self.jit and not use_grid:
+            self.update_herd_jit(direction)
+            return
+
+        next_heading = self.next_heading
+        next_heading.fill(0)
+
+        # Dogs only move themselves, so they can all move before the sheep
+        timer = self.profiler
+        with timer.phase('move'):
+            self.move_all(self.dog, direction, out=self.dog)
+
+        for dog_idx in self.dog_passes():
+            dogs = self.dog[dog_idx]
+            with timer.phase('visibility'):
+                threat = self.threats(dogs)
+                react = np.any(threat, axis=1)
+
+            # Random chance of moving in any direction / Grazing
+            with timer.phase('graze'):
+                start = self.herd.start
+                np.copyto(start, self.sheep)
+                graze, graze_dir = self.graze_draws()
+                grazed = np.nonzero(~react & graze)[0]
+                self.sheep[grazed] = self.move_all(self.sheep[grazed],
+                                                   graze_dir[grazed])
+
+            react_idx = sheep_idx[react]
+            if len(react_idx) == 0:
+                continue
+            dog_repul = dog_repulsion(self.sheep[react_idx], dogs,
+                                      threat[react_idx], self.multi_dog)
+
+            if use_grid:
+                with timer.phase('neighbors'):
+                    heading = self.grid_headings(
+                        start, react_idx, grazed, dog_repul)
+            else:
+                # Sheep grazed earlier in this pass are seen at their new spot
+                flock = self.sheep
+                if len(grazed):
+                    pairs = (len(react_idx), self.num_agents)
+                    before = np.less(sheep_idx, react_idx[:, None],
+                                     out=self.scratch.get('before', pairs))
+                    flock = self.scratch.get('flock', pairs + (2,))
+                    np.copyto(flock, start)
+                    np.copyto(flock, self.sheep, where=before[..., None])
+
+                sheep = self.sheep[react_idx]
+                with timer.phase('visibility'):
+                    visible = self.visibility(sheep[:, None], flock)
+                with timer.phase('neighbors'):
+                    heading = flock_headings(
+                        sheep, flock, react_idx, dog_repul,
+                        self.heading[react_idx], self.num_nearest, visible,
+                        self.scratch)
+
+            next_heading[react_idx] += heading
+            self.sheep_dir[react_idx] = next_heading[react_idx]
+
+        # Update sheep location with obstacle clipping
+        with timer.phase('move'):
+            movement = unit_vects(next_heading, out=self.herd.movement)
+            movement *= S_Speed
+            self.move_all(self.sheep, movement, out=self.sheep)
+
+        # Update heading for next iteration, reusing the old one next step
+        self.herd.swap_headings()
+
+    def update_herd_jit(self, direction: np.ndarray):
+        """
+        Move the dogs and the sheep with the compiled reference loop.
+
+        Args:
+            direction (np.ndarray): Movement direction of each dog
+        """
+        # Imported here so numba is only loaded when it is used
+        from shepherd_game import jit as jit_kernels
+
+        draws = [self.graze_draws() for _ in self.dog_passes()]
+        graze = np.array([draw[0] for draw in draws])
+        graze_dir = np.array([draw[1] for draw in draws])
+
+        jit_kernels.herd_step(
+            self.sheep, self.dog, np.asarray(direction, dtype=self.dtype),
+            self.heading, self.next_heading, self.sheep_dir, graze,
+            graze_dir, self.broadphase.kernel_args(),
+            MULTI_DOG.index(self.multi_dog))
+        self.herd.swap_headings()
+
+    def grid_headings(self,
+                      start: np.ndarray,
+                      react_idx: np.ndarray,
+                      grazed_idx: np.ndarray,
+                      dog_repul: np.ndarray) -> np.ndarray:
+        """
+        Calculate the heading of reacting sheep using the spatial grid.
+
+        Both the start and grazed position of every grazed sheep are indexed.
+        A reacting sheep sees the grazed position of the sheep before it and
+        the start position of the rest, the same as the dense update.
+
+        Args:
+            start (np.ndarray): Sheep positions before grazing, shape (S, 2)
+            react_idx (np.ndarray): Index of the reacting sheep, shape (R,)
+            grazed_idx (np.ndarray): Index of the grazed sheep, in order
+            dog_repul (np.ndarray): Repulsion from the dogs, shape (R, 2)
+
+        Returns:
+            np.ndarray: Next heading of the reacting sheep, shape (R, 2)
+        """
+        sheep = start[react_idx]
+        points = np.concatenate([start, self.sheep[grazed_idx]])
+        point_id = np.concatenate([self.sheep_idx, grazed_idx])
+        is_grazed = np.zeros(self.num_agents, dtype=bool)
+        is_grazed[grazed_idx] = True
+        is_moved = np.arange(len(points)) >= self.num_agents
+
+        def seen_by(rows, point_idx):
+            """Check if the indexed point is what each row's sheep sees."""
+            before = point_id[point_idx] < react_idx[rows]
+            return np.where(is_moved[point_idx], before,
+                            ~(before & is_grazed[point_id[point_idx]])) & \
+                (point_id[point_idx] != react_idx[rows])
+
+        self.grid.build(points)
+
+        # Local repulsion from sheep within R_A
+        rows, point_idx, _ = self.grid.query_radius(sheep, R_A)
+        keep = seen_by(rows, point_idx)
+        rows, point_idx = rows[keep], point_idx[keep]
+        away = unit_vects(sheep[rows] - points[point_idx])
+        local_repul = np.stack([
+            np.bincount(rows, away[:, 0], minlength=len(react_idx)),
+            np.bincount(rows, away[:, 1], minlength=len(react_idx)),
+        ], axis=-1)
+
+        # The LCM is over every other sheep, as num_nearest is always the
+        # rest of the flock, so it comes from prefix sums
+        moved = np.where(is_grazed[:, None], self.sheep, start)
+        start_sum = np.cumsum(start, axis=0) - start
+        moved_sum = np.cumsum(moved, axis=0) - moved
+        total = start_sum[-1] + start[-1]
+        flock_sum = moved_sum[react_idx] + \
+            (total - start_sum[react_idx]) - sheep
+        count = np.full(len(react_idx), self.num_agents - 1)
+        lcm = flock_sum / np.maximum(count, 1)[:, None]
+
+        return combine_headings(sheep, lcm, count > 0, local_repul,
+                                dog_repul, self.heading[react_idx])
+
+    def update_herd_reference(self, direction: np.ndarray):
+        """
+        Move the dogs and the sheep one sheep at a time.
+
+        This is the original per-sheep loop, kept as the reference
+        implementation for the vectorized update.
+
+        Args:
+            direction (np.ndarray): Movement direction of each dog
+        """
+        next_heading = self.next_heading
+        next_heading.fill(0)
+
+        # Add direction to the coordinates
+        # Update dog position but don't overwrite the reference to self.dog
         for idx, dog in enumerate(self.dog):
-            # Add direction to the coordinates
-            # Update dog position but don't overwrite the reference to self.dog
             dog[:] = self.calculate_movement(dog, direction[idx])
 
+        # Iterate for each dog, or once for all of them
+        for dog_idx in self.dog_passes():
+            graze, graze_dir = self.graze_draws()
+
             # Iterate through each sheep to calculate movement
             for i, sheep in enumerate(self.sheep):
-                # if sheep is far from dog or if sheep cannot see dog
-                if (dist(sheep, dog) > R_S) or self.cannot_see(sheep, dog):
+                # Dogs that are close to the sheep and that it can see
+                threats = [self.dog[k] for k in dog_idx
+                           if dist(sheep, self.dog[k]) <= R_S and
+                           not self.cannot_see(sheep, self.dog[k])]
+
+                # if sheep is far from every dog or cannot see them
+                if not threats:
                     # Random chance of moving in any direction / Grazing
-                    if np.random.rand() < GRAZE:
-                        sheep[:] = self.calculate_movement(sheep, rand_unit())
+                    if graze[i]:
+                        sheep[:] = self.calculate_movement(sheep, graze_dir[i])
 
-                # if sheep is close to dog, calculate movement
+                # if sheep is close to a dog, calculate movement
                 else:
-                    # repulsion direction away from shepherd
-                    dog_repul = unit_vect(sheep, dog)
+                    # repulsion direction away from the shepherds
+                    if self.multi_dog == 'nearest':
+                        dog = min(threats, key=lambda x: dist(sheep, x))
+                        dog_repul = unit_vect(sheep, dog)
+                    else:
+                        dog_repul = sum(unit_vect(sheep, dog)
+                                        for dog in threats)
 
                     # Sort sheep based on distance
                     nearest_sheep = sorted(
@@ -216,26 +754,7 @@ class Game:
                 self.sheep[idx], S_Speed*unit_vect(next_heading[idx]))
 
         # Update heading for next iteration
-        self.heading = next_heading
-
-        if CLIP:
-            # Clip the locations to within the field
-            self.dog = self.dog.clip(0, FIELD_LENGTH-1)
-            self.sheep = self.sheep.clip(0, FIELD_LENGTH-1)
-
-        # Record positions and save frame
-        if self.save:
-            self.pos.append([pos for dog in self.dog for pos in dog])
-            self.sheep_pos.append(
-                [pos for sheep in self.sheep for pos in sheep])
-            self.img_list.append(pygame.surfarray.array3d(self.screen))
-
-        for sheep in self.sheep:
-            if dist(sheep, self.target) > TARGET_RADIUS:
-                return False
-
-        # End game if all the sheep are inside the target radius
-        return True
+        self.herd.swap_headings()
 
     def get_joy_input(self):
         """Key key inputs for game controls using joystick."""
@@ -250,16 +769,11 @@ class Game:
         x = self.joystick.get_axis(3)
         y = self.joystick.get_axis(4)
 
-        # Build movement based on num dog
-        if self.num_dog == 1:
-            move = np.array([[x, y]])
-        elif self.num_dog == 2:
-            move = np.array([
-                [x, y],
-                [self.joystick.get_axis(0), self.joystick.get_axis(1)]
-            ])
-        else:
-            raise NotImplementedError
+        # The first two dogs follow the sticks, any others stand still
+        move = np.zeros((self.num_dog, 2))
+        move[0] = [x, y]
+        if self.num_dog > 1:
+            move[1] = [self.joystick.get_axis(0), self.joystick.get_axis(1)]
 
         return move * D_Speed
 
@@ -278,10 +792,11 @@ class Game:
         if keys[pygame.K_UP]:
             y -= D_Speed
 
-        # Build movement based on num dog
-        if self.num_dog == 1:
-            move = np.array([[x, y]])
-        elif self.num_dog == 2:
+        # The first two dogs follow the arrows and WASD, any others stand
+        # still
+        move = np.zeros((self.num_dog, 2))
+        move[0] = [x, y]
+        if self.num_dog > 1:
             x2, y2 = 0, 0
             if keys[pygame.K_d]:
                 x2 += D_Speed
@@ -291,12 +806,7 @@ class Game:
                 x2 -= D_Speed
             if keys[pygame.K_w]:
                 y2 -= D_Speed
-            move = np.array([
-                [x, y],
-                [x2, y2]
-            ])
-        else:
-            raise NotImplementedError
+            move[1] = [x2, y2]
 
         # Reset
         if keys[pygame.K_r]:
@@ -320,18 +830,42 @@ class Game:
         Returns:
             bool: True if there are obstacles directly in between
         """
-        # Check line obstacles
-        for line in obstacles.lines:
-            if line_intersects(point1, point2, line.start, line.end):
-                return True
-
-        # Check circle obstacles
-        for circle in obstacles.circles:
-            if circle_intersects(point1, point2, circle.center, circle.radius):
-                return True
+        grid = self.broadphase
+        for idx in grid.query(point1, point2):
+            if idx < grid.num_lines:
+                # Check line obstacles
+                if line_intersects(point1, point2,
+                                   grid.starts[idx], grid.ends[idx]):
+                    return True
+            else:
+                # Check circle obstacles
+                idx -= grid.num_lines
+                if circle_intersects(point1, point2,
+                                     grid.centers[idx], grid.radii[idx]):
+                    return True
 
         return False
 
+    def visibility(self,
+                   points1: np.ndarray,
+                   points2: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Check which pairs of objects (sheep or dog) can see each other.
+
+        Args:
+            points1 (np.ndarray): Objects, shape (..., 2)
+            points2 (np.ndarray): Objects, broadcastable against points1
+
+        Returns:
+            Optional[np.ndarray]: True where the pair can see each other.
+                None if there are no obstacles, so everything can be seen
+        """
+        if self.broadphase.num == 0:
+            return None
+
+        # Only pairs sharing a grid cell with an obstacle are tested
+        return ~self.broadphase.blocked(points1, points2)
+
     def calculate_movement(self,
                            start: np.ndarray,
                            movement: np.ndarray) -> np.ndarray:
@@ -347,33 +881,63 @@ class Game:
         """
         end = start + movement
 
-        # Check line obstacles
-        for line in obstacles.lines:
-            if line_intersects(start, end, line.start, line.end):
+        grid = self.broadphase
+        for idx in grid.query(start, end):
+            if idx < grid.num_lines:
+                # Check line obstacles
+                line_start, line_end = grid.starts[idx], grid.ends[idx]
+                if not line_intersects(start, end, line_start, line_end):
+                    continue
+
                 # Projection of movement onto the line obstacle
                 vec_movement = np.array([end[0] - start[0], end[1] - start[1]])
-                vec_obstacle = np.array(
-                    [line.end[0] - line.start[0], line.end[1] - line.start[1]])
+                vec_obstacle = line_end - line_start
                 proj = np.dot(vec_movement, vec_obstacle) / \
                     np.linalg.norm(vec_obstacle)
 
                 # Calculate new position by getting the projection vector and adding to start
                 return start + (proj * unit_vect(vec_obstacle))
 
-        # Check circle obstacles
-        for circle in obstacles.circles:
-            if circle_intersects(start, end, circle.center, circle.radius):
+            # Check circle obstacles
+            idx -= grid.num_lines
+            center, radius = grid.centers[idx], grid.radii[idx]
+            if circle_intersects(start, end, center, radius):
                 # Calculate collision slide
-                coll_ang = math.atan2(
-                    end[1] - circle.center[1], end[0] - circle.center[0])
+                coll_ang = math.atan2(end[1] - center[1], end[0] - center[0])
 
                 return np.array([
-                    circle.center[0] + circle.radius * math.cos(coll_ang),
-                    circle.center[1] + circle.radius * math.sin(coll_ang),
+                    center[0] + radius * math.cos(coll_ang),
+                    center[1] + radius * math.sin(coll_ang),
                 ])
 
         return end
 
+    def move_all(self,
+                 starts: np.ndarray,
+                 movements: np.ndarray,
+                 out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Calculate movement for many objects after checking for collisions.
+
+        Args:
+            starts (np.ndarray): Starting points, shape (N, 2)
+            movements (np.ndarray): Directions of travel, shape (N, 2)
+            out (Optional[np.ndarray]): Array to write the new positions
+                into, such as starts. Defaults to None.
+
+        Returns:
+            np.ndarray: New positions, shape (N, 2)
+        """
+        if self.broadphase.num == 0:
+            return np.add(starts, movements, out=out)
+
+        # One batched query for every object
+        ends = self.broadphase.move(starts, movements)
+        if out is None:
+            return ends
+        out[:] = ends
+        return out
+
     def render(self, draw: bool = True):
         """
         Render the game window.
@@ -381,49 +945,71 @@ class Game:
         Args:
             draw (bool): Update the pygame display. Defaults to True
         """
-        self.screen.fill((19, 133, 16))
-
-        # Target
-        target_loc = (self.padding + self.target) * self.scale
-        pygame.draw.circle(self.screen, BLACK, target_loc,
-                           TARGET_RADIUS * self.scale, 0)
-
-        # Dog
-        for idx, each in enumerate(self.dog):
-            pos = (self.padding + each) * self.scale
-            head = self.dog_dir[idx] * self.scale + pos
-            pygame.draw.circle(self.screen, (25, 25, 255),
-                               pos, self.scale + 2, 0)
-            pygame.draw.polygon(self.screen, (25, 25, 255),
-                                triangle(pos, head, self.scale+2))
-
-        # Sheep
-        for idx, each in enumerate(self.sheep):
-            pos = (self.padding + each) * self.scale
-            head = self.sheep_dir[idx] * self.scale + pos
-            pygame.draw.circle(self.screen, WHITE,
-                               pos, self.scale + 2, 0)
-            pygame.draw.polygon(self.screen, WHITE,
-                                triangle(pos, head, self.scale+2))
-
-        # Draw obstacles
-        for circle in obstacles.circles:
-            pygame.draw.circle(self.screen, OBSTACLE_COLOR, tuple(
-                circle.center + self.padding), circle.radius)
-
-        for line in obstacles.lines:
-            pygame.draw.aaline(self.screen, OBSTACLE_COLOR, tuple(
-                line.start + self.padding), tuple(line.end + self.padding))
+        with self.profiler.phase('render'):
+            self.draw()
+        self.screen_fresh = True
 
         # Time
-        if self.display_time:
-            time_passed = (pygame.time.get_ticks() - self.start_time)/1000
+        if self.display_time and not self.headless:
+            time_passed = round(time.time() - self.start_time, 3)
             message = 'Seconds: ' + str(time_passed)
-            self.screen.blit(self.font.render(message, True, BLACK), (0, 0))
+            self.sprites.add([self.screen.blit(
+                get_font(20, True).render(message, True, BLACK), (0, 0))])
+
+        # Phase timings under the time
+        if self.profile_overlay and not self.headless:
+            for row, message in enumerate(self.profiler.lines()):
+                self.sprites.add([self.screen.blit(
+                    get_font(14).render(message, True, BLACK),
+                    (0, 24 + 16*row))])
+
+        # Update only the areas that changed since the last update
+        if draw and self.show:
+            with self.profiler.phase('display'):
+                dirty = self.sprites.flush()
+                if dirty is None:
+                    pygame.display.update()
+                else:
+                    pygame.display.update(dirty)
+
+    def draw(self):
+        """Draw the game state onto the screen surface."""
+        self.sprites.draw(self.sheep, self.dog, self.target, self.sheep_dir,
+                          self.dog_dir, self.broadphase)
+
+    def observe(self) -> np.ndarray:
+        """
+        Draw the current game state and return it as an image.
+
+        Works with or without a window.
+
+        Returns:
+            np.ndarray: RGB pixels, indexed as [x, y]
+        """
+        if self.rasterizer is not None:
+            return self.rasterizer.render(self.sheep, self.dog, self.target,
+                                          self.sheep_dir, self.dog_dir).copy()
+
+        self.render(draw=False)
+        return pygame.surfarray.array3d(self.screen)
 
-        # Update display
-        if draw:
-            pygame.display.update()
+    def capture(self) -> np.ndarray:
+        """
+        Get the frame to save for the current game state.
+
+        With a window this is what is already on screen, redrawn off screen
+        first if steps ran since the last render, such as with render_every
+        or display_rate in run. Otherwise the frame is drawn the same way as
+        observe.
+
+        Returns:
+            np.ndarray: RGB pixels, indexed as [x, y]
+        """
+        if self.show and self.rasterizer is None:
+            if not self.screen_fresh:
+                self.render(draw=False)
+            return pygame.surfarray.array3d(self.screen)
+        return self.observe()
 
     def pygame_running(self):
         """
@@ -436,61 +1022,108 @@ class Game:
                 return False
         return True
 
+    @property
+    def pos(self) -> np.ndarray:
+        """Saved dog positions of the episode, shape (T, D*2)."""
+        return self.trajectory.dog.reshape(len(self.trajectory), -1)
+
+    @property
+    def sheep_pos(self) -> np.ndarray:
+        """Saved sheep positions of the episode, shape (T, S*2)."""
+        return self.trajectory.sheep.reshape(len(self.trajectory), -1)
+
     def save_data(self):
-        """Save the game data to a csv and images."""
-        self.data_path = self.dir + f'{self.trial}/'
-        self.img_path = self.data_path + "img/"
+        """
+        Save the game data to a csv and images.
+
+        The steps are already streamed to disk by the recorder, this finishes
+        the trial folder. The next trial starts on the next step.
+        """
+        if self.save_format == 'trials':
+            self.data_path = os.path.join(self.dir, str(self.trial))
+            self.img_path = os.path.join(self.data_path, 'img')
+        else:
+            self.data_path = self.dir
+
+        with self.profiler.phase('save_data'):
+            self.recorder.finish(self.target)
+        self.save_profile()
         self.trial += 1
+        self.recording = False
+
+    def _spawn(self) -> Dict[str, np.ndarray]:
+        """State shown by the frame of the next sample, for the recorder."""
+        return {'dog': self.dog, 'sheep': self.sheep, 'dog_dir': self.dog_dir,
+                'sheep_dir': self.sheep_dir}
+
+    def save_profile(self):
+        """
+        End the timing summary of the episode, keeping it as
+        profile_summary and appending it to <save_dir>/profile.jsonl when
+        saving.
+        """
+        if not self.profiler.enabled:
+            return
+
+        self.profile_summary = self.profiler.end_episode(trial=self.trial)
+        if self.save:
+            with open(os.path.join(self.dir, PROFILE_FILE), 'a') as file:
+                file.write(json.dumps(self.profile_summary) + '\n')
 
-        os.mkdir(self.data_path)
-        os.mkdir(self.img_path)
-
-        with open(self.data_path + 'pos.csv', 'w', newline=''
-                  )as csvfile:
-            row = np.round(self.pos[0], 3)
-            writer = csv.writer(csvfile)
-            writer.writerow(row)
-            print("total_data: ", len(self.pos))
-
-            # Iterate over each set of points
-            for i in range(1, len(self.pos)):
-                writer.writerow(np.round(self.pos[i], 3))
-
-        with open(self.data_path + 'sheep_pos.csv', 'w', newline=''
-                  )as csvfile:
-            row = np.round(self.sheep_pos[0], 3)
-            writer = csv.writer(csvfile)
-            writer.writerow(row)
-
-            # Iterate over each set of points
-            for i in range(1, len(self.sheep_pos)):
-                writer.writerow(np.round(self.sheep_pos[i], 3))
-
-        # Save the target
-        with open(self.data_path + 'target_pos.csv', 'w') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(self.target)
-
-        for idx, pix_array in enumerate(self.img_list):
-            img = pygame.surfarray.make_surface(pix_array)
-            pygame.image.save(img, self.img_path+f"{idx+1}.bmp")
-
-    def run(self):
-        """Main function for running the game."""
-        while not RENDER or self.pygame_running():
-            if RENDER:
+    def close(self):
+        """
+        Stop saving, dropping the episode that was not finished. A closed
+        game can no longer save, so stepping it with a save_dir raises
+        a RuntimeError.
+        """
+        if self.save:
+            self.recorder.close()
+        if self.controller is not None:
+            self.controller.close()
+
+    def run(self,
+            sim_rate: float = FPS,
+            turbo: bool = False,
+            render_every: int = 1,
+            display_rate: Optional[float] = None):
+        """
+        Main function for running the game.
+
+        The simulation runs on a fixed timestep of 1/sim_rate seconds. If a
+        step runs late the loop carries on from the current time instead of
+        rushing to catch up. Rendering is separate from stepping, so fast
+        runs can skip most frames.
+
+        Args:
+            sim_rate (float): Steps per second. Defaults to FPS
+            turbo (bool): Step as fast as possible, ignoring sim_rate.
+                Headless games are always in turbo. Defaults to False
+            render_every (int): Render at most once every this many steps.
+                Defaults to 1
+            display_rate (Optional[float]): Most renders per second. If None,
+                there is no limit. Defaults to None.
+        """
+        assert self.get_input is not None, "Headless games have no input"
+        turbo = turbo or self.headless
+        step_time = 1 / sim_rate
+        frame_time = 0 if display_rate is None else 1 / display_rate
+        next_step = next_frame = time.perf_counter()
+        steps = 0
+
+        while not self.show or self.pygame_running():
+            if self.show and steps % render_every == 0 and \
+                    time.perf_counter() >= next_frame:
                 self.render()
+                next_frame = time.perf_counter() + frame_time
 
             # Get key input
-            action = self.get_input()
+            with self.profiler.phase('input'):
+                action = self.get_input()
 
             if action is not False:
                 # Run each step of the game
                 ended = self.step(action)
-
-                for idx in range(action.shape[0]):
-                    if dist(action[idx]) > 0.1:
-                        self.dog_dir[idx] = action[idx]
+                steps += 1
             else:
                 # Close the game
                 break
@@ -500,12 +1133,21 @@ class Game:
                 if self.save:
                     self.save_data()
                     print(f"Data saved in {self.data_path}")
+                else:
+                    self.save_profile()
 
                 self.reset()
 
-            # Update the game clock
-            fpsClock.tick(FPS)
+            # Wait for the next step of the fixed timestep
+            if not turbo:
+                next_step += step_time
+                delay = next_step - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_step = time.perf_counter()
 
+        self.close()
 
 if __name__ == "__main__":
     # Game(save_dir=None, start_run=201, random_goal=False).run()
@@ -0,0 +1,155 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+
+from shepherd_game.game import Game
+from shepherd_game.policies import StrombomShepherd
+
+
+def next_run(save_dir: str) -> int:
+    """
+    First run number after every trial in save_dir, finished or not.
+
+    Args:
+        save_dir (str): Directory with one folder per trial
+
+    Returns:
+        int: Unused run number
+    """
+    if not os.path.exists(save_dir):
+        return 0
+    runs = [int(name.split('.')[0]) for name in os.listdir(save_dir)
+            if name.split('.')[0].isdigit()]
+    return max(runs, default=-1) + 1
+
+
+def run_worker(save_dir: str,
+               start_run: int,
+               num_episodes: int,
+               seed: np.random.SeedSequence,
+               max_steps: int,
+               game_kwargs: dict,
+               max_failures: Optional[int] = None) -> Dict[str, int]:
+    """
+    Record episodes of the scripted shepherd in one process.
+
+    Successful episodes are saved with run numbers start_run,
+    start_run + 1, ... Episodes that reach max_steps are dropped and run
+    again, until max_failures episodes have been dropped. The worker then
+    gives up, and the episodes it did not save are counted as missing.
+
+    Args:
+        save_dir (str): Directory to save to
+        start_run (int): Run number of the first saved episode
+        num_episodes (int): Episodes to save
+        seed (np.random.SeedSequence): Seed stream of this worker
+        max_steps (int): Steps before an episode is given up
+        game_kwargs (dict): Other arguments for Game
+        max_failures (Optional[int]): Dropped episodes before the worker
+            gives up. If None, it never does. Defaults to None
+
+    Returns:
+        Dict[str, int]: Number of saved, dropped and missing episodes and of
+            steps
+    """
+    game_seed, policy_seed = seed.spawn(2)
+    policy = StrombomShepherd(np.random.default_rng(policy_seed))
+
+    game = Game(save_dir=save_dir, start_run=start_run, headless=True,
+                **game_kwargs)
+    game.seed_rngs(game_seed)
+    stats = {'episodes': 0, 'dropped': 0, 'missing': 0, 'steps': 0}
+    while stats['episodes'] < num_episodes:
+        if max_failures is not None and stats['dropped'] >= max_failures:
+            stats['missing'] = num_episodes - stats['episodes']
+            break
+        game.reset()
+
+        for _ in range(max_steps):
+            stats['steps'] += 1
+            if game.step(policy.act(game.dog, game.sheep, game.target)):
+                game.save_data()
+                stats['episodes'] += 1
+                break
+        else:
+            stats['dropped'] += 1
+
+    game.close()
+    return stats
+
+
+def generate(save_dir: str,
+             num_episodes: int,
+             workers: Optional[int] = None,
+             seed: Optional[int] = None,
+             max_steps: int = 3000,
+             max_failures: Optional[int] = 100,
+             start_run: Optional[int] = None,
+             frame_scale: Optional[float] = 1,
+             **game_kwargs) -> Dict[str, int]:
+    """
+    Record a dataset of scripted shepherd episodes with many processes.
+
+    Every worker runs a headless Game driven by StrombomShepherd and saves
+    its episodes under its own block of run numbers, so trials of different
+    workers never collide. Each worker gets its own seed stream spawned from
+    seed.
+
+    With the 'trials' format all trials go into save_dir. The chunked
+    formats allow one run per directory, so each worker writes to
+    save_dir/worker<k>/.
+
+    Args:
+        save_dir (str): Directory to save to
+        num_episodes (int): Successful episodes to save
+        workers (Optional[int]): Worker processes. Defaults to the number of
+            CPUs.
+        seed (Optional[int]): Seed of the whole dataset. Defaults to None.
+        max_steps (int): Steps before an episode is given up and run again.
+            Defaults to 3000
+        max_failures (Optional[int]): Dropped episodes before a worker
+            gives up on the rest of its block, so a setup that never
+            succeeds cannot run forever. If None, workers never give up.
+            Defaults to 100
+        start_run (Optional[int]): Run number of the first episode. Defaults
+            to the number after the last trial in save_dir.
+        frame_scale (Optional[float]): Frame resolution, passed to Game.
+            Defaults to 1
+        **game_kwargs: Other arguments for Game, such as num_sheep or
+            random_goal
+
+    Returns:
+        Dict[str, int]: Number of saved, dropped and missing episodes and of
+            steps. Missing episodes were given up on after max_failures
+    """
+    workers = workers or os.cpu_count()
+    workers = max(min(workers, num_episodes), 1)
+    save_dir = os.path.join(save_dir, '')
+    os.makedirs(save_dir, exist_ok=True)
+    if start_run is None:
+        start_run = next_run(save_dir)
+    game_kwargs['frame_scale'] = frame_scale
+
+    # Split the episodes and run numbers into one block per worker
+    counts = np.full(workers, num_episodes // workers)
+    counts[:num_episodes % workers] += 1
+    starts = start_run + np.cumsum(counts) - counts
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    chunked = game_kwargs.get('save_format', 'trials') != 'trials'
+    dirs = [os.path.join(save_dir, f'worker{k}', '') if chunked else save_dir
+            for k in range(workers)]
+
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(
+            run_worker, dirs, starts.tolist(), counts.tolist(), seeds,
+            [max_steps] * workers, [game_kwargs] * workers,
+            [max_failures] * workers))
+
+    return {key: sum(result[key] for result in results)
+            for key in results[0]}
+
+
+if __name__ == "__main__":
+    print(generate("data/", 1000, seed=0, random_goal=True))
@@ -0,0 +1,252 @@
+import math
+
+import numpy as np
+
+from shepherd_game.parameters import P_A, P_C, P_H, P_S, R_A, R_S, S_Speed
+from shepherd_game.strombom import MULTI_DOG
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# The kernels are only compiled if numba is installed
+AVAILABLE = numba is not None
+
+# Indices of the multi_dog modes in strombom.MULTI_DOG
+NEAREST = MULTI_DOG.index('nearest')
+SEQUENTIAL = MULTI_DOG.index('sequential')
+
+
+def _njit(func):
+    """Compile a kernel with numba if it is installed."""
+    if AVAILABLE:
+        return numba.njit(cache=True)(func)
+    return func
+
+
+@_njit
+def _orientation(px, py, qx, qy, rx, ry):
+    """Orientation of the triplet (p, q, r), as utils.orientation."""
+    val = (qy - py) * (rx - qx) - (qx - px) * (ry - qy)
+    if val == 0:
+        return 0
+    return 1 if val > 0 else 2
+
+
+@_njit
+def _line_intersects(ax, ay, bx, by, cx, cy, dx, dy):
+    """Segment intersection, as utils.line_intersects."""
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+    return o1 != o2 and o3 != o4
+
+
+@_njit
+def _circle_intersects(ax, ay, bx, by, cx, cy, radius):
+    """Segment and circle intersection, as utils.circle_intersects."""
+    sx = bx - ax
+    sy = by - ay
+    mag = sx*sx + sy*sy
+    px, py = ax, ay
+    if mag != 0:
+        t = ((cx - ax)*sx + (cy - ay)*sy) / mag
+        if t > 1:
+            px, py = bx, by
+        elif t >= 0:
+            px, py = ax + t*sx, ay + t*sy
+    return (px - cx)**2 + (py - cy)**2 <= radius**2
+
+
+@_njit
+def _first_hit(ax, ay, bx, by, grid, any_hit):
+    """
+    First obstacle crossed by a segment, -1 if none.
+
+    Only the obstacles listed in the grid cells of the segment bounding
+    box are tested. Lines are numbered before circles, as in Broadphase.
+
+    Args:
+        ax, ay, bx, by (float): Segment from a to b
+        grid (tuple): Broadphase.kernel_args
+        any_hit (bool): Return the first hit found instead of the lowest
+            numbered one
+    """
+    starts, ends, centers, radii, origin, size, shape, cell_start, items = grid
+    num_lines = len(starts)
+    if num_lines + len(radii) == 0:
+        return -1
+
+    x0 = min(max(int((min(ax, bx) - origin[0]) // size), 0), shape[0] - 1)
+    x1 = min(max(int((max(ax, bx) - origin[0]) // size), 0), shape[0] - 1)
+    y0 = min(max(int((min(ay, by) - origin[1]) // size), 0), shape[1] - 1)
+    y1 = min(max(int((max(ay, by) - origin[1]) // size), 0), shape[1] - 1)
+
+    best = -1
+    for x in range(x0, x1 + 1):
+        for k in range(cell_start[x*shape[1] + y0],
+                       cell_start[x*shape[1] + y1 + 1]):
+            idx = items[k]
+            if best != -1 and idx >= best:
+                continue
+            if idx < num_lines:
+                hit = _line_intersects(ax, ay, bx, by,
+                                       starts[idx, 0], starts[idx, 1],
+                                       ends[idx, 0], ends[idx, 1])
+            else:
+                c = idx - num_lines
+                hit = _circle_intersects(ax, ay, bx, by, centers[c, 0],
+                                         centers[c, 1], radii[c])
+            if hit:
+                if any_hit:
+                    return idx
+                best = idx
+    return best
+
+
+@_njit
+def _cannot_see(ax, ay, bx, by, grid):
+    """Check for an obstacle between two points, as Game.cannot_see."""
+    return _first_hit(ax, ay, bx, by, grid, True) != -1
+
+
+@_njit
+def _unit(x, y):
+    """Unit vector, zero for a zero vector, as utils.unit_vect."""
+    norm = math.sqrt(x*x + y*y)
+    if norm == 0:
+        return 0.0, 0.0
+    return x / norm, y / norm
+
+
+@_njit
+def move(x, y, mx, my, grid):
+    """
+    Move a point, sliding along the first obstacle hit.
+
+    Same as Game.calculate_movement for one point.
+    """
+    ex = x + mx
+    ey = y + my
+    idx = _first_hit(x, y, ex, ey, grid, False)
+    if idx == -1:
+        return ex, ey
+
+    starts, ends, centers, radii = grid[0], grid[1], grid[2], grid[3]
+    if idx < len(starts):
+        ox = ends[idx, 0] - starts[idx, 0]
+        oy = ends[idx, 1] - starts[idx, 1]
+        proj = (mx*ox + my*oy) / math.sqrt(ox*ox + oy*oy)
+        ux, uy = _unit(ox, oy)
+        return x + proj*ux, y + proj*uy
+
+    c = idx - len(starts)
+    angle = math.atan2(ey - centers[c, 1], ex - centers[c, 0])
+    return centers[c, 0] + radii[c]*math.cos(angle), \
+        centers[c, 1] + radii[c]*math.sin(angle)
+
+
+@_njit
+def herd_step(sheep, dogs, direction, heading, next_heading, sheep_dir, graze,
+              graze_dir, grid, mode):
+    """
+    Move the dogs and the sheep in place, as Game.update_herd_reference.
+
+    Args:
+        sheep (np.ndarray): Sheep positions, shape (S, 2), updated
+        dogs (np.ndarray): Dog positions, shape (D, 2), updated
+        direction (np.ndarray): Movement of each dog, shape (D, 2)
+        heading (np.ndarray): Previous sheep headings, shape (S, 2)
+        next_heading (np.ndarray): Next sheep headings, shape (S, 2),
+            overwritten
+        sheep_dir (np.ndarray): Drawn sheep headings, shape (S, 2), updated
+        graze (np.ndarray): Grazing roll of each sheep per pass, shape (P, S)
+        graze_dir (np.ndarray): Unit grazing directions, shape (P, S, 2)
+        grid (tuple): Obstacle grid from Broadphase.kernel_args
+        mode (int): Index of the multi_dog mode in strombom.MULTI_DOG
+    """
+    num = len(sheep)
+    next_heading[:] = 0
+    dists = np.empty(num)
+
+    for d in range(len(dogs)):
+        dogs[d, 0], dogs[d, 1] = move(dogs[d, 0], dogs[d, 1],
+                                      direction[d, 0], direction[d, 1], grid)
+
+    # One pass per dog when sequential, otherwise one for all of them
+    sequential = mode == SEQUENTIAL
+    for p in range(len(graze)):
+        first = p if sequential else 0
+        last = p + 1 if sequential else len(dogs)
+
+        for i in range(num):
+            x, y = sheep[i, 0], sheep[i, 1]
+
+            # Repulsion from the dogs within R_S that are in sight
+            dog_x = dog_y = 0.0
+            nearest = np.inf
+            for d in range(first, last):
+                dist = math.sqrt((x - dogs[d, 0])**2 + (y - dogs[d, 1])**2)
+                if dist > R_S or \
+                        _cannot_see(x, y, dogs[d, 0], dogs[d, 1], grid):
+                    continue
+                ux, uy = _unit(x - dogs[d, 0], y - dogs[d, 1])
+                if mode != NEAREST:
+                    dog_x += ux
+                    dog_y += uy
+                elif dist < nearest:
+                    dog_x, dog_y = ux, uy
+                if dist < nearest:
+                    nearest = dist
+
+            if nearest == np.inf:
+                # Random chance of moving in any direction / Grazing
+                if graze[p, i]:
+                    sheep[i, 0], sheep[i, 1] = move(
+                        x, y, graze_dir[p, i, 0], graze_dir[p, i, 1], grid)
+                continue
+
+            # Neighbors sorted by distance, the first being the sheep itself
+            for j in range(num):
+                dists[j] = math.sqrt((x - sheep[j, 0])**2 +
+                                     (y - sheep[j, 1])**2)
+            order = np.argsort(dists, kind='mergesort')
+
+            # LCM of every seen sheep and repulsion from the close ones
+            lcm_x = lcm_y = 0.0
+            rep_x = rep_y = 0.0
+            count = 0
+            repelling = True
+            for k in range(1, num):
+                j = order[k]
+                if _cannot_see(x, y, sheep[j, 0], sheep[j, 1], grid):
+                    continue
+                lcm_x += sheep[j, 0]
+                lcm_y += sheep[j, 1]
+                count += 1
+                if repelling and dists[j] <= R_A:
+                    ux, uy = _unit(x - sheep[j, 0], y - sheep[j, 1])
+                    rep_x += ux
+                    rep_y += uy
+                else:
+                    repelling = False
+
+            lcm_ax = lcm_ay = 0.0
+            if count > 0:
+                lcm_ax, lcm_ay = _unit(lcm_x / count - x, lcm_y / count - y)
+            rep_x, rep_y = _unit(rep_x, rep_y)
+
+            next_heading[i, 0] += P_C*lcm_ax + P_A*rep_x + P_S*dog_x
+            next_heading[i, 1] += P_C*lcm_ay + P_A*rep_y + P_S*dog_y
+            next_heading[i, 0] += P_H*heading[i, 0]
+            next_heading[i, 1] += P_H*heading[i, 1]
+            sheep_dir[i, 0] = next_heading[i, 0]
+            sheep_dir[i, 1] = next_heading[i, 1]
+
+    # Update sheep location with obstacle clipping
+    for i in range(num):
+        ux, uy = _unit(next_heading[i, 0], next_heading[i, 1])
+        sheep[i, 0], sheep[i, 1] = move(sheep[i, 0], sheep[i, 1],
+                                        S_Speed*ux, S_Speed*uy, grid)
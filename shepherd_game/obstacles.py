@@ -1,5 +1,10 @@
 import dataclasses
-from typing import List
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from shepherd_game.utils import circles_intersect, lines_intersect
+
 
 @dataclasses.dataclass()
 class Line:
@@ -18,4 +23,286 @@ lines: List[Line] = [
 
 circles: List[Circle] = [
     # Circle(center=(60, 60), radius=10),
-]
\ No newline at end of file
+]
+
+
+def line_arrays() -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stack the line obstacles into arrays.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Start and end points, shape (L, 2)
+    """
+    starts = np.array([line.start for line in lines], dtype=float)
+    ends = np.array([line.end for line in lines], dtype=float)
+    return starts.reshape(-1, 2), ends.reshape(-1, 2)
+
+
+def circle_arrays() -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Stack the circle obstacles into arrays.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Centers, shape (C, 2), and radii,
+            shape (C,)
+    """
+    centers = np.array([circle.center for circle in circles], dtype=float)
+    radii = np.array([circle.radius for circle in circles], dtype=float)
+    return centers.reshape(-1, 2), radii
+
+
+class Broadphase:
+    def __init__(self,
+                 lines: List[Line],
+                 circles: List[Circle],
+                 cell_size: Optional[float] = None):
+        """
+        Uniform grid over the obstacles for collision and sight queries.
+
+        Every obstacle is listed in the grid cells its bounding box covers,
+        so a segment is only tested against the obstacles in the cells of
+        its own bounding box. Obstacles are numbered with the lines first,
+        in list order, then the circles, which is the order the scalar
+        checks in Game try them in.
+
+        Args:
+            lines (List[Line]): Line obstacles
+            circles (List[Circle]): Circle obstacles
+            cell_size (Optional[float]): Width of a grid cell. Defaults to
+                the median obstacle size, with at most 128 cells per side
+        """
+        self.num_lines = len(lines)
+        self.starts = np.array([line.start for line in lines],
+                               dtype=float).reshape(-1, 2)
+        self.ends = np.array([line.end for line in lines],
+                             dtype=float).reshape(-1, 2)
+        self.centers = np.array([circle.center for circle in circles],
+                                dtype=float).reshape(-1, 2)
+        self.radii = np.array([circle.radius for circle in circles],
+                              dtype=float)
+        self.num = self.num_lines + len(self.radii)
+
+        # Bounding box of every obstacle
+        low = np.concatenate([np.minimum(self.starts, self.ends),
+                              self.centers - self.radii[:, None]])
+        high = np.concatenate([np.maximum(self.starts, self.ends),
+                               self.centers + self.radii[:, None]])
+        if self.num == 0:
+            low = high = np.zeros((1, 2))
+        self.origin = low.min(axis=0)
+        self.corner = high.max(axis=0)
+        extent = self.corner - self.origin
+        if cell_size is None:
+            cell_size = max(float(np.median((high - low).max(axis=1))),
+                            float(extent.max()) / 128, 1.0)
+        self.cell_size = float(cell_size)
+        self.shape = (extent // self.cell_size).astype(int) + 1
+
+        # Cells covered by each obstacle, sorted by cell then obstacle
+        first, last = self.cell_range(low, high)
+        cells = [(x*self.shape[1] + y, idx)
+                 for idx in range(self.num)
+                 for x in range(first[idx, 0], last[idx, 0] + 1)
+                 for y in range(first[idx, 1], last[idx, 1] + 1)]
+        cells = np.array(sorted(cells), dtype=np.int64).reshape(-1, 2)
+        self.items = cells[:, 1].copy()
+        counts = np.bincount(cells[:, 0], minlength=self.shape.prod())
+        self.cell_start = np.concatenate([[0], np.cumsum(counts)])
+
+    def cell_range(self,
+                   low: np.ndarray,
+                   high: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Grid cells covered by bounding boxes, clipped to the grid.
+
+        Args:
+            low (np.ndarray): Lower corners, shape (N, 2)
+            high (np.ndarray): Upper corners, shape (N, 2)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: First and last cell on each axis,
+                shape (N, 2)
+        """
+        top = self.shape - 1
+        first = np.clip((low - self.origin) // self.cell_size, 0, top)
+        last = np.clip((high - self.origin) // self.cell_size, 0, top)
+        return first.astype(int), last.astype(int)
+
+    def kernel_args(self) -> Tuple:
+        """Arrays of the obstacles and the grid for the jit kernels."""
+        return (self.starts, self.ends, self.centers, self.radii,
+                self.origin, self.cell_size, self.shape, self.cell_start,
+                self.items)
+
+    def query(self, start: np.ndarray, end: np.ndarray) -> List[int]:
+        """
+        Obstacles near one segment.
+
+        Args:
+            start (np.ndarray): Start of the segment
+            end (np.ndarray): End of the segment
+
+        Returns:
+            List[int]: Sorted obstacle numbers in the cells of the segment
+        """
+        low = np.minimum(start, end)
+        high = np.maximum(start, end)
+        if self.num == 0 or np.any(high < self.origin) or \
+                np.any(low > self.corner):
+            return []
+        (x0, y0), (x1, y1) = self.cell_range(low, high)
+        found = set()
+        for x in range(x0, x1 + 1):
+            cell = x*self.shape[1]
+            found.update(self.items[
+                self.cell_start[cell + y0]:self.cell_start[cell + y1 + 1]])
+        return sorted(found)
+
+    def candidates(self,
+                   starts: np.ndarray,
+                   ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pairs of segments and obstacles in a shared grid cell.
+
+        Args:
+            starts (np.ndarray): Starts of the segments, shape (N, 2)
+            ends (np.ndarray): Ends of the segments, shape (N, 2)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Segment and obstacle of each pair.
+                A pair is repeated for every cell they share
+        """
+        empty = np.zeros(0, dtype=np.int64)
+        if self.num == 0 or len(starts) == 0:
+            return empty, empty
+        low = np.minimum(starts, ends)
+        high = np.maximum(starts, ends)
+        first, last = self.cell_range(low, high)
+
+        # One row per covered cell of every segment, none for segments
+        # outside the obstacles
+        span = last - first + 1
+        counts = span[:, 0] * span[:, 1]
+        counts[np.any((high < self.origin) | (low > self.corner), axis=1)] = 0
+        segment = np.repeat(np.arange(len(starts)), counts)
+        local = np.arange(len(segment)) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        cell = (first[segment, 0] + local // span[segment, 1]) * \
+            self.shape[1] + first[segment, 1] + local % span[segment, 1]
+
+        # One row per obstacle listed in each of those cells
+        sizes = self.cell_start[cell + 1] - self.cell_start[cell]
+        segment = np.repeat(segment, sizes)
+        offset = np.arange(len(segment)) - \
+            np.repeat(np.cumsum(sizes) - sizes, sizes)
+        obstacle = self.items[np.repeat(self.cell_start[cell], sizes) + offset]
+        return segment, obstacle
+
+    def hits(self,
+             starts: np.ndarray,
+             ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pairs of segments and the obstacles they intersect.
+
+        Args:
+            starts (np.ndarray): Starts of the segments, shape (N, 2)
+            ends (np.ndarray): Ends of the segments, shape (N, 2)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Segment and obstacle of each hit.
+                A hit is repeated for every cell they share
+        """
+        segment, obstacle = self.candidates(starts, ends)
+        is_line = obstacle < self.num_lines
+        hit = np.empty(len(segment), dtype=bool)
+
+        idx, line = segment[is_line], obstacle[is_line]
+        hit[is_line] = lines_intersect(starts[idx], ends[idx],
+                                       self.starts[line], self.ends[line])
+        idx, circle = segment[~is_line], obstacle[~is_line] - self.num_lines
+        hit[~is_line] = circles_intersect(starts[idx], ends[idx],
+                                          self.centers[circle],
+                                          self.radii[circle])
+        return segment[hit], obstacle[hit]
+
+    def blocked(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Check which segments cross any obstacle.
+
+        Args:
+            starts (np.ndarray): Starts of the segments, shape (..., 2)
+            ends (np.ndarray): Ends of the segments, shape (..., 2)
+
+        Returns:
+            np.ndarray: True where the segment crosses an obstacle, shape (...)
+        """
+        starts, ends = np.broadcast_arrays(np.asarray(starts, dtype=float),
+                                           np.asarray(ends, dtype=float))
+        shape = starts.shape[:-1]
+        blocked = np.zeros(int(np.prod(shape)), dtype=bool)
+        blocked[self.hits(starts.reshape(-1, 2), ends.reshape(-1, 2))[0]] = \
+            True
+        return blocked.reshape(shape)
+
+    def move(self, starts: np.ndarray, movements: np.ndarray) -> np.ndarray:
+        """
+        Move points, sliding along the first obstacle each one hits.
+
+        Batched form of Game.calculate_movement.
+
+        Args:
+            starts (np.ndarray): Starting points, shape (N, 2)
+            movements (np.ndarray): Directions of travel, shape (N, 2)
+
+        Returns:
+            np.ndarray: New positions, shape (N, 2)
+        """
+        starts = np.asarray(starts, dtype=float)
+        movements = np.asarray(movements, dtype=float)
+        ends = starts + movements
+        segment, obstacle = self.hits(starts, ends)
+
+        # First obstacle hit by each segment, in the order of the scalar check
+        order = np.argsort(segment * self.num + obstacle)
+        segment, obstacle = segment[order], obstacle[order]
+        first = np.flatnonzero(np.diff(segment, prepend=-1))
+        segment, obstacle = segment[first], obstacle[first]
+
+        is_line = obstacle < self.num_lines
+        idx, line = segment[is_line], obstacle[is_line]
+        # Projection of movement onto the line obstacle
+        along = self.ends[line] - self.starts[line]
+        norm = np.hypot(along[:, 0], along[:, 1])
+        proj = np.sum(movements[idx] * along, axis=-1) / norm
+        ends[idx] = starts[idx] + proj[:, None] * along / norm[:, None]
+
+        # Slide around the circle obstacle
+        idx, circle = segment[~is_line], obstacle[~is_line] - self.num_lines
+        center = self.centers[circle]
+        angle = np.arctan2(ends[idx, 1] - center[:, 1],
+                           ends[idx, 0] - center[:, 0])
+        ends[idx] = center + self.radii[circle, None] * \
+            np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+        return ends
+
+
+# Grid of the current obstacles, rebuilt when they change
+_compiled: Tuple[Tuple, Optional[Broadphase]] = ((), None)
+
+
+def broadphase() -> Broadphase:
+    """
+    Broadphase grid of the current obstacles.
+
+    The grid is cached and only rebuilt if lines or circles changed since
+    the last call, so calling this once per episode is cheap.
+
+    Returns:
+        Broadphase: Grid of lines and circles
+    """
+    global _compiled
+    key = (tuple((*line.start, *line.end) for line in lines),
+           tuple((*circle.center, circle.radius) for circle in circles))
+    if _compiled[1] is None or _compiled[0] != key:
+        _compiled = (key, Broadphase(lines, circles))
+    return _compiled[1]
@@ -0,0 +1,93 @@
+from typing import Optional
+
+import numpy as np
+
+from shepherd_game.parameters import D_Speed, E, R_A, R_S
+from shepherd_game.utils import unit_vects
+
+
+class StrombomShepherd:
+    def __init__(self,
+                 rng: Optional[np.random.Generator] = None,
+                 noise: float = E,
+                 speed: float = D_Speed):
+        """
+        Scripted shepherd using the collect and drive heuristic of Strombom.
+
+        If any sheep is further than R_A * N^(2/3) from the center of the
+        flock, the dog collects it by moving behind it, away from the center.
+        Otherwise the dog drives the flock by moving behind its center, away
+        from the target. The dog stands still while it is within 3*R_A of a
+        sheep, so it does not split the flock. Every dog follows the same
+        rule from its own position.
+
+        Args:
+            rng (Optional[np.random.Generator]): Generator for the angular
+                noise. Defaults to None.
+            noise (float): Relative strength of the angular noise.
+                Defaults to E
+            speed (float): Length of each action. Defaults to D_Speed
+        """
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.noise = noise
+        self.speed = speed
+
+    def act(self,
+            dog: np.ndarray,
+            sheep: np.ndarray,
+            target: np.ndarray) -> np.ndarray:
+        """
+        Pick the movement of each dog.
+
+        Any leading batch axes are kept, so the state of a VecGame can be
+        passed in directly.
+
+        Args:
+            dog (np.ndarray): Dog positions, shape (..., D, 2)
+            sheep (np.ndarray): Sheep positions, shape (..., S, 2)
+            target (np.ndarray): Target position, shape (..., 2)
+
+        Returns:
+            np.ndarray: Dog movements for Game.step, shape (..., D, 2)
+        """
+        num_sheep = sheep.shape[-2]
+        center = sheep.mean(axis=-2, keepdims=True)
+        from_center = sheep - center
+        spread = np.hypot(from_center[..., 0], from_center[..., 1])
+
+        # Dog k collects the k-th furthest sheep from the flock
+        num_dog = dog.shape[-2]
+        far = np.argsort(-spread, axis=-1)
+        far = far[..., np.arange(num_dog) % num_sheep, None]
+        outlier = np.take_along_axis(sheep, far, axis=-2)
+        collect = outlier + R_A * unit_vects(outlier - center)
+
+        # Drive the flock from behind, away from the target, with the dogs
+        # side by side
+        behind = unit_vects(center - np.asarray(target)[..., None, :])
+        side = np.stack([-behind[..., 1], behind[..., 0]], axis=-1)
+        offset = np.arange(num_dog)[:, None] - (num_dog - 1) / 2
+        drive = center + R_A * np.sqrt(num_sheep) * (behind + offset * side)
+
+        # A dog in front of the flock walks around it instead of through it
+        rel = dog - center
+        ahead = np.sum(rel * behind, axis=-1) < 0
+        around = np.where(np.sum(rel * side, axis=-1) < 0, -1, 1)[..., None]
+        drive = np.where(ahead[..., None],
+                         center + R_S * around * side, drive)
+
+        # Dogs without a stray sheep to collect drive the flock
+        collecting = np.take_along_axis(spread, far[..., 0], axis=-1) > \
+            R_A * num_sheep**(2/3)
+        goal = np.where(collecting[..., None], collect, drive)
+
+        move = unit_vects(goal - dog) + \
+            self.noise * unit_vects(self.rng.random(dog.shape) - 0.5)
+        move = self.speed * unit_vects(move)
+
+        # Wait while too close to any sheep
+        offsets = dog[..., :, None, :] - sheep[..., None, :, :]
+        close = np.any(
+            np.hypot(offsets[..., 0], offsets[..., 1]) < 3*R_A, axis=-1)
+        move[close] = 0
+        return move
@@ -0,0 +1,125 @@
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Dict, List
+
+import numpy as np
+
+# Shared do-nothing context used while timing is off
+_DISABLED = nullcontext()
+
+
+class _Phase:
+    __slots__ = ['timer', 'name', 'start']
+
+    def __init__(self, timer: 'PhaseTimer', name: str):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class PhaseTimer:
+    def __init__(self, enabled: bool = False, window: int = 300):
+        """
+        Opt-in timers for the phases of the game loop.
+
+        Wrap a phase in `with timer.phase(name):`. While disabled this
+        returns a shared empty context, so instrumented code costs one
+        method call per phase.
+
+        Args:
+            enabled (bool): Record timings. Defaults to False
+            window (int): Calls per phase kept for the rolling stats.
+                Defaults to 300
+        """
+        self.enabled = enabled
+        self.window = window
+        self.recent: Dict[str, deque] = {}
+        self.totals: Dict[str, List[float]] = {}
+
+    def phase(self, name: str):
+        """
+        Time a block of code.
+
+        Args:
+            name (str): Phase name
+
+        Returns:
+            Context manager that records the time spent in the block
+        """
+        if not self.enabled:
+            return _DISABLED
+        return _Phase(self, name)
+
+    def add(self, name: str, seconds: float):
+        """
+        Record one call of a phase.
+
+        Args:
+            name (str): Phase name
+            seconds (float): Time spent
+        """
+        if name not in self.recent:
+            self.recent[name] = deque(maxlen=self.window)
+            self.totals[name] = [0.0, 0]
+        self.recent[name].append(seconds)
+        self.totals[name][0] += seconds
+        self.totals[name][1] += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Rolling stats of the last window calls of each phase.
+
+        Returns:
+            Dict[str, Dict[str, float]]: Mean, median, 95th percentile and
+                max time in ms per phase
+        """
+        stats = {}
+        for name, recent in self.recent.items():
+            times = np.array(recent) * 1e3
+            stats[name] = {
+                'mean_ms': float(times.mean()),
+                'p50_ms': float(np.percentile(times, 50)),
+                'p95_ms': float(np.percentile(times, 95)),
+                'max_ms': float(times.max()),
+            }
+        return stats
+
+    def end_episode(self, **info) -> Dict:
+        """
+        Summarize the phases since the last episode ended and start over.
+
+        The summary is not kept, so a long session holds only the rolling
+        and episode totals. Game appends it to profile.jsonl.
+
+        Args:
+            **info: Extra fields for the summary, such as the trial number
+
+        Returns:
+            Dict: Summary with the total and mean time in ms and call count
+                of each phase
+        """
+        summary = dict(info)
+        summary['phases'] = {
+            name: {'total_ms': total * 1e3,
+                   'mean_ms': total * 1e3 / count,
+                   'count': count}
+            for name, (total, count) in self.totals.items() if count}
+        self.reset_episode()
+        return summary
+
+    def reset_episode(self):
+        """Drop the episode totals, keeping the rolling stats."""
+        self.totals = {name: [0.0, 0] for name in self.totals}
+
+    def lines(self) -> List[str]:
+        """Rolling stats as text, slowest phase first."""
+        stats = sorted(self.stats().items(),
+                       key=lambda item: -item[1]['mean_ms'])
+        return [f"{name}: {value['mean_ms']:.2f} ms "
+                f"(p95 {value['p95_ms']:.2f})" for name, value in stats]
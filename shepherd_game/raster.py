@@ -0,0 +1,230 @@
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+from shepherd_game import obstacles
+from shepherd_game.parameters import FIELD_LENGTH, PADDING, TARGET_RADIUS
+from shepherd_game.utils import triangles
+
+FIELD_COLOR = (19, 133, 16)
+DOG_COLOR = (25, 25, 255)
+OBSTACLE_COLOR = (139, 69, 19)
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+
+
+class Rasterizer:
+    def __init__(self, scale: float = 1):
+        """
+        Draw game states into NumPy images without pygame.
+
+        Images use the same layout as pygame.surfarray, indexed as [x, y],
+        so they can be saved with the same code as screen captures. Shapes
+        are drawn with fixed size pixel stamps, so a whole batch of states is
+        drawn with a handful of array operations.
+
+        Args:
+            scale (float): Pixels per field unit. 1 gives images at the
+                original field size. Defaults to 1
+        """
+        self.scale = scale
+        self.padding = np.array(PADDING)
+        self.size = tuple(
+            int(round((FIELD_LENGTH + 2*pad) * scale)) for pad in PADDING)
+        self.agent_size = scale + 2
+        self.buffer = np.zeros((0,) + self.size + (3,), dtype=np.uint8)
+
+    def to_pixels(self, points: np.ndarray) -> np.ndarray:
+        """
+        Convert field positions into pixel positions.
+
+        Args:
+            points (np.ndarray): Field positions, shape (..., 2)
+
+        Returns:
+            np.ndarray: Pixel positions, shape (..., 2)
+        """
+        return (self.padding + points) * self.scale
+
+    def render(self,
+               sheep: np.ndarray,
+               dog: np.ndarray,
+               target: np.ndarray,
+               sheep_dir: Optional[np.ndarray] = None,
+               dog_dir: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Draw one game state.
+
+        Args:
+            sheep (np.ndarray): Sheep positions, shape (S, 2)
+            dog (np.ndarray): Dog positions, shape (D, 2)
+            target (np.ndarray): Target position, shape (2,)
+            sheep_dir (Optional[np.ndarray]): Sheep headings, shape (S, 2).
+                Defaults to None.
+            dog_dir (Optional[np.ndarray]): Dog headings, shape (D, 2).
+                Defaults to None.
+
+        Returns:
+            np.ndarray: RGB image, shape (W, H, 3). This is a view of the
+                internal buffer and is overwritten by the next call
+        """
+        return self.render_batch(
+            sheep[None], dog[None], np.asarray(target)[None],
+            None if sheep_dir is None else sheep_dir[None],
+            None if dog_dir is None else dog_dir[None])[0]
+
+    def render_batch(self,
+                     sheep: np.ndarray,
+                     dog: np.ndarray,
+                     target: np.ndarray,
+                     sheep_dir: Optional[np.ndarray] = None,
+                     dog_dir: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Draw a batch of game states, such as the state of a VecGame.
+
+        Args:
+            sheep (np.ndarray): Sheep positions, shape (N, S, 2)
+            dog (np.ndarray): Dog positions, shape (N, D, 2)
+            target (np.ndarray): Target positions, shape (N, 2)
+            sheep_dir (Optional[np.ndarray]): Sheep headings, shape (N, S, 2).
+                Defaults to None.
+            dog_dir (Optional[np.ndarray]): Dog headings, shape (N, D, 2).
+                Defaults to None.
+
+        Returns:
+            np.ndarray: RGB images, shape (N, W, H, 3). This is a view of the
+                internal buffer and is overwritten by the next call
+        """
+        num = len(sheep)
+        if len(self.buffer) != num:
+            self.buffer = np.zeros((num,) + self.size + (3,), dtype=np.uint8)
+        self.buffer[:] = FIELD_COLOR
+
+        # Target
+        self.draw_circles(self.to_pixels(target)[:, None],
+                          TARGET_RADIUS * self.scale, BLACK)
+
+        # Agents are a circle with a triangle pointing in their heading
+        for pos, heading, color in [(dog, dog_dir, DOG_COLOR),
+                                    (sheep, sheep_dir, WHITE)]:
+            pos = self.to_pixels(pos)
+            self.draw_circles(pos, self.agent_size, color)
+            if heading is None:
+                heading = np.zeros_like(pos)
+            self.draw_triangles(
+                triangles(pos, heading * self.scale + pos, self.agent_size),
+                color)
+
+        # Obstacles
+        centers, radii = obstacles.circle_arrays()
+        for center, radius in zip(centers, radii):
+            self.draw_circles(
+                np.broadcast_to(self.to_pixels(center), (num, 1, 2)),
+                radius * self.scale, OBSTACLE_COLOR)
+
+        starts, ends = obstacles.line_arrays()
+        for start, end in zip(starts, ends):
+            self.draw_line(self.to_pixels(start), self.to_pixels(end),
+                           OBSTACLE_COLOR)
+
+        return self.buffer
+
+    def draw_circles(self,
+                     centers: np.ndarray,
+                     radius: float,
+                     color: Tuple[int, int, int]):
+        """
+        Draw filled circles of the same radius into every image.
+
+        Args:
+            centers (np.ndarray): Pixel centers, shape (N, M, 2)
+            radius (float): Radius in pixels
+            color (Tuple[int, int, int]): RGB color
+        """
+        def inside(pixels, centers):
+            offsets = pixels - centers[:, None, :]
+            return np.sum(offsets**2, axis=-1) <= radius**2
+
+        self._stamp(centers, centers, radius, inside, color)
+
+    def draw_triangles(self,
+                       corners: np.ndarray,
+                       color: Tuple[int, int, int]):
+        """
+        Draw filled triangles into every image.
+
+        Args:
+            corners (np.ndarray): Pixel corners, shape (N, M, 3, 2)
+            color (Tuple[int, int, int]): RGB color
+        """
+        def inside(pixels, corners):
+            # Pixels on the same side of all three edges are inside
+            sides = []
+            for i in range(3):
+                a, b = corners[:, None, i], corners[:, None, (i+1) % 3]
+                sides.append(
+                    (b[..., 0] - a[..., 0]) * (pixels[..., 1] - a[..., 1]) -
+                    (b[..., 1] - a[..., 1]) * (pixels[..., 0] - a[..., 0]))
+            sides = np.stack(sides)
+            return np.all(sides >= 0, axis=0) | np.all(sides <= 0, axis=0)
+
+        self._stamp(corners[..., 0, :], corners, 2*self.agent_size, inside,
+                    color)
+
+    def draw_line(self,
+                  start: np.ndarray,
+                  end: np.ndarray,
+                  color: Tuple[int, int, int]):
+        """
+        Draw a one pixel wide line into every image.
+
+        Args:
+            start (np.ndarray): Pixel start point, shape (2,)
+            end (np.ndarray): Pixel end point, shape (2,)
+            color (Tuple[int, int, int]): RGB color
+        """
+        steps = int(np.ceil(np.abs(end - start).max())) + 1
+        pixels = np.round(np.linspace(start, end, steps)).astype(int)
+        pixels = pixels[self._in_bounds(pixels)]
+        self.buffer[:, pixels[:, 0], pixels[:, 1]] = color
+
+    def _in_bounds(self, pixels: np.ndarray) -> np.ndarray:
+        """Check which pixels are inside the image."""
+        return (pixels[..., 0] >= 0) & (pixels[..., 0] < self.size[0]) & \
+            (pixels[..., 1] >= 0) & (pixels[..., 1] < self.size[1])
+
+    def _stamp(self,
+               anchors: np.ndarray,
+               shapes: np.ndarray,
+               reach: float,
+               inside: Callable[[np.ndarray, np.ndarray], np.ndarray],
+               color: Tuple[int, int, int]):
+        """
+        Color the pixels of many shapes with a square stamp around each.
+
+        Args:
+            anchors (np.ndarray): Pixel point inside each shape, shape (N, M, 2)
+            shapes (np.ndarray): Shape description passed to inside, with
+                leading shape (N, M)
+            reach (float): Furthest distance of the shape from its anchor
+            inside (Callable): Maps pixels, shape (N*M, K, 2), and the
+                flattened shapes to a mask of pixels inside each shape
+            color (Tuple[int, int, int]): RGB color
+        """
+        num, per_image = anchors.shape[:2]
+        if per_image == 0:
+            return
+
+        reach = int(np.ceil(reach)) + 1
+        steps = np.arange(-reach, reach+1)
+        stencil = np.stack(np.meshgrid(steps, steps), axis=-1).reshape(-1, 2)
+
+        anchors = anchors.reshape(-1, 2)
+        pixels = np.floor(anchors).astype(int)[:, None, :] + stencil
+        mask = inside(pixels, shapes.reshape((-1,) + shapes.shape[2:])) & \
+            self._in_bounds(pixels)
+
+        image = np.repeat(np.arange(num), per_image)[:, None]
+        image = np.broadcast_to(image, mask.shape)[mask]
+        pixels = pixels[mask]
+        self.buffer[image, pixels[:, 0], pixels[:, 1]] = color
@@ -0,0 +1,385 @@
+import atexit
+import csv
+import os
+import queue
+import shutil
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+PARTIAL_SUFFIX = '.partial'
+# Arrays of the state before the first step of an episode
+SPAWN_ARRAYS = ('dog', 'sheep', 'dog_dir', 'sheep_dir')
+
+
+def write_bmp(path: str, frame: np.ndarray):
+    """
+    Save an RGB frame as a 24-bit BMP without going through pygame.
+
+    Args:
+        path (str): File to write
+        frame (np.ndarray): RGB pixels indexed as [x, y], shape (W, H, 3)
+    """
+    width, height = frame.shape[:2]
+    row_size = (3*width + 3) // 4 * 4
+
+    # BMP rows go bottom to top and store BGR
+    pixels = np.zeros((height, row_size), dtype=np.uint8)
+    pixels[:, :3*width] = frame[:, ::-1, ::-1].transpose(1, 0, 2).reshape(
+        height, 3*width)
+
+    header = np.zeros(54, dtype=np.uint8)
+    header[:2] = [ord('B'), ord('M')]
+    header[2:6] = np.frombuffer(
+        np.uint32(54 + pixels.size).tobytes(), np.uint8)
+    header[10:14] = np.frombuffer(np.uint32(54).tobytes(), np.uint8)
+    header[14:26] = np.frombuffer(
+        np.array([40, width, height], np.uint32).tobytes(), np.uint8)
+    header[26:30] = np.frombuffer(
+        np.array([1, 24], np.uint16).tobytes(), np.uint8)
+    header[34:38] = np.frombuffer(np.uint32(pixels.size).tobytes(), np.uint8)
+
+    with open(path, 'wb') as file:
+        file.write(header.tobytes())
+        file.write(pixels.tobytes())
+
+
+# Arrays of TrajectoryLog, in the order append takes them
+LOG_ARRAYS = ('dog_steps', 'sheep_steps', 'dog_dir_steps', 'sheep_dir_steps')
+
+
+class TrajectoryLog:
+    __slots__ = list(LOG_ARRAYS) + ['length']
+
+    def __init__(self,
+                 num_dog: int,
+                 num_sheep: int,
+                 dtype: type = np.float64,
+                 capacity: int = 1024):
+        """
+        Positions and headings of an episode in typed arrays that grow as
+        needed.
+
+        Steps are copied into preallocated rows and the arrays double in
+        size when full, so logging a step allocates nothing most of the time.
+
+        Args:
+            num_dog (int): Number of dogs
+            num_sheep (int): Number of sheep
+            dtype (type): Float type of the positions. Defaults to np.float64
+            capacity (int): Steps to allocate at first. Defaults to 1024
+        """
+        self.dog_steps = np.empty((capacity, num_dog, 2), dtype)
+        self.sheep_steps = np.empty((capacity, num_sheep, 2), dtype)
+        self.dog_dir_steps = np.empty_like(self.dog_steps)
+        self.sheep_dir_steps = np.empty_like(self.sheep_steps)
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self,
+               dog: np.ndarray,
+               sheep: np.ndarray,
+               dog_dir: np.ndarray,
+               sheep_dir: np.ndarray):
+        """
+        Log one step.
+
+        Args:
+            dog (np.ndarray): Dog positions, shape (D, 2)
+            sheep (np.ndarray): Sheep positions, shape (S, 2)
+            dog_dir (np.ndarray): Dog headings, shape (D, 2)
+            sheep_dir (np.ndarray): Sheep headings, shape (S, 2)
+        """
+        if self.length == len(self.dog_steps):
+            for name in LOG_ARRAYS:
+                old = getattr(self, name)
+                new = np.empty((2*len(old) or 1,) + old.shape[1:], old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+        for name, value in zip(LOG_ARRAYS, [dog, sheep, dog_dir, sheep_dir]):
+            getattr(self, name)[self.length] = value
+        self.length += 1
+
+    def clear(self):
+        """Drop the logged steps, keeping the memory for the next episode."""
+        self.length = 0
+
+    @property
+    def dog(self) -> np.ndarray:
+        """Logged dog positions, shape (T, D, 2). A view."""
+        return self.dog_steps[:self.length]
+
+    @property
+    def sheep(self) -> np.ndarray:
+        """Logged sheep positions, shape (T, S, 2). A view."""
+        return self.sheep_steps[:self.length]
+
+    @property
+    def dog_dir(self) -> np.ndarray:
+        """Logged dog headings, shape (T, D, 2). A view."""
+        return self.dog_dir_steps[:self.length]
+
+    @property
+    def sheep_dir(self) -> np.ndarray:
+        """Logged sheep headings, shape (T, S, 2). A view."""
+        return self.sheep_dir_steps[:self.length]
+
+
+class TrialWriter:
+    def __init__(self, save_dir: str):
+        """
+        Write episodes as trial folders of CSVs and BMP frames.
+
+        Each episode is written into save_dir/<trial>.partial/ while it runs
+        and renamed to save_dir/<trial>/ once it is finished, so a crash never
+        leaves a half written trial. The layout of a finished trial is the
+        same as Game.save_data has always written, plus the headings of each
+        step in dog_dir.csv and sheep_dir.csv and the state before the first
+        step in spawn.csv, one row each for the dog and sheep positions and
+        headings. Values are written at full precision, so frames drawn from
+        them match the saved ones.
+
+        Args:
+            save_dir (str): Directory to save the trials in
+        """
+        self.save_dir = save_dir
+        self.path = None
+        self.files = []
+
+    def start(self,
+              trial: int,
+              spawn: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Start writing a new episode, dropping an unfinished one.
+
+        Args:
+            trial (int): Run number used for the trial folder
+            spawn (Optional[Dict[str, np.ndarray]]): State before the first
+                step, with the arrays of SPAWN_ARRAYS. Defaults to None.
+        """
+        self.discard()
+        self.trial_path = os.path.join(self.save_dir, str(trial))
+        self.path = self.trial_path + PARTIAL_SUFFIX
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(os.path.join(self.path, 'img'))
+
+        self.files = [open(os.path.join(self.path, name), 'w', newline='')
+                      for name in ['pos.csv', 'sheep_pos.csv', 'dog_dir.csv',
+                                   'sheep_dir.csv']]
+        self.writers = [csv.writer(file) for file in self.files]
+        self.num_frames = 0
+
+        if spawn is not None:
+            with open(os.path.join(self.path, 'spawn.csv'), 'w',
+                      newline='') as file:
+                writer = csv.writer(file)
+                for name in SPAWN_ARRAYS:
+                    writer.writerow(np.ravel(spawn[name]).tolist())
+
+    def step(self,
+             dog: np.ndarray,
+             sheep: np.ndarray,
+             frame: Optional[np.ndarray] = None,
+             action: Optional[np.ndarray] = None,
+             dog_dir: Optional[np.ndarray] = None,
+             sheep_dir: Optional[np.ndarray] = None):
+        """
+        Write one step. The CSV layout has no column for the action.
+
+        Args:
+            dog (np.ndarray): Dog positions, shape (D, 2)
+            sheep (np.ndarray): Sheep positions, shape (S, 2)
+            frame (Optional[np.ndarray]): RGB frame indexed as [x, y].
+                Defaults to None.
+            action (Optional[np.ndarray]): Dog actions, shape (D, 2).
+                Defaults to None.
+            dog_dir (Optional[np.ndarray]): Dog headings, shape (D, 2).
+                Defaults to None.
+            sheep_dir (Optional[np.ndarray]): Sheep headings, shape (S, 2).
+                Defaults to None.
+        """
+        # Full precision, so replayed frames match the saved ones
+        for writer, value in zip(self.writers,
+                                 [dog, sheep, dog_dir, sheep_dir]):
+            if value is not None:
+                writer.writerow(np.ravel(value).tolist())
+        self.num_frames += 1
+        if frame is not None:
+            write_bmp(os.path.join(self.path, 'img', f'{self.num_frames}.bmp'),
+                      frame)
+
+    def finish(self, target: np.ndarray, success: bool = True):
+        """
+        Finish the episode and move it to its final folder.
+
+        Args:
+            target (np.ndarray): Target position of the episode
+            success (bool): Whether the sheep reached the target. Trial
+                folders do not store it, catalog.Catalog works it out from
+                the final positions. Defaults to True
+        """
+        with open(os.path.join(self.path, 'target_pos.csv'), 'w') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(target)
+
+        for file in self.files:
+            file.close()
+        self.files = []
+
+        os.rename(self.path, self.trial_path)
+        self.path = None
+
+    def discard(self):
+        """Delete the unfinished episode, if there is one."""
+        for file in self.files:
+            file.close()
+        self.files = []
+
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+    def close(self):
+        """Drop any unfinished episode."""
+        self.discard()
+
+
+class EpisodeRecorder:
+    def __init__(self, writer, max_queue: int = 64):
+        """
+        Stream episodes to disk from a background writer thread.
+
+        Every call is queued and run on the writer in order, so the game loop
+        only waits when the writer falls max_queue steps behind. If a write
+        fails, the episode is discarded, the rest of its steps are dropped
+        and the error is raised in the game thread on its next call. Calls
+        after close raise a RuntimeError instead of waiting for a writer
+        that is gone.
+
+        Args:
+            writer: Episode writer with start, step, finish, discard and
+                close methods, such as TrialWriter
+            max_queue (int): Steps that can wait for the writer before record
+                blocks. Bounds the memory used by frames. Defaults to 64
+        """
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        # Set when a write of the current episode failed
+        self.failed = False
+
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def start(self,
+              trial: int,
+              spawn: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Start recording a new episode.
+
+        Args:
+            trial (int): Run number of the episode
+            spawn (Optional[Dict[str, np.ndarray]]): State before the first
+                step, with the arrays of SPAWN_ARRAYS. Defaults to None.
+        """
+        if spawn is not None:
+            spawn = {name: np.array(spawn[name], dtype=float)
+                     for name in SPAWN_ARRAYS}
+        self._put(('start', trial, spawn))
+
+    def record(self,
+               dog: np.ndarray,
+               sheep: np.ndarray,
+               frame: Optional[np.ndarray] = None,
+               action: Optional[np.ndarray] = None,
+               dog_dir: Optional[np.ndarray] = None,
+               sheep_dir: Optional[np.ndarray] = None):
+        """
+        Record one step. Blocks while the writer is too far behind.
+
+        Args:
+            dog (np.ndarray): Dog positions, shape (D, 2)
+            sheep (np.ndarray): Sheep positions, shape (S, 2)
+            frame (Optional[np.ndarray]): RGB frame indexed as [x, y].
+                Defaults to None.
+            action (Optional[np.ndarray]): Dog actions, shape (D, 2).
+                Defaults to None.
+            dog_dir (Optional[np.ndarray]): Dog headings, shape (D, 2).
+                Defaults to None.
+            sheep_dir (Optional[np.ndarray]): Sheep headings, shape (S, 2).
+                Defaults to None.
+        """
+        def copy(value):
+            return None if value is None else np.array(value, dtype=float)
+
+        self._put(('step', copy(dog), copy(sheep), frame, copy(action),
+                   copy(dog_dir), copy(sheep_dir)))
+
+    def finish(self, target: np.ndarray, success: bool = True):
+        """
+        Finish the current episode.
+
+        Args:
+            target (np.ndarray): Target position of the episode
+            success (bool): Whether the sheep reached the target.
+                Defaults to True
+        """
+        self._put(('finish', np.array(target), success))
+
+    def discard(self):
+        """Delete the current episode, if there is one."""
+        self._put(('discard',))
+
+    def flush(self):
+        """Wait until everything recorded so far is on disk."""
+        self.queue.join()
+        self._check()
+
+    def close(self):
+        """Discard any unfinished episode and stop the writer thread."""
+        if not self.thread.is_alive():
+            return
+        atexit.unregister(self.close)
+        self.queue.put(('close',))
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+    def _put(self, item):
+        if not self.thread.is_alive():
+            raise RuntimeError("EpisodeRecorder is closed")
+        self._check()
+        self.queue.put(item)
+
+    def _check(self):
+        """Raise errors from the writer thread in the game thread."""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _write(self):
+        """Writer thread loop."""
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if item[0] == 'start':
+                    self.failed = False
+                # Steps of a failed episode would leave a trial with gaps
+                if not (self.failed and item[0] in ['step', 'finish']):
+                    getattr(self.writer, item[0])(*item[1:])
+            except Exception as error:
+                self.error = error
+                self.failed = True
+                try:
+                    self.writer.discard()
+                except Exception:
+                    pass
+            finally:
+                self.queue.task_done()
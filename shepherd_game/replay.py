@@ -0,0 +1,256 @@
+import functools
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+
+from shepherd_game.catalog import Catalog, load_trial
+from shepherd_game.raster import Rasterizer
+from shepherd_game.recorder import SPAWN_ARRAYS
+from shepherd_game.storage import INDEX_FILE, EpisodeReader
+
+# Movement a dog needs between samples to turn, as in Game.step
+MIN_DOG_MOVE = 0.1
+# Frames rendered at once by frames
+RENDER_BATCH = 64
+
+
+def headings(sheep: np.ndarray,
+             dog: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Derive the drawn headings of an episode from its positions.
+
+    Used for runs saved before headings were logged. Sheep face the way
+    they last moved. Dogs keep facing the way of their last movement
+    longer than MIN_DOG_MOVE, as the game keeps dog_dir. Nothing has moved
+    before the first sample, so it has no headings.
+
+    Args:
+        sheep (np.ndarray): Sheep positions, shape (T, S, 2)
+        dog (np.ndarray): Dog positions, shape (T, D, 2)
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Sheep and dog headings, shape
+            (T, S, 2) and (T, D, 2)
+    """
+    sheep_dir = np.zeros_like(sheep)
+    sheep_dir[1:] = np.diff(sheep, axis=0)
+
+    moves = np.zeros_like(dog)
+    moves[1:] = np.diff(dog, axis=0)
+    moving = np.linalg.norm(moves, axis=-1) > MIN_DOG_MOVE
+    # Sample of the last turn of each dog, 0 being the still first sample
+    last = np.where(moving, np.arange(len(dog))[:, None], 0)
+    last = np.maximum.accumulate(last, axis=0)
+    dog_dir = moves[last, np.arange(dog.shape[1])]
+    return sheep_dir, dog_dir
+
+
+class EpisodeReplay:
+    def __init__(self,
+                 source: Union[str, Catalog, EpisodeReader],
+                 scale: float = 1,
+                 cache_bytes: int = 256 * 2**20,
+                 cache_episodes: int = 16):
+        """
+        Render the frames of saved episodes from their state logs on demand.
+
+        Saved positions, headings and targets hold the whole scene, so
+        frames do not have to be stored. Any frame can be drawn at any
+        resolution and crop with the NumPy rasterizer, and drawn frames are
+        kept in an LRU cache bounded by its size in bytes.
+
+        Like the saved frames, frame k shows the state before sample k, so
+        frame 0 is the logged spawn state and frame k the logged state after
+        sample k - 1. An episode has one more frame than samples, the last
+        one showing the final state. Runs saved before the headings and
+        spawn state were logged have one frame per sample, showing the state
+        after it, with headings derived by headings. Obstacles are the ones
+        currently in obstacles.py.
+
+        Args:
+            source (Union[str, Catalog, EpisodeReader]): Saved episodes. A
+                directory is read with storage.EpisodeReader if it holds a
+                chunked run, otherwise with a catalog.Catalog of its trials
+            scale (float): Default pixels per field unit. Defaults to 1
+            cache_bytes (int): Size of the frame cache. Defaults to 256 MiB
+            cache_episodes (int): Episodes to keep the positions and
+                headings of. Defaults to 16
+        """
+        if isinstance(source, str):
+            if os.path.exists(os.path.join(source, INDEX_FILE)):
+                source = EpisodeReader(source)
+            else:
+                source = Catalog(source)
+        self.source = source
+        self.scale = scale
+        self.rasterizers: Dict[float, Rasterizer] = {}
+
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.cache: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.states = functools.lru_cache(maxsize=cache_episodes)(
+            self.states)
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def length(self, idx: int) -> int:
+        """Number of frames of one episode."""
+        return len(self.states(idx)['dog'])
+
+    def states(self, idx: int) -> Dict[str, np.ndarray]:
+        """
+        Positions and headings shown by the frames of one episode.
+
+        Args:
+            idx (int): Episode number in the source
+
+        Returns:
+            Dict[str, np.ndarray]: 'dog', 'sheep', 'dog_dir' and 'sheep_dir'
+                with the frame as the first axis, and the 'target'
+        """
+        if isinstance(self.source, Catalog):
+            data = load_trial(os.path.join(self.source.data_dir,
+                                           str(self.source.trials[idx])),
+                              headings=True)
+        else:
+            names = [name for name in SPAWN_ARRAYS
+                     if name in self.source.arrays]
+            data = self.source.episode(idx, names)
+        length = len(data['dog'])
+        states = {name: np.asarray(data[name], dtype=float).reshape(
+                      length, -1, 2)
+                  for name in SPAWN_ARRAYS if name in data}
+        states['target'] = np.asarray(data['target'], dtype=float)
+
+        if 'spawn' in data and 'dog_dir' in states:
+            # Put the spawn state in front of the logged states
+            for name in SPAWN_ARRAYS:
+                states[name] = np.concatenate(
+                    [np.asarray(data['spawn'][name], dtype=float)[None],
+                     states[name]])
+        else:
+            states['sheep_dir'], states['dog_dir'] = headings(
+                states['sheep'], states['dog'])
+        return states
+
+    def frame(self,
+              idx: int,
+              step: int,
+              scale: Optional[float] = None,
+              crop: Optional[Tuple[float, float, float, float]] = None
+              ) -> np.ndarray:
+        """
+        Get one frame of an episode.
+
+        Args:
+            idx (int): Episode number in the source
+            step (int): Sample of the episode
+            scale (Optional[float]): Pixels per field unit. If None, the
+                default scale is used. Defaults to None.
+            crop (Optional[Tuple[float, float, float, float]]): Area to keep,
+                as (x_min, y_min, x_max, y_max) in field units. The padding
+                around the field has negative or past the edge coordinates.
+                If None, the whole frame is kept. Defaults to None.
+
+        Returns:
+            np.ndarray: RGB pixels indexed as [x, y]. Shared with the cache,
+                so it is read only
+        """
+        return self.frames(idx, [step], scale, crop)[0]
+
+    def frames(self,
+               idx: int,
+               steps: Optional[Iterable[int]] = None,
+               scale: Optional[float] = None,
+               crop: Optional[Tuple[float, float, float, float]] = None
+               ) -> np.ndarray:
+        """
+        Get frames of an episode, rendering the ones not cached in batches.
+
+        Args:
+            idx (int): Episode number in the source
+            steps (Optional[Iterable[int]]): Samples of the episode. If None,
+                every sample. Defaults to None.
+            scale (Optional[float]): Pixels per field unit. If None, the
+                default scale is used. Defaults to None.
+            crop (Optional[Tuple[float, float, float, float]]): Area to keep,
+                see frame. Defaults to None.
+
+        Returns:
+            np.ndarray: RGB pixels, shape (N, W, H, 3)
+        """
+        scale = self.scale if scale is None else scale
+        crop = None if crop is None else tuple(float(c) for c in crop)
+        data = self.states(idx)
+        length = len(data['dog'])
+        steps = np.arange(length) if steps is None else \
+            np.asarray(list(steps), dtype=int)
+        steps = np.where(steps < 0, steps + length, steps)
+        if np.any((steps < 0) | (steps >= length)):
+            raise IndexError(f"Episode {idx} has {length} samples")
+
+        keys = [(idx, int(step), scale, crop) for step in steps]
+        found = {key: self._get(key) for key in keys}
+        missing = sorted({key[1] for key, value in found.items()
+                          if value is None})
+
+        rasterizer = self.rasterizers.get(scale)
+        if rasterizer is None:
+            rasterizer = self.rasterizers[scale] = Rasterizer(scale)
+        window = self._window(rasterizer, crop)
+        for start in range(0, len(missing), RENDER_BATCH):
+            batch = missing[start:start+RENDER_BATCH]
+            images = rasterizer.render_batch(
+                data['sheep'][batch], data['dog'][batch],
+                np.broadcast_to(data['target'], (len(batch), 2)),
+                data['sheep_dir'][batch], data['dog_dir'][batch])
+            for step, image in zip(batch, images):
+                key = (idx, step, scale, crop)
+                found[key] = image[window].copy()
+                found[key].flags.writeable = False
+                self._put(key, found[key])
+
+        return np.stack([found[key] for key in keys])
+
+    def clear(self):
+        """Empty the frame cache."""
+        self.cache.clear()
+        self.cached_bytes = 0
+
+    def _window(self,
+                rasterizer: Rasterizer,
+                crop: Optional[Tuple[float, float, float, float]]) -> tuple:
+        """Pixel slices of a crop in the frames of a rasterizer."""
+        if crop is None:
+            return (slice(None), slice(None))
+        low = np.floor(rasterizer.to_pixels(np.array(crop[:2]))).astype(int)
+        high = np.ceil(rasterizer.to_pixels(np.array(crop[2:]))).astype(int)
+        low = np.clip(low, 0, rasterizer.size)
+        high = np.clip(high, low, rasterizer.size)
+        return (slice(low[0], high[0]), slice(low[1], high[1]))
+
+    def _get(self, key: tuple) -> Optional[np.ndarray]:
+        """Take a frame from the cache, marking it as recently used."""
+        image = self.cache.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return image
+
+    def _put(self, key: tuple, image: np.ndarray):
+        """Cache a frame, dropping the least recently used ones to fit."""
+        if image.nbytes > self.cache_bytes:
+            return
+        self.cache[key] = image
+        self.cached_bytes += image.nbytes
+        while self.cached_bytes > self.cache_bytes:
+            _, old = self.cache.popitem(last=False)
+            self.cached_bytes -= old.nbytes
@@ -0,0 +1,102 @@
+from typing import Tuple
+
+import numpy as np
+
+# Offset so negative cell coordinates still give unique positive keys
+_CELL_OFFSET = 1 << 20
+
+
+def _cell_keys(cells: np.ndarray) -> np.ndarray:
+    """Combine integer (x, y) cell coordinates into a single key."""
+    cells = cells.astype(np.int64) + _CELL_OFFSET
+    return cells[..., 0] * (2 * _CELL_OFFSET) + cells[..., 1]
+
+
+def _expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenate arange(start, start + count) for every range."""
+    ends = np.cumsum(counts)
+    steps = np.arange(ends[-1] if len(ends) else 0)
+    return steps + np.repeat(starts - ends + counts, counts)
+
+
+class SpatialGrid:
+    def __init__(self, cell_size: float):
+        """
+        Uniform grid (cell list) over a set of points.
+
+        Points are bucketed into square cells and sorted by cell, so a query
+        only looks at the cells its search radius overlaps.
+
+        Args:
+            cell_size (float): Width of each grid cell. Works best close to
+                the most common query radius
+        """
+        self.cell_size = cell_size
+        self.points = np.zeros((0, 2))
+
+    def build(self, points: np.ndarray):
+        """
+        Rebuild the grid over a new set of points.
+
+        Args:
+            points (np.ndarray): Points to index, shape (P, 2)
+        """
+        self.points = np.asarray(points, dtype=float)
+        keys = _cell_keys(np.floor(self.points / self.cell_size))
+        self.order = np.argsort(keys, kind='stable')
+        self.keys, self.starts, self.counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True)
+
+    def _candidates(self,
+                    queries: np.ndarray,
+                    radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Find every point in the cells a query radius overlaps."""
+        reach = int(np.ceil(radius / self.cell_size))
+        if (2*reach + 1)**2 > len(self.keys):
+            # Scanning every occupied cell is cheaper than the stencil
+            query_idx = np.repeat(np.arange(len(queries)), len(self.points))
+            point_idx = np.tile(np.arange(len(self.points)), len(queries))
+            return query_idx, point_idx
+
+        steps = np.arange(-reach, reach+1)
+        stencil = np.stack(np.meshgrid(steps, steps), axis=-1).reshape(-1, 2)
+
+        cells = np.floor(queries / self.cell_size)[:, None, :] + stencil
+        keys = _cell_keys(cells)
+
+        # Look up each neighboring cell in the sorted cell list
+        found = np.searchsorted(self.keys, keys)
+        found = np.minimum(found, len(self.keys)-1)
+        hit = self.keys[found] == keys
+        query_idx = np.nonzero(hit)[0]
+        cell_idx = found[hit]
+
+        counts = self.counts[cell_idx]
+        point_idx = self.order[_expand_ranges(self.starts[cell_idx], counts)]
+        return np.repeat(query_idx, counts), point_idx
+
+    def query_radius(self,
+                     queries: np.ndarray,
+                     radius: float) -> Tuple[np.ndarray, np.ndarray,
+                                             np.ndarray]:
+        """
+        Find all point pairs within a radius of each query.
+
+        Args:
+            queries (np.ndarray): Query positions, shape (Q, 2)
+            radius (float): Search radius, inclusive
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Query index, point
+                index and distance of every pair, sorted by query index
+        """
+        queries = np.asarray(queries, dtype=float).reshape(-1, 2)
+        if len(self.keys) == 0 or len(queries) == 0:
+            empty = np.zeros(0, dtype=int)
+            return empty, empty, np.zeros(0)
+
+        query_idx, point_idx = self._candidates(queries, radius)
+        offsets = self.points[point_idx] - queries[query_idx]
+        dists = np.hypot(offsets[:, 0], offsets[:, 1])
+        close = dists <= radius
+        return query_idx[close], point_idx[close], dists[close]
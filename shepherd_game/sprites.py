@@ -0,0 +1,198 @@
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pygame
+
+from shepherd_game.obstacles import Broadphase
+from shepherd_game.parameters import TARGET_RADIUS
+from shepherd_game.raster import (BLACK, DOG_COLOR, FIELD_COLOR,
+                                  OBSTACLE_COLOR, WHITE)
+from shepherd_game.utils import triangle
+
+# Sprite background, never used by the game colors
+COLORKEY = (255, 0, 255)
+# Pending update areas before the whole display is updated instead
+MAX_DIRTY = 1024
+
+
+class SpriteRenderer:
+    def __init__(self,
+                 surface: pygame.Surface,
+                 scale: float,
+                 padding: np.ndarray,
+                 angles: int = 64):
+        """
+        Draw games onto a pygame surface, redrawing only what moved.
+
+        The field, target and obstacles are drawn once into a cached
+        background, rebuilt only when the target or the obstacles change.
+        Agents are blitted from an atlas of sprites pre-drawn at angles
+        headings, and each frame only restores the background under the
+        agents and overlays of the last frame. The changed areas are kept
+        for the next display update, so the cost of a frame scales with the
+        number of agents instead of the window size. The atlas is only drawn
+        on the first draw, so games that never render do not pay for it.
+
+        Args:
+            surface (pygame.Surface): Surface to draw on, such as the screen
+            scale (float): Pixels per field unit
+            padding (np.ndarray): Field padding, in field units
+            angles (int): Headings per sprite in the atlas. Defaults to 64
+        """
+        self.surface = surface
+        self.scale = scale
+        self.padding = np.asarray(padding)
+        self.angles = angles
+        self.size = scale + 2
+
+        self.atlas = None
+        self.half = None
+
+        self.background = None
+        self.scene = None
+        self.drawn: List[pygame.Rect] = []
+        self.dirty: Optional[List[pygame.Rect]] = None
+
+    def make_sprites(self, color: Tuple[int, int, int]) -> List:
+        """
+        Draw an agent at every heading of the atlas.
+
+        Args:
+            color (Tuple[int, int, int]): RGB color
+
+        Returns:
+            List: One sprite per heading, then one for an agent without a
+                heading
+        """
+        side = int(math.ceil(4*self.size)) + 3
+        center = np.array([side / 2, side / 2])
+
+        sprites = []
+        for k in range(self.angles + 1):
+            if k < self.angles:
+                angle = 2*math.pi * k / self.angles
+                head = center + [math.cos(angle), math.sin(angle)]
+            else:
+                head = center
+            sprite = pygame.Surface((side, side))
+            sprite.fill(COLORKEY)
+            pygame.draw.circle(sprite, color, center, self.size, 0)
+            pygame.draw.polygon(sprite, color,
+                                triangle(center, head, self.size))
+            sprite.set_colorkey(COLORKEY, pygame.RLEACCEL)
+            sprites.append(sprite)
+        return sprites
+
+    def to_pixels(self, points: np.ndarray) -> np.ndarray:
+        """Convert field positions into pixel positions."""
+        return (self.padding + points) * self.scale
+
+    def draw_background(self, target: np.ndarray, broadphase: Broadphase):
+        """
+        Draw the field, target and obstacles into the background.
+
+        Args:
+            target (np.ndarray): Target position
+            broadphase (Broadphase): Obstacles to draw
+        """
+        background = pygame.Surface(self.surface.get_size())
+        background.fill(FIELD_COLOR)
+
+        # Target
+        pygame.draw.circle(background, BLACK, self.to_pixels(target),
+                           TARGET_RADIUS * self.scale, 0)
+
+        # Obstacles
+        for center, radius in zip(broadphase.centers, broadphase.radii):
+            pygame.draw.circle(background, OBSTACLE_COLOR,
+                               self.to_pixels(center), radius * self.scale)
+        for start, end in zip(broadphase.starts, broadphase.ends):
+            pygame.draw.aaline(background, OBSTACLE_COLOR,
+                               self.to_pixels(start), self.to_pixels(end))
+
+        self.background = background
+
+    def draw(self,
+             sheep: np.ndarray,
+             dog: np.ndarray,
+             target: np.ndarray,
+             sheep_dir: np.ndarray,
+             dog_dir: np.ndarray,
+             broadphase: Broadphase):
+        """
+        Draw one game state.
+
+        Args:
+            sheep (np.ndarray): Sheep positions, shape (S, 2)
+            dog (np.ndarray): Dog positions, shape (D, 2)
+            target (np.ndarray): Target position, shape (2,)
+            sheep_dir (np.ndarray): Sheep headings, shape (S, 2)
+            dog_dir (np.ndarray): Dog headings, shape (D, 2)
+            broadphase (Broadphase): Obstacles of the game
+        """
+        if self.atlas is None:
+            self.atlas = {color: self.make_sprites(color)
+                          for color in [DOG_COLOR, WHITE]}
+            self.half = self.atlas[WHITE][0].get_width() / 2
+
+        # Rebuild the background if the target or obstacles moved
+        scene = (tuple(np.asarray(target, dtype=float)), broadphase)
+        if self.scene is None or self.scene[0] != scene[0] or \
+                self.scene[1] is not broadphase:
+            self.draw_background(target, broadphase)
+            self.scene = scene
+            self.surface.blit(self.background, (0, 0))
+            self.drawn = []
+            self.dirty = None
+        else:
+            # Erase the agents and overlays of the last frame
+            self.surface.blits([(self.background, rect, rect)
+                                for rect in self.drawn], False)
+            self.mark(self.drawn)
+            self.drawn = []
+
+        # Dogs then sheep, so sheep are drawn on top as before
+        for pos, heading, color in [(dog, dog_dir, DOG_COLOR),
+                                    (sheep, sheep_dir, WHITE)]:
+            corners = np.round(self.to_pixels(pos) - self.half).astype(int)
+            frames = np.round(np.arctan2(heading[:, 1], heading[:, 0]) /
+                              (2*np.pi) * self.angles).astype(int) % \
+                self.angles
+            frames[~np.any(heading != 0, axis=1)] = self.angles
+
+            sprites = self.atlas[color]
+            self.add(self.surface.blits(
+                [(sprites[frame], tuple(corner))
+                 for frame, corner in zip(frames.tolist(), corners.tolist())]))
+
+    def add(self, rects: List[pygame.Rect]):
+        """
+        Record areas drawn over the background, such as text overlays.
+
+        They are erased on the next draw and sent with the next display
+        update.
+
+        Args:
+            rects (List[pygame.Rect]): Areas drawn on the surface
+        """
+        self.drawn.extend(rects)
+        self.mark(rects)
+
+    def mark(self, rects: List[pygame.Rect]):
+        """Add areas to the next display update."""
+        if self.dirty is not None:
+            self.dirty.extend(rects)
+            if len(self.dirty) > MAX_DIRTY:
+                self.dirty = None
+
+    def flush(self) -> Optional[List[pygame.Rect]]:
+        """
+        Take the areas changed since the last display update.
+
+        Returns:
+            Optional[List[pygame.Rect]]: Changed areas, None if the whole
+                surface changed
+        """
+        dirty, self.dirty = self.dirty, []
+        return dirty
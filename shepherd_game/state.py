@@ -0,0 +1,130 @@
+import dataclasses
+import operator
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Random generators of Game and VecGame
+RNG_NAMES = ('sheep_rng', 'target_rng', 'dog_rng', 'graze_rng')
+
+
+class HerdState:
+    __slots__ = ['sheep', 'dog', 'target', 'heading', 'next_heading',
+                 'sheep_dir', 'dog_dir', 'start', 'offsets', 'movement']
+
+    def __init__(self,
+                 num_dog: int,
+                 num_sheep: int,
+                 dtype: type = np.float64,
+                 num_envs: Optional[int] = None):
+        """
+        Live arrays of a Game, or of every game of a VecGame.
+
+        Everything a step writes is allocated here once and updated in
+        place, the game only reads it through herd_property. start, offsets
+        and movement are per sheep scratch of the step.
+
+        Args:
+            num_dog (int): Number of dogs
+            num_sheep (int): Number of sheep
+            dtype (type): Float type of the arrays. Defaults to np.float64
+            num_envs (Optional[int]): Games of a VecGame, the first axis of
+                every array. If None, there is no game axis. Defaults to None
+        """
+        batch = () if num_envs is None else (num_envs,)
+        self.sheep = np.zeros(batch + (num_sheep, 2), dtype)
+        self.dog = np.zeros(batch + (num_dog, 2), dtype)
+        self.target = np.zeros(batch + (2,), dtype)
+        self.dog_dir = np.zeros_like(self.dog)
+        for name in ['heading', 'next_heading', 'sheep_dir', 'start',
+                     'offsets', 'movement']:
+            setattr(self, name, np.zeros_like(self.sheep))
+
+    def swap_headings(self):
+        """Make next_heading the heading, reusing the old one next step."""
+        self.heading, self.next_heading = self.next_heading, self.heading
+
+
+def herd_property(name: str) -> property:
+    """
+    Read only attribute forwarding to an array of the HerdState in herd.
+
+    Args:
+        name (str): Array of HerdState
+
+    Returns:
+        property: Property for a Game or VecGame class
+    """
+    return property(operator.attrgetter('herd.' + name),
+                    doc=f"{name} of the herd, written in place")
+
+
+@dataclasses.dataclass()
+class GameState:
+    """
+    Simulation state of a Game, or of every game of a VecGame.
+
+    Holds copies of the arrays that a step reads and writes, and the state
+    of the random generators, but no pygame or recording state. For a
+    VecGame every array has the game as its first axis.
+    """
+    sheep: np.ndarray
+    dog: np.ndarray
+    target: np.ndarray
+    heading: np.ndarray
+    sheep_dir: np.ndarray
+    dog_dir: np.ndarray
+    rng: Dict[str, dict]
+    # Grazing draws made by Game but not used yet
+    graze: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    # Steps of each game of a VecGame
+    steps: Optional[np.ndarray] = None
+
+    ARRAYS = ('sheep', 'dog', 'target', 'heading', 'sheep_dir', 'dog_dir')
+
+    @classmethod
+    def capture(cls, game, **extra) -> 'GameState':
+        """
+        Copy the state of a game.
+
+        Args:
+            game: Game or VecGame
+            **extra: Other fields, such as graze or steps
+
+        Returns:
+            GameState: Copy of the state
+        """
+        arrays = {name: np.array(getattr(game, name)) for name in cls.ARRAYS}
+        rng = {name: getattr(game, name).bit_generator.state
+               for name in RNG_NAMES}
+        return cls(rng=rng, **arrays, **extra)
+
+    def apply(self, game, idx: Optional[np.ndarray] = None):
+        """
+        Copy the arrays of the state into a game.
+
+        Args:
+            game: Game or VecGame
+            idx (Optional[np.ndarray]): Games of a VecGame to write into. If
+                None, the whole arrays are overwritten. Defaults to None.
+        """
+        for name in self.ARRAYS:
+            value = getattr(self, name)
+            current = getattr(game, name)
+            if idx is None:
+                if np.shape(current) != value.shape:
+                    raise ValueError(
+                        f"Snapshot {name} has shape {value.shape}, the game "
+                        f"has {np.shape(current)}")
+                np.copyto(current, value)
+            else:
+                if current.shape[1:] != value.shape[-current.ndim+1:]:
+                    raise ValueError(
+                        f"Snapshot {name} has shape {value.shape}, the games "
+                        f"have {current.shape[1:]}")
+                current[idx] = value
+
+    def apply_rngs(self, game):
+        """Restore the random generators of a game."""
+        for name in RNG_NAMES:
+            getattr(game, name).bit_generator.state = self.rng[name]
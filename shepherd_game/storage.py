@@ -0,0 +1,340 @@
+import functools
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from shepherd_game.recorder import SPAWN_ARRAYS
+
+INDEX_FILE = 'index.json'
+EPISODES_FILE = 'episodes.jsonl'
+FORMAT_VERSION = 1
+
+
+def _chunk_path(root: str, name: str, chunk: int, compress: bool) -> str:
+    """Path of one chunk of one array."""
+    ext = 'npz' if compress else 'npy'
+    return os.path.join(root, name, f'{chunk:05d}.{ext}')
+
+
+class ChunkWriter:
+    def __init__(self,
+                 save_dir: str,
+                 chunk_size: int = 1024,
+                 compress: bool = False):
+        """
+        Write episodes as chunked binary arrays with an episode index.
+
+        The steps of all episodes are appended to one step axis per array
+        (frames, dog, sheep, action, dog_dir, sheep_dir) and saved in chunks
+        of chunk_size steps, so chunk i always starts at step i*chunk_size.
+        Finished episodes are appended to episodes.jsonl with their step
+        range, target, success and spawn state once all their steps are in
+        saved chunks, so a crash only loses the unsaved tail.
+
+        Args:
+            save_dir (str): Directory of the run, must not hold another run
+            chunk_size (int): Steps per chunk. Defaults to 1024
+            compress (bool): Compress chunks with zlib. Compressed chunks
+                cannot be memory-mapped by the reader. Defaults to False
+        """
+        if os.path.exists(os.path.join(save_dir, INDEX_FILE)):
+            raise FileExistsError(f"{save_dir} already holds a run")
+        os.makedirs(save_dir, exist_ok=True)
+
+        self.save_dir = save_dir
+        self.index = {
+            'version': FORMAT_VERSION,
+            'chunk_size': chunk_size,
+            'compress': compress,
+            'arrays': {},
+        }
+        # Rows of the open chunk, memory-mapped unless compressing
+        self.chunk: Dict[str, np.ndarray] = {}
+        self.rows = 0
+        self.saved_steps = 0
+        self.num_chunks = 0
+        self.pending = []
+        self.episode = None
+
+    @property
+    def num_steps(self) -> int:
+        """Steps written so far, saved or in the open chunk."""
+        return self.saved_steps + self.rows
+
+    def start(self,
+              trial: int,
+              spawn: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Start writing a new episode, dropping an unfinished one.
+
+        Args:
+            trial (int): Run number of the episode
+            spawn (Optional[Dict[str, np.ndarray]]): State before the first
+                step, with the arrays of recorder.SPAWN_ARRAYS, stored in
+                single precision like the steps. Defaults to None.
+        """
+        self.discard()
+        self.episode = {'trial': trial, 'start': self.num_steps}
+        if spawn is not None:
+            self.episode['spawn'] = {
+                name: np.asarray(spawn[name], dtype=np.float32).tolist()
+                for name in SPAWN_ARRAYS}
+
+    def step(self,
+             dog: np.ndarray,
+             sheep: np.ndarray,
+             frame: Optional[np.ndarray] = None,
+             action: Optional[np.ndarray] = None,
+             dog_dir: Optional[np.ndarray] = None,
+             sheep_dir: Optional[np.ndarray] = None):
+        """
+        Write one step.
+
+        Args:
+            dog (np.ndarray): Dog positions, shape (D, 2)
+            sheep (np.ndarray): Sheep positions, shape (S, 2)
+            frame (Optional[np.ndarray]): RGB frame indexed as [x, y].
+                Defaults to None.
+            action (Optional[np.ndarray]): Dog actions, shape (D, 2). Zero
+                if not given. Defaults to None.
+            dog_dir (Optional[np.ndarray]): Dog headings, shape (D, 2).
+                Defaults to None.
+            sheep_dir (Optional[np.ndarray]): Sheep headings, shape (S, 2).
+                Defaults to None.
+        """
+        if action is None:
+            action = np.zeros_like(dog)
+        arrays = {
+            'dog': np.asarray(dog, dtype=np.float32),
+            'sheep': np.asarray(sheep, dtype=np.float32),
+            'action': np.asarray(action, dtype=np.float32),
+        }
+        for name, value in [('dog_dir', dog_dir), ('sheep_dir', sheep_dir)]:
+            if value is not None:
+                arrays[name] = np.asarray(value, dtype=np.float32)
+        if frame is not None:
+            arrays['frames'] = np.asarray(frame, dtype=np.uint8)
+
+        if not self.index['arrays']:
+            # The first step decides which arrays the run has
+            for name, value in arrays.items():
+                self.index['arrays'][name] = {
+                    'dtype': value.dtype.str, 'shape': list(value.shape)}
+                os.makedirs(os.path.join(self.save_dir, name))
+            path = os.path.join(self.save_dir, INDEX_FILE)
+            with open(path + '.tmp', 'w') as file:
+                json.dump(self.index, file)
+            os.replace(path + '.tmp', path)
+        assert arrays.keys() == self.index['arrays'].keys(), \
+            "Every step must record the same arrays"
+
+        if not self.chunk:
+            self._open_chunk()
+        for name, value in arrays.items():
+            self.chunk[name][self.rows] = value
+        self.rows += 1
+
+        if self.rows == self.index['chunk_size']:
+            self._save_chunk()
+
+    def finish(self, target: np.ndarray, success: bool = True):
+        """
+        Finish the episode and add it to the index.
+
+        Args:
+            target (np.ndarray): Target position of the episode
+            success (bool): Whether the sheep reached the target.
+                Defaults to True
+        """
+        self.episode['length'] = self.num_steps - self.episode['start']
+        self.episode['target'] = [float(x) for x in target]
+        self.episode['success'] = bool(success)
+        self.pending.append(self.episode)
+        self.episode = None
+        self._save_episodes()
+
+    def discard(self):
+        """
+        Drop the unfinished episode, if there is one.
+
+        Steps of the episode in the open chunk are overwritten by the next
+        steps. Steps in saved chunks stay there but are never indexed.
+        """
+        if self.episode is None:
+            return
+        self.rows = max(self.episode['start'] - self.saved_steps, 0)
+        self.episode = None
+
+    def close(self):
+        """Drop any unfinished episode and save the remaining steps."""
+        self.discard()
+        self._save_chunk()
+
+    def _open_chunk(self):
+        """Allocate the rows of the next chunk."""
+        size = self.index['chunk_size']
+        for name, info in self.index['arrays'].items():
+            shape = (size,) + tuple(info['shape'])
+            if self.index['compress']:
+                self.chunk[name] = np.zeros(shape, dtype=info['dtype'])
+            else:
+                # Rows go straight to disk so frames do not pile up in memory
+                self.chunk[name] = np.lib.format.open_memmap(
+                    self._chunk_file(name) + '.tmp', mode='w+',
+                    dtype=info['dtype'], shape=shape)
+
+    def _save_chunk(self):
+        """Save the open chunk and index the episodes it completes."""
+        if self.rows == 0:
+            for name in list(self.chunk):
+                self._drop_chunk(name)
+            return
+
+        for name in list(self.chunk):
+            path = self._chunk_file(name)
+            if self.index['compress']:
+                with open(path + '.tmp', 'wb') as file:
+                    np.savez_compressed(file, data=self.chunk[name][:self.rows])
+            elif self.rows < self.index['chunk_size']:
+                # Cut the last chunk of the run down to the rows it uses
+                with open(path + '.tmp2', 'wb') as file:
+                    np.save(file, self.chunk[name][:self.rows])
+                self._drop_chunk(name)
+                os.replace(path + '.tmp2', path + '.tmp')
+            else:
+                self.chunk[name].flush()
+            self.chunk.pop(name, None)
+            os.replace(path + '.tmp', path)
+
+        self.num_chunks += 1
+        self.saved_steps += self.rows
+        self.rows = 0
+        self._save_episodes()
+
+    def _drop_chunk(self, name: str):
+        """Forget the rows of one array of the open chunk."""
+        data = self.chunk.pop(name)
+        if isinstance(data, np.memmap):
+            path = data.filename
+            del data
+            os.remove(path)
+
+    def _chunk_file(self, name: str) -> str:
+        """Path of the open chunk of one array."""
+        return _chunk_path(self.save_dir, name, self.num_chunks,
+                           self.index['compress'])
+
+    def _save_episodes(self):
+        """Index every finished episode whose steps are all saved."""
+        saved = [episode for episode in self.pending
+                 if episode['start'] + episode['length'] <= self.saved_steps]
+        if not saved:
+            return
+
+        with open(os.path.join(self.save_dir, EPISODES_FILE), 'a') as file:
+            for episode in saved:
+                file.write(json.dumps(episode) + '\n')
+        self.pending = self.pending[len(saved):]
+
+
+class EpisodeReader:
+    def __init__(self, save_dir: str, cache_chunks: int = 8):
+        """
+        Read a run written by ChunkWriter.
+
+        Uncompressed chunks are memory-mapped, so an episode that lies in one
+        chunk is returned as a zero copy view. Compressed chunks are
+        decompressed on first use and kept in a small LRU cache.
+
+        Args:
+            save_dir (str): Directory of the run
+            cache_chunks (int): Decompressed chunks to keep per array.
+                Defaults to 8
+        """
+        self.save_dir = save_dir
+        with open(os.path.join(save_dir, INDEX_FILE)) as file:
+            self.index = json.load(file)
+        self.chunk_size = self.index['chunk_size']
+        self.compress = self.index['compress']
+        self.arrays = list(self.index['arrays'])
+
+        # A line cut short by a crash is skipped
+        self.episodes = []
+        path = os.path.join(save_dir, EPISODES_FILE)
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        self.episodes.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break
+
+        cache = cache_chunks * len(self.arrays) if self.compress else None
+        self._load_chunk = functools.lru_cache(maxsize=cache)(
+            self._load_chunk)
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    def __getitem__(self, idx: int) -> Dict[str, np.ndarray]:
+        return self.episode(idx)
+
+    def episode(self, idx: int,
+                names: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Get the arrays of one episode.
+
+        Args:
+            idx (int): Episode number in the index
+            names (Optional[List[str]]): Arrays to read. If None, all arrays
+                are read. Defaults to None.
+
+        Returns:
+            Dict[str, np.ndarray]: Arrays with the step as the first axis,
+                plus 'target' and 'success', and the 'spawn' state if it was
+                recorded
+        """
+        info = self.episodes[idx]
+        start, stop = info['start'], info['start'] + info['length']
+        data = {name: self.steps(name, start, stop)
+                for name in (names or self.arrays)}
+        data['target'] = np.array(info['target'])
+        data['success'] = info['success']
+        if 'spawn' in info:
+            data['spawn'] = {
+                name: np.array(value, dtype=np.float32).reshape(-1, 2)
+                for name, value in info['spawn'].items()}
+        return data
+
+    def steps(self, name: str, start: int, stop: int) -> np.ndarray:
+        """
+        Get a range of steps of one array across the whole run.
+
+        Args:
+            name (str): Array name, such as 'frames' or 'dog'
+            start (int): First step
+            stop (int): Step after the last one
+
+        Returns:
+            np.ndarray: The steps. A view when they lie in one chunk
+        """
+        first = start // self.chunk_size
+        last = max((stop - 1) // self.chunk_size, first)
+
+        parts = []
+        for chunk in range(first, last + 1):
+            offset = chunk * self.chunk_size
+            data = self._load_chunk(name, chunk)
+            parts.append(data[max(start - offset, 0):stop - offset])
+
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def _load_chunk(self, name: str, chunk: int) -> np.ndarray:
+        """Open one chunk of one array."""
+        path = _chunk_path(self.save_dir, name, chunk, self.compress)
+        if self.compress:
+            with np.load(path) as data:
+                return data['data']
+        return np.load(path, mmap_mode='r')
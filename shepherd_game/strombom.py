@@ -0,0 +1,224 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+from shepherd_game.parameters import P_A, P_C, P_H, P_S, R_A, R_S
+from shepherd_game.utils import unit_vects
+
+# Ways to combine the repulsion of several dogs. 'nearest' and 'sum' update
+# each sheep once per step, 'sequential' once per dog, which is the original
+# update
+MULTI_DOG = ('nearest', 'sum', 'sequential')
+
+# Work arrays of FlockScratch, with whether they hold floats or flags
+SCRATCH = (('offsets', True), ('flock', True), ('dists', True),
+           ('weights', True), ('seen', False), ('close', False),
+           ('before', False))
+
+
+class FlockScratch:
+    __slots__ = [name for name, _ in SCRATCH] + ['dtype']
+
+    def __init__(self, dtype: type = np.float64):
+        """
+        Work arrays of flock_headings, reused from step to step.
+
+        Every array holds one row per pair of a reacting sheep and a flock
+        member. They are flat, so a call takes a view of the first rows in
+        the shape it needs. They start empty and at least double when a
+        call needs more, so they only grow to the most pairs a step has
+        used, and after a few steps the dense update allocates no (R, S)
+        arrays.
+
+        Args:
+            dtype (type): Float type of the arrays. Defaults to np.float64
+        """
+        self.dtype = np.dtype(dtype)
+        for name, is_float in SCRATCH:
+            setattr(self, name, np.empty(0, self.dtype if is_float else bool))
+
+    def get(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        View of a work array, growing it if it is too small.
+
+        Args:
+            name (str): Array name in SCRATCH
+            shape (Tuple[int, ...]): Shape of the view
+
+        Returns:
+            np.ndarray: Uninitialized view of the first rows of the array
+        """
+        buffer = getattr(self, name)
+        size = int(np.prod(shape))
+        if size > len(buffer):
+            buffer = np.empty(max(size, 2*len(buffer)), buffer.dtype)
+            setattr(self, name, buffer)
+        return buffer[:size].reshape(shape)
+
+
+def react_mask(sheep: np.ndarray,
+               dog: np.ndarray,
+               visible: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Find the sheep that are reacting to a dog.
+
+    Args:
+        sheep (np.ndarray): Sheep positions, shape (..., S, 2)
+        dog (np.ndarray): Dog position, shape (..., 2)
+        visible (Optional[np.ndarray]): Which sheep can see the dog, shape
+            (..., S). If None, every sheep can see the dog. Defaults to None.
+
+    Returns:
+        np.ndarray: True for sheep within R_S of the dog that can see it
+    """
+    offsets = sheep - dog[..., None, :]
+    close = np.hypot(offsets[..., 0], offsets[..., 1]) <= R_S
+    if visible is not None:
+        close &= visible
+    return close
+
+
+def dog_repulsion(sheep: np.ndarray,
+                  dogs: np.ndarray,
+                  threat: np.ndarray,
+                  mode: str = 'nearest') -> np.ndarray:
+    """
+    Calculate the repulsion of every dog on reacting sheep in one pass.
+
+    Args:
+        sheep (np.ndarray): Positions of the reacting sheep, shape (..., R, 2)
+        dogs (np.ndarray): Dog positions, shape (..., D, 2)
+        threat (np.ndarray): Which dogs each sheep reacts to, shape
+            (..., R, D)
+        mode (str): 'nearest' to flee the nearest threatening dog, 'sum' to
+            add up a unit vector away from each of them. Defaults to
+            'nearest'
+
+    Returns:
+        np.ndarray: Dog repulsion of each sheep, shape (..., R, 2)
+    """
+    offsets = sheep[..., :, None, :] - dogs[..., None, :, :]
+    away = unit_vects(offsets)
+    if mode != 'nearest':
+        return (threat[..., None] * away).sum(axis=-2)
+
+    dists = np.where(threat, np.hypot(offsets[..., 0], offsets[..., 1]),
+                     np.inf)
+    nearest = np.argmin(dists, axis=-1)
+    return np.take_along_axis(away, nearest[..., None, None], axis=-2)[
+        ..., 0, :]
+
+
+def flock_headings(sheep: np.ndarray,
+                   flock: np.ndarray,
+                   self_idx: np.ndarray,
+                   dog_repul: np.ndarray,
+                   heading: np.ndarray,
+                   num_nearest: int,
+                   visible: Optional[np.ndarray] = None,
+                   scratch: Optional[FlockScratch] = None) -> np.ndarray:
+    """
+    Calculate the heading of every sheep reacting to a dog at once.
+
+    This is the vectorized form of the per-sheep loop in Game.step: LCM
+    attraction to the nearest seen sheep, local repulsion from seen sheep
+    within R_A, repulsion from the dogs and the previous heading.
+
+    Args:
+        sheep (np.ndarray): Positions of the reacting sheep, shape (..., R, 2)
+        flock (np.ndarray): Positions of the whole flock, shape (..., S, 2).
+            Can also be given per reacting sheep, shape (..., R, S, 2)
+        self_idx (np.ndarray): Index of each reacting sheep in the flock,
+            shape (R,) or (..., R)
+        dog_repul (np.ndarray): Repulsion from the dogs, shape (..., R, 2)
+        heading (np.ndarray): Previous heading of the reacting sheep,
+            shape (..., R, 2)
+        num_nearest (int): Number of nearest seen sheep used for the LCM
+        visible (Optional[np.ndarray]): Which flock members each reacting
+            sheep can see, shape (..., R, S). If None, all sheep can be seen.
+            Defaults to None.
+        scratch (Optional[FlockScratch]): Work arrays for the (..., R, S)
+            pairs. If None, they are allocated for this call. Defaults to
+            None.
+
+    Returns:
+        np.ndarray: Next heading of the reacting sheep, shape (..., R, 2)
+    """
+    if flock.ndim == sheep.ndim:
+        flock = flock[..., None, :, :]
+    num_flock = flock.shape[-2]
+    if scratch is None:
+        scratch = FlockScratch(dtype=np.result_type(sheep, flock))
+    pairs = np.broadcast_shapes(sheep.shape[:-1] + (1,), flock.shape[:-1])
+
+    # Vectors from each neighbor to the sheep
+    offsets = np.subtract(sheep[..., :, None, :], flock,
+                          out=scratch.get('offsets', pairs + (2,)))
+    dists = np.hypot(offsets[..., 0], offsets[..., 1],
+                     out=scratch.get('dists', pairs))
+
+    # A sheep never counts itself as a neighbor
+    seen = scratch.get('seen', pairs)
+    if visible is None:
+        seen.fill(True)
+    else:
+        np.copyto(seen, visible)
+    self_idx = np.broadcast_to(self_idx, pairs[:-1])
+    np.put_along_axis(seen, self_idx[..., None], False, axis=-1)
+
+    # Partial selection of the n nearest seen sheep for the LCM
+    if num_nearest < num_flock - 1:
+        ranked = np.where(seen, dists, np.inf)
+        nearest = np.argpartition(ranked, num_nearest - 1, axis=-1)
+        chosen = np.zeros_like(seen)
+        np.put_along_axis(chosen, nearest[..., :num_nearest], True, axis=-1)
+        chosen &= seen
+    else:
+        chosen = seen
+
+    # LCM of the chosen sheep, only valid if any sheep can be seen
+    count = chosen.sum(axis=-1)
+    weights = scratch.get('weights', pairs)
+    np.copyto(weights, chosen)
+    lcm = (weights[..., None, :] @ flock)[..., 0, :] / \
+        np.maximum(count, 1)[..., None]
+
+    # Local repulsion from seen sheep within R_A, with the offsets turned
+    # into unit vectors in place. Zero length offsets stay zero
+    close = np.less_equal(dists, R_A, out=scratch.get('close', pairs))
+    close &= seen
+    np.maximum(dists, np.finfo(dists.dtype).tiny, out=dists)
+    np.divide(offsets, dists[..., None], out=offsets)
+    np.multiply(offsets, close[..., None], out=offsets)
+    local_repul = offsets.sum(axis=-2)
+
+    return combine_headings(sheep, lcm, count > 0, local_repul, dog_repul,
+                            heading)
+
+
+def combine_headings(sheep: np.ndarray,
+                     lcm: np.ndarray,
+                     has_lcm: np.ndarray,
+                     local_repul: np.ndarray,
+                     dog_repul: np.ndarray,
+                     heading: np.ndarray) -> np.ndarray:
+    """
+    Weight the Strombom terms into the next heading of reacting sheep.
+
+    Args:
+        sheep (np.ndarray): Positions of the reacting sheep, shape (..., R, 2)
+        lcm (np.ndarray): LCM of the sheep each one can see, shape (..., R, 2)
+        has_lcm (np.ndarray): False where a sheep sees no others, shape (..., R)
+        local_repul (np.ndarray): Sum of unit vectors away from close
+            neighbors, shape (..., R, 2)
+        dog_repul (np.ndarray): Repulsion from the dogs, shape (..., R, 2)
+        heading (np.ndarray): Previous heading of the reacting sheep,
+            shape (..., R, 2)
+
+    Returns:
+        np.ndarray: Next heading of the reacting sheep, shape (..., R, 2)
+    """
+    lcm_attract = np.where(has_lcm[..., None], unit_vects(lcm - sheep), 0)
+    local_repul = unit_vects(local_repul)
+
+    return P_C*lcm_attract + P_A*local_repul + P_S*dog_repul + P_H*heading
@@ -0,0 +1,311 @@
+import multiprocessing as mp
+import os
+import traceback
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from shepherd_game.raster import Rasterizer
+
+
+def _views(blocks: Dict[str, shared_memory.SharedMemory],
+           specs: Dict[str, Tuple]) -> Dict[str, np.ndarray]:
+    """Arrays on top of shared memory blocks."""
+    return {key: np.ndarray(shape, dtype, buffer=blocks[key].buf)
+            for key, (_, shape, dtype) in specs.items()}
+
+
+def _worker(remote,
+            specs: Dict[str, Tuple],
+            envs: List[int],
+            seeds: List[np.random.SeedSequence],
+            max_steps: Optional[int],
+            frame_scale: Optional[float],
+            game_kwargs: List[dict]):
+    """
+    Run a group of games in a worker process.
+
+    Args:
+        remote (Connection): Command channel to the parent
+        specs (Dict[str, Tuple]): Name, shape and dtype of each shared array
+        envs (List[int]): Index of each game of this worker in the batch
+        seeds (List[np.random.SeedSequence]): Seed of each game
+        max_steps (Optional[int]): Steps before a game is ended
+        frame_scale (Optional[float]): Frame resolution, None for no frames
+        game_kwargs (List[dict]): Other arguments for Game, one per game
+    """
+    # Imported here so the parent never loads pygame
+    from shepherd_game.game import Game
+
+    blocks = {key: shared_memory.SharedMemory(name=spec[0])
+              for key, spec in specs.items()}
+    arrays = _views(blocks, specs)
+
+    def write(env, game):
+        arrays['dog'][env] = game.dog
+        arrays['sheep'][env] = game.sheep
+        arrays['target'][env] = game.target
+        if 'frames' in arrays:
+            arrays['frames'][env] = game.observe()
+
+    try:
+        games = []
+        for env, seed, kwargs in zip(envs, seeds, game_kwargs):
+            game = Game(headless=True, frame_scale=frame_scale, **kwargs)
+            game.seed_rngs(seed)
+            game.reset()
+            games.append(game)
+            write(env, game)
+        remote.send(('ok', None))
+
+        while True:
+            command, data = remote.recv()
+            if command == 'step':
+                for env, game in zip(envs, games):
+                    ended = game.step(arrays['action'][env])
+                    arrays['steps'][env] += 1
+                    if ended and game.save:
+                        game.save_data()
+                    if max_steps is not None and \
+                            arrays['steps'][env] >= max_steps:
+                        ended = True
+
+                    # Ended games are reset in place, as in VecGame
+                    arrays['done'][env] = ended
+                    if ended:
+                        game.reset()
+                        arrays['steps'][env] = 0
+                    write(env, game)
+            elif command == 'reset':
+                for env, game in zip(envs, games):
+                    if data[env]:
+                        game.reset()
+                        arrays['steps'][env] = 0
+                        arrays['done'][env] = False
+                        write(env, game)
+            elif command == 'close':
+                for game in games:
+                    game.close()
+                remote.send(('ok', None))
+                break
+            remote.send(('ok', None))
+    except Exception:
+        remote.send(('error', traceback.format_exc()))
+    finally:
+        del arrays
+        for block in blocks.values():
+            block.close()
+        remote.close()
+
+
+class SubprocVecGame:
+    def __init__(self,
+                 num_envs: int,
+                 workers: Optional[int] = None,
+                 seed: Optional[int] = None,
+                 max_steps: Optional[int] = None,
+                 frame_scale: Optional[float] = 1,
+                 start_method: Optional[str] = None,
+                 **game_kwargs):
+        """
+        Run a batch of Game instances in worker processes.
+
+        Each worker owns its games and their pygame state, and writes
+        positions, frames and done flags straight into shared memory. The
+        parent reads them as arrays without copying, and only short commands
+        go over the pipes; actions are written to shared memory too.
+
+        The arrays dog, sheep, target, frames, done and steps are views of
+        the shared buffers. They are overwritten by the next step. As in
+        VecGame, games that end are reset in place, so the arrays always hold
+        running games and done tells which ones ended on the last step.
+
+        Args:
+            num_envs (int): Number of games in the batch
+            workers (Optional[int]): Worker processes. Defaults to the number
+                of CPUs, at most num_envs
+            seed (Optional[int]): Seed of the batch. Each game gets its own
+                stream spawned from it. Defaults to None.
+            max_steps (Optional[int]): End a game after this many steps even
+                if the sheep are not in the goal. Defaults to None.
+            frame_scale (Optional[float]): Frame resolution, passed to Game.
+                If None, no frames are drawn. Defaults to 1
+            start_method (Optional[str]): multiprocessing start method, such
+                as 'spawn'. Defaults to the platform default
+            **game_kwargs: Other arguments for Game, such as num_sheep or
+                num_dog. With a save_dir, game k saves to save_dir/env<k>/
+                so games never share run numbers
+        """
+        num_dog = game_kwargs.get('num_dog', 1)
+        num_sheep = game_kwargs.get('num_sheep', 5)
+        self.num_envs = num_envs
+        workers = max(min(workers or mp.cpu_count(), num_envs), 1)
+
+        # Each game saves to its own directory, run numbers are per game
+        env_kwargs = [game_kwargs] * num_envs
+        save_dir = game_kwargs.get('save_dir')
+        if save_dir is not None:
+            os.makedirs(save_dir, exist_ok=True)
+            env_kwargs = [dict(game_kwargs, save_dir=os.path.join(
+                save_dir, f'env{env}', '')) for env in range(num_envs)]
+
+        shapes = {
+            'action': ((num_envs, num_dog, 2), np.float64),
+            'dog': ((num_envs, num_dog, 2), np.float64),
+            'sheep': ((num_envs, num_sheep, 2), np.float64),
+            'target': ((num_envs, 2), np.float64),
+            'done': ((num_envs,), np.bool_),
+            'steps': ((num_envs,), np.int64),
+        }
+        if frame_scale is not None:
+            size = Rasterizer(frame_scale).size
+            shapes['frames'] = ((num_envs,) + size + (3,), np.uint8)
+
+        self.blocks = {}
+        self.remotes = []
+        self.processes = []
+        self.waiting = False
+        self.closed = False
+        try:
+            specs = {}
+            for key, (shape, dtype) in shapes.items():
+                nbytes = max(int(np.prod(shape)) *
+                             np.dtype(dtype).itemsize, 1)
+                self.blocks[key] = shared_memory.SharedMemory(create=True,
+                                                              size=nbytes)
+                specs[key] = (self.blocks[key].name, shape,
+                              np.dtype(dtype).str)
+            # No local views, so the blocks can be closed if startup fails
+            self.__dict__.update(_views(self.blocks, specs))
+            for key in self.blocks:
+                getattr(self, key).fill(0)
+
+            # Contiguous blocks of games per worker
+            context = mp.get_context(start_method)
+            seeds = np.random.SeedSequence(seed).spawn(num_envs)
+            groups = np.array_split(np.arange(num_envs), workers)
+            for envs in groups:
+                remote, child = context.Pipe()
+                process = context.Process(
+                    target=_worker, daemon=True,
+                    args=(child, specs, envs.tolist(),
+                          [seeds[env] for env in envs], max_steps,
+                          frame_scale, [env_kwargs[env] for env in envs]))
+                process.start()
+                child.close()
+                self.remotes.append(remote)
+                self.processes.append(process)
+
+            self._wait()
+        except BaseException:
+            # Workers that started fine are stopped without a handshake
+            self.closed = True
+            self._release(terminate=True)
+            raise
+
+    def step_async(self, direction: np.ndarray):
+        """
+        Start a step of every game without waiting for it.
+
+        Args:
+            direction (np.ndarray): Movement of each dog, shape (N, D, 2)
+        """
+        assert np.shape(direction) == self.action.shape, \
+            "Wrong number of actions"
+        self.action[:] = direction
+        for remote in self.remotes:
+            remote.send(('step', None))
+        self.waiting = True
+
+    def step_wait(self) -> np.ndarray:
+        """
+        Wait for the step started by step_async.
+
+        Returns:
+            np.ndarray: True for each game that ended on this step. A view
+                of the shared buffer
+        """
+        self._wait()
+        self.waiting = False
+        return self.done
+
+    def step(self, direction: np.ndarray) -> np.ndarray:
+        """
+        Calculate one game step for every game in the batch.
+
+        Args:
+            direction (np.ndarray): Movement of each dog, shape (N, D, 2)
+
+        Returns:
+            np.ndarray: True for each game that ended on this step
+        """
+        self.step_async(direction)
+        return self.step_wait()
+
+    def reset(self, mask: Optional[np.ndarray] = None):
+        """
+        Reset games by randomizing locations.
+
+        Args:
+            mask (Optional[np.ndarray]): Which games to reset, shape (N,). If
+                None, every game is reset. Defaults to None.
+        """
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        for remote in self.remotes:
+            remote.send(('reset', np.asarray(mask, dtype=bool)))
+        self._wait()
+
+    def close(self):
+        """Stop the workers and free the shared memory."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.waiting:
+                self._wait()
+            for remote in self.remotes:
+                remote.send(('close', None))
+            self._wait()
+        except (BrokenPipeError, EOFError, RuntimeError):
+            pass
+        self._release()
+
+    def _release(self, terminate: bool = False):
+        """
+        Stop the worker processes and free the shared memory.
+
+        Args:
+            terminate (bool): Terminate the workers instead of waiting for
+                them to exit. Defaults to False
+        """
+        for process in self.processes:
+            if not terminate:
+                process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        for remote in self.remotes:
+            remote.close()
+
+        # Views have to go before the blocks can be closed
+        for key in self.blocks:
+            setattr(self, key, None)
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+    def _wait(self):
+        """Wait for every worker, raising errors from the workers."""
+        errors = []
+        for remote in self.remotes:
+            status, message = remote.recv()
+            if status == 'error':
+                errors.append(message)
+        if errors:
+            raise RuntimeError("Worker failed:\n" + errors[0])
+
+    def __del__(self):
+        if not getattr(self, 'closed', True):
+            self.close()
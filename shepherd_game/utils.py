@@ -1,5 +1,5 @@
 import math
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
@@ -37,6 +37,28 @@ def unit_vect(head, tail=np.array([0, 0])) -> np.ndarray:
     return (head-tail)/dist(head, tail)
 
 
+def unit_vects(vects: np.ndarray,
+               out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Normalize an array of vectors along the last axis.
+
+    Zero length vectors stay zero, the same as unit_vect.
+
+    Args:
+        vects (np.ndarray): Vectors, shape (..., 2)
+        out (Optional[np.ndarray]): Array to write the unit vectors into,
+            which can be vects. Defaults to None.
+
+    Returns:
+        np.ndarray: Unit vectors with the same shape as vects
+    """
+    vects = np.asarray(vects, dtype=float)
+    norm = np.hypot(vects[..., 0], vects[..., 1])[..., None]
+    # Zero length vectors are divided by one
+    norm[norm == 0] = 1
+    return np.divide(vects, norm, out=out)
+
+
 def rand_unit() -> np.ndarray:
     """Return a random unit vector."""
     return unit_vect([np.random.rand()-.5, np.random.rand()-.5])
@@ -106,6 +128,36 @@ def line_intersects(start1: np.ndarray,
     return False
 
 
+def lines_intersect(start1: np.ndarray,
+                    end1: np.ndarray,
+                    start2: np.ndarray,
+                    end2: np.ndarray) -> np.ndarray:
+    """
+    Check if many pairs of line segments intersect.
+
+    Vectorized form of line_intersects. All arguments broadcast together.
+
+    Args:
+        start1 (np.ndarray): Starts of the first segments, shape (..., 2)
+        end1 (np.ndarray): Ends of the first segments, shape (..., 2)
+        start2 (np.ndarray): Starts of the second segments, shape (..., 2)
+        end2 (np.ndarray): Ends of the second segments, shape (..., 2)
+
+    Returns:
+        np.ndarray: True where the line segments intersect
+    """
+    def orientations(p, q, r):
+        return np.sign((q[..., Y] - p[..., Y]) * (r[..., X] - q[..., X]) -
+                       (q[..., X] - p[..., X]) * (r[..., Y] - q[..., Y]))
+
+    o1 = orientations(start1, end1, start2)
+    o2 = orientations(start1, end1, end2)
+    o3 = orientations(start2, end2, start1)
+    o4 = orientations(start2, end2, end1)
+
+    return (o1 != o2) & (o3 != o4)
+
+
 def circle_intersects(start: np.ndarray,
                       end: np.ndarray,
                       circle_center: np.ndarray,
@@ -146,6 +198,39 @@ def circle_intersects(start: np.ndarray,
     return np.sum((close_point - circle_center) ** 2) <= radius ** 2
 
 
+def circles_intersect(start: np.ndarray,
+                      end: np.ndarray,
+                      circle_center: np.ndarray,
+                      radius: np.ndarray) -> np.ndarray:
+    """
+    Check if many line segments intersect with circles.
+
+    Vectorized form of circle_intersects. All arguments broadcast together.
+
+    Args:
+        start (np.ndarray): Starts of the line segments, shape (..., 2)
+        end (np.ndarray): Ends of the line segments, shape (..., 2)
+        circle_center (np.ndarray): Centers of the circles, shape (..., 2)
+        radius (np.ndarray): Radii of the circles, shape (...)
+
+    Returns:
+        np.ndarray: True where the line segment intersects the circle
+    """
+    segment = end - start
+    mag = np.sum(segment * segment, axis=-1)
+    t = np.sum((circle_center - start) * segment, axis=-1) / \
+        np.where(mag == 0, 1, mag)
+
+    # Find the point on each line segment that is closest to the center
+    close_point = np.where(((t < 0) | (mag == 0))[..., None], start,
+                           np.where((t > 1)[..., None], end,
+                                    start + t[..., None] * segment))
+
+    # Compare the distance to the closest point on the segment vs the radius
+    return np.sum((close_point - circle_center) ** 2, axis=-1) <= \
+        np.asarray(radius) ** 2
+
+
 def triangle(point: np.ndarray,
              direction: np.ndarray,
              size: float) -> List:
@@ -174,3 +259,29 @@ def triangle(point: np.ndarray,
     ])
 
     return [head, base1, base2]
+
+
+def triangles(points: np.ndarray,
+              directions: np.ndarray,
+              size: float) -> np.ndarray:
+    """
+    Generate many triangles at once, see triangle.
+
+    Args:
+        points (np.ndarray): Origins of the triangles, shape (..., 2)
+        directions (np.ndarray): Points of the triangles, shape (..., 2)
+        size (float): Size of the triangles
+
+    Returns:
+        np.ndarray: 3 points for each triangle, shape (..., 3, 2)
+    """
+    offsets = directions - points
+    angle = np.arctan2(offsets[..., Y], offsets[..., X])
+
+    head = points + unit_vects(offsets) * size * 2
+    base1 = points + size * np.stack([np.cos(angle + math.pi/4),
+                                      np.sin(angle + math.pi/4)], axis=-1)
+    base2 = points + size * np.stack([np.cos(angle - math.pi/4),
+                                      np.sin(angle - math.pi/4)], axis=-1)
+
+    return np.stack([head, base1, base2], axis=-2)
@@ -0,0 +1,345 @@
+from typing import Optional
+
+import numpy as np
+
+from shepherd_game import obstacles
+from shepherd_game.parameters import *
+from shepherd_game.state import GameState, HerdState, herd_property
+from shepherd_game.strombom import (MULTI_DOG, FlockScratch, dog_repulsion,
+                                    flock_headings, react_mask)
+from shepherd_game.utils import unit_vects
+
+
+class VecGame:
+    # State arrays, kept in self.herd and only ever written in place
+    sheep = herd_property('sheep')
+    dog = herd_property('dog')
+    target = herd_property('target')
+    heading = herd_property('heading')
+    sheep_dir = herd_property('sheep_dir')
+    dog_dir = herd_property('dog_dir')
+
+    def __init__(self,
+                 num_envs: int,
+                 seed: Optional[int] = None,
+                 random_goal: bool = False,
+                 start_in_goal: bool = True,
+                 sheep_top_right: bool = True,
+                 num_dog: int = 1,
+                 num_sheep: int = 5,
+                 max_steps: Optional[int] = None,
+                 multi_dog: str = 'nearest'):
+        """
+        Create a batch of shepherding games that are stepped together.
+
+        The state of every game is kept in arrays with the environment as the
+        first axis, so one call to step advances all of them. There is no
+        pygame window, and the batch owns its own random generators.
+
+        Args:
+            num_envs (int): Number of games in the batch
+            seed (Optional[int]): Seed for the batch random generators.
+                Defaults to None.
+            random_goal (bool): Randomize the goal location. Defaults to False.
+            start_in_goal (bool): Start the shepherd in the goal location. If
+                False, the shepherd will spawn in the bottom left. Defaults
+                to True.
+            sheep_top_right (bool): Start the sheep in the top right corner. If
+                False, the sheep can spawn anywhere. Defaults to True
+            num_dog (int): The number of dogs in each game. Defaults to 1
+            num_sheep (int): The number of sheep in each game. Defaults to 5
+            max_steps (Optional[int]): End a game after this many steps even
+                if the sheep are not in the goal. Defaults to None.
+            multi_dog (str): How sheep react to several dogs, as in Game.
+                Defaults to 'nearest'
+        """
+        if multi_dog not in MULTI_DOG:
+            raise ValueError(f"Unknown multi_dog mode {multi_dog}")
+
+        self.num_envs = num_envs
+        # Spawns, targets and grazing each get their own stream, so changing
+        # one does not shift the draws of the others
+        sheep, target, dog, graze = np.random.SeedSequence(seed).spawn(4)
+        self.sheep_rng = np.random.default_rng(sheep)
+        self.target_rng = np.random.default_rng(target)
+        self.dog_rng = np.random.default_rng(dog)
+        self.graze_rng = np.random.default_rng(graze)
+        self.random_goal = random_goal
+        self.start_in_goal = start_in_goal
+        self.sheep_top_right = sheep_top_right
+        self.num_agents = num_sheep
+        self.num_nearest = self.num_agents-1
+        self.num_dog = num_dog
+        self.max_steps = max_steps
+        self.multi_dog = multi_dog
+
+        self.herd = HerdState(num_dog, num_sheep, num_envs=num_envs)
+        self.steps = np.zeros(num_envs, dtype=int)
+        self.sheep_idx = np.arange(num_sheep)
+        # Grazing draws of one pass
+        self.graze = np.zeros((num_envs, num_sheep), dtype=bool)
+        self.graze_draw = np.zeros((num_envs, num_sheep))
+        self.graze_dir = np.zeros_like(self.sheep)
+        # Pairs of the reacting sheep, grown to the largest step
+        self.scratch = FlockScratch()
+
+        self.reset()
+
+    def reset(self, mask: Optional[np.ndarray] = None):
+        """
+        Reset games by randomizing locations.
+
+        The obstacles are shared by every game in the batch, so changes to
+        them apply to the whole batch from the next reset of any game.
+
+        Args:
+            mask (Optional[np.ndarray]): Which games to reset, shape (N,). If
+                None, every game is reset. Defaults to None.
+        """
+        # Obstacle grid, only rebuilt if the obstacles changed
+        self.broadphase = obstacles.broadphase()
+
+        idx = np.arange(self.num_envs) if mask is None \
+            else np.flatnonzero(mask)
+        num = len(idx)
+        if num == 0:
+            return
+
+        if self.sheep_top_right:
+            # Randomely place the sheep in the top right quarter
+            sheep = self.sheep_rng.random((num, self.num_agents, 2)) * \
+                FIELD_LENGTH/2
+            sheep[..., 0] += FIELD_LENGTH/2
+        else:
+            # Randomly place the sheep anywhere
+            sheep = self.sheep_rng.random((num, self.num_agents, 2)) * \
+                FIELD_LENGTH
+        CoM = np.mean(sheep, axis=1)
+
+        # Place the target
+        if self.random_goal:
+            # Randomize but make sure the game isn't "won"
+            target = self.target_rng.random((num, 2))*FIELD_LENGTH/2
+            target[:, 1] += FIELD_LENGTH/2
+            won = np.linalg.norm(CoM - target, axis=1) < TARGET_RADIUS
+            while np.any(won):
+                target[won] = self.target_rng.random((won.sum(), 2)) * \
+                    FIELD_LENGTH
+                won = np.linalg.norm(CoM - target, axis=1) < TARGET_RADIUS
+        else:
+            # Bottom left corner
+            target = np.tile([0, FIELD_LENGTH-1], (num, 1)).astype(float)
+
+        if self.start_in_goal:
+            # Randomly place the dogs in the target circle
+            th = self.dog_rng.uniform(0, 2*np.pi, (num, 1))
+            r = TARGET_RADIUS * np.sqrt(self.dog_rng.uniform(0, 1, (num, 1)))
+            dog = np.stack([r*np.cos(th), r*np.sin(th)], axis=-1) + \
+                target[:, None, :]
+            dog = np.repeat(dog, self.num_dog, axis=1)
+        else:
+            # Randomly place the dogs in the bottom left corner
+            dog = self.dog_rng.random((num, self.num_dog, 2)) * \
+                FIELD_LENGTH/2
+            dog[..., 1] += FIELD_LENGTH/2
+
+        self.sheep[idx] = sheep
+        self.dog[idx] = dog
+        self.target[idx] = target
+        self.heading[idx] = 0
+        self.sheep_dir[idx] = 0
+        self.dog_dir[idx] = 0
+        self.steps[idx] = 0
+
+    def snapshot(self) -> GameState:
+        """
+        Copy the state of every game, random generators included.
+
+        Returns:
+            GameState: Copy of the state, with the game as the first axis
+        """
+        return GameState.capture(self, steps=self.steps.copy())
+
+    def restore(self, state: GameState):
+        """
+        Go back to a snapshot of this batch.
+
+        Args:
+            state (GameState): Snapshot taken with snapshot
+        """
+        if state.steps is None:
+            raise ValueError("Not a snapshot of a VecGame, use expand")
+        state.apply(self)
+        state.apply_rngs(self)
+        self.steps = state.steps.copy()
+
+    def expand(self, state: GameState, mask: Optional[np.ndarray] = None):
+        """
+        Start games from the snapshot of a single Game.
+
+        Used to branch rollouts, such as the children of a tree search node.
+        The games take the positions and headings of the snapshot and start
+        at step 0. Grazing is drawn from the batch generators, so the games
+        branch apart even with the same actions.
+
+        Args:
+            state (GameState): Snapshot taken with Game.snapshot
+            mask (Optional[np.ndarray]): Which games to start from it, shape
+                (N,). If None, every game is. Defaults to None.
+        """
+        if state.steps is not None:
+            raise ValueError("Not a snapshot of a Game, use restore")
+        idx = np.arange(self.num_envs) if mask is None \
+            else np.flatnonzero(mask)
+        state.apply(self, idx)
+        self.steps[idx] = 0
+
+    def step(self, direction: np.ndarray) -> np.ndarray:
+        """
+        Calculate one game step for every game in the batch.
+
+        Games that end are reset in place before returning, so the state
+        arrays always hold running games.
+
+        Args:
+            direction (np.ndarray): Movement direction of each dog,
+                shape (N, D, 2)
+
+        Returns:
+            np.ndarray: True for each game that ended on this step
+        """
+        assert direction.shape == self.dog.shape, "Wrong number of actions"
+        next_heading = self.herd.next_heading
+        next_heading.fill(0)
+        sheep_idx = self.sheep_idx
+
+        # Dogs only move themselves, so they can all move before the sheep
+        self.move_all(self.dog, direction, out=self.dog)
+
+        # One pass per dog when sequential, otherwise one for all of them
+        if self.multi_dog == 'sequential':
+            passes = [[idx] for idx in range(self.num_dog)]
+        else:
+            passes = [list(range(self.num_dog))]
+
+        for dog_idx in passes:
+            dogs = self.dog[:, dog_idx]
+            threat = react_mask(self.sheep[:, None], dogs).transpose(0, 2, 1)
+
+            # Only sheep close enough to react need a sight check
+            env_i, sheep_i, dog_i = np.nonzero(threat)
+            seen = self.visibility(self.sheep[env_i, sheep_i],
+                                   dogs[env_i, dog_i])
+            if seen is not None:
+                threat[env_i, sheep_i, dog_i] = seen
+            react = np.any(threat, axis=-1)
+
+            # Random chance of moving in any direction / Grazing
+            graze = np.less(self.graze_rng.random(out=self.graze_draw), GRAZE,
+                            out=self.graze)
+            graze &= ~react
+            graze_dir = self.graze_rng.random(out=self.graze_dir)
+            graze_dir -= .5
+            unit_vects(graze_dir, out=graze_dir)
+            start = self.herd.start
+            np.copyto(start, self.sheep)
+            self.sheep[graze] = self.move_all(self.sheep[graze],
+                                              graze_dir[graze])
+
+            # Only the reacting sheep of every game are updated, one per row
+            env_i, sheep_i = np.nonzero(react)
+            if len(env_i) == 0:
+                continue
+
+            # Sheep grazed earlier in this pass are seen at their new spot
+            pairs = (len(env_i), self.num_agents)
+            before = np.less(sheep_idx, sheep_i[:, None],
+                             out=self.scratch.get('before', pairs))
+            flock = self.scratch.get('flock', pairs + (2,))
+            np.take(start, env_i, axis=0, out=flock)
+            np.copyto(flock, self.sheep[env_i], where=before[..., None])
+
+            sheep = self.sheep[env_i, sheep_i, None]
+            dog_repul = dog_repulsion(sheep, dogs[env_i],
+                                      threat[env_i, sheep_i, None],
+                                      self.multi_dog)
+            visible = self.visibility(sheep[..., None, :], flock[:, None])
+            heading = flock_headings(
+                sheep, flock, sheep_i[:, None], dog_repul,
+                self.heading[env_i, sheep_i, None], self.num_nearest, visible,
+                self.scratch)
+            next_heading[env_i, sheep_i] += heading[:, 0]
+            self.sheep_dir[env_i, sheep_i] = next_heading[env_i, sheep_i]
+
+        # Remember the last movement direction of each dog
+        moving = np.linalg.norm(direction, axis=-1, keepdims=True) > 0.1
+        np.copyto(self.dog_dir, direction, where=moving)
+
+        # Update sheep location with obstacle clipping
+        movement = unit_vects(next_heading, out=self.herd.movement)
+        movement *= S_Speed
+        self.move_all(self.sheep, movement, out=self.sheep)
+
+        # Update heading for next iteration, reusing the old one next step
+        self.herd.swap_headings()
+
+        if CLIP:
+            # Clip the locations to within the field
+            np.clip(self.dog, 0, FIELD_LENGTH-1, out=self.dog)
+            np.clip(self.sheep, 0, FIELD_LENGTH-1, out=self.sheep)
+
+        # End games where all the sheep are inside the target radius
+        offsets = np.subtract(self.sheep, self.target[:, None],
+                              out=self.herd.offsets)
+        done = np.all(np.hypot(offsets[..., 0], offsets[..., 1])
+                      <= TARGET_RADIUS, axis=1)
+        self.steps += 1
+        if self.max_steps is not None:
+            done |= self.steps >= self.max_steps
+
+        self.reset(done)
+        return done
+
+    def visibility(self,
+                   points1: np.ndarray,
+                   points2: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Check which pairs of objects can see each other in every game.
+
+        Args:
+            points1 (np.ndarray): Objects, shape (..., 2)
+            points2 (np.ndarray): Objects, broadcastable against points1
+
+        Returns:
+            Optional[np.ndarray]: True where the pair can see each other.
+                None if there are no obstacles
+        """
+        if self.broadphase.num == 0:
+            return None
+        return ~self.broadphase.blocked(points1, points2)
+
+    def move_all(self,
+                 starts: np.ndarray,
+                 movements: np.ndarray,
+                 out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Move objects of every game, sliding along obstacles.
+
+        Args:
+            starts (np.ndarray): Starting points, shape (..., 2)
+            movements (np.ndarray): Directions of travel, shape (..., 2)
+            out (Optional[np.ndarray]): Array to write the new positions
+                into, such as starts. Defaults to None.
+
+        Returns:
+            np.ndarray: New positions, shape (..., 2)
+        """
+        if self.broadphase.num == 0:
+            return np.add(starts, movements, out=out)
+        ends = self.broadphase.move(starts.reshape(-1, 2),
+                                    movements.reshape(-1, 2)
+                                    ).reshape(starts.shape)
+        if out is None:
+            return ends
+        out[:] = ends
+        return out
@@ -0,0 +1,195 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.colors import LogNorm
+
+from shepherd_game.catalog import load_trial, trial_names
+from shepherd_game.parameters import FIELD_LENGTH, PADDING
+
+# Trials binned by a worker before it sends back its sums
+CHUNK_TRIALS = 64
+
+
+def _bin_trials(paths: List[str],
+                edges: Tuple[np.ndarray, np.ndarray],
+                target: Optional[np.ndarray],
+                radius: float) -> Dict[str, np.ndarray]:
+    """
+    Bin the positions of a group of trials, one trial at a time.
+
+    Args:
+        paths (List[str]): Trial folders
+        edges (Tuple[np.ndarray, np.ndarray]): Bin edges along x and y
+        target (Optional[np.ndarray]): Only bin trials with their goal within
+            radius of this location. If None, every trial is binned
+        radius (float): Distance used with target
+
+    Returns:
+        Dict[str, np.ndarray]: Sample counts and sums of the episode time of
+            the samples, for the dogs and the sheep, and the 'goals' of the
+            binned trials
+    """
+    shape = (len(edges[0]) - 1, len(edges[1]) - 1)
+    sums = {name: np.zeros(shape) for name in
+            ['dog_count', 'dog_time', 'sheep_count', 'sheep_time']}
+    goals = []
+    for path in paths:
+        trial = load_trial(path)
+        if target is not None and \
+                np.linalg.norm(trial['target'] - target) > radius:
+            continue
+        goals.append(trial['target'])
+
+        for name in ['dog', 'sheep']:
+            points = trial[name].reshape(len(trial[name]), -1, 2)
+            # Time from 0 to 1 in the episode of every sample
+            time = np.arange(len(points)) / max(len(points) - 1, 1)
+            time = np.broadcast_to(time[:, None], points.shape[:2])
+            for key, weights in [('_count', None), ('_time', time)]:
+                sums[name + key] += np.histogram2d(
+                    points[..., 0].ravel(), points[..., 1].ravel(),
+                    bins=edges, weights=None if weights is None
+                    else weights.ravel())[0]
+    sums['goals'] = np.array(goals).reshape(-1, 2)
+    return sums
+
+
+def density(data_dir: str,
+            start: int = 0,
+            end: Optional[int] = None,
+            target: Optional[np.ndarray] = None,
+            radius: float = 1,
+            bin_size: float = 1,
+            workers: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    Bin the trajectories of every dog and sheep into 2D histograms.
+
+    Trials are read one at a time by a pool of processes, each adding its
+    trials into running histograms, so memory stays bounded for any number
+    of trials.
+
+    Args:
+        data_dir (str): Directory with one folder per trial
+        start (int): Which trial to start at. Defaults to 0
+        end (Optional[int]): Which trial to stop at. If None, go to the
+            end. Defaults to None.
+        target (Optional[np.ndarray]): Only use trials with their goal within
+            radius of this location. Defaults to None.
+        radius (float): Distance used with target. Defaults to 1
+        bin_size (float): Bin width in field units. Defaults to 1
+        workers (Optional[int]): Processes binning trials. Defaults to the
+            number of CPUs.
+
+    Returns:
+        Dict[str, np.ndarray]: For 'dog' and 'sheep', the number of samples
+            in each bin, shape (X, Y), and as '<name>_time' the mean time of
+            those samples in their episode, 0 at the start and 1 at the end.
+            Also the 'goals' of the trials used and the 'extent' of the bins
+            as (left, right, bottom, top)
+    """
+    low = -np.array(PADDING, dtype=float)
+    high = FIELD_LENGTH + np.array(PADDING, dtype=float)
+    shape = np.ceil((high - low) / bin_size).astype(int)
+    edges = tuple(low[axis] + bin_size * np.arange(shape[axis] + 1)
+                  for axis in range(2))
+
+    paths = [os.path.join(data_dir, name)
+             for name in trial_names(data_dir)[start:end]]
+    chunks = [paths[i:i+CHUNK_TRIALS]
+              for i in range(0, len(paths), CHUNK_TRIALS)]
+
+    sums = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for part in pool.map(_bin_trials, chunks, [edges] * len(chunks),
+                             [target] * len(chunks), [radius] * len(chunks)):
+            for key, value in part.items():
+                if key not in sums:
+                    sums[key] = value
+                elif key == 'goals':
+                    sums[key] = np.concatenate([sums[key], value])
+                else:
+                    sums[key] += value
+
+    result = {'extent': (edges[0][0], edges[0][-1], edges[1][-1],
+                         edges[1][0]),
+              'goals': sums.get('goals', np.zeros((0, 2)))}
+    for name in ['dog', 'sheep']:
+        count = sums.get(name + '_count', np.zeros(shape))
+        time = sums.get(name + '_time', np.zeros(shape))
+        result[name] = count
+        with np.errstate(invalid='ignore'):
+            result[name + '_time'] = time / count
+    return result
+
+
+def main(data_dir: str,
+         start: int = 0,
+         end: Optional[int] = None,
+         target: Optional[np.ndarray] = None,
+         radius: float = 1,
+         bin_size: float = 1,
+         output: Optional[str] = None):
+    """
+    Generate heatmaps of where the shepherds and sheep spend their time
+
+    The top row shows how many samples fall in each bin, on a log scale, and
+    the bottom row when in the episode they were there, purple at the start
+    and yellow at the end. Every dog of every episode is included.
+
+    Args:
+        data_dir (str): Path where the data is saved
+        start (int): Which data folder to start at. Defaults to 0
+        end (int or None): Which data folder to stop at. If none, it will use
+            all of the data. Defaults to None
+        target (np.ndarray or None): Only use episodes with their goal within
+            radius of this location. Defaults to None
+        radius (float): Distance used with target. Defaults to 1
+        bin_size (float): Bin width in field units. Defaults to 1
+        output (str or None): Save the figure to this file, such as a PNG,
+            without opening a window. If None, it is shown. Defaults to None
+    """
+    if output is not None:
+        # Draw without a display
+        plt.switch_backend('Agg')
+
+    # Stream the trials into the histograms
+    hist = density(data_dir, start, end, target, radius, bin_size)
+
+    fig, axes = plt.subplots(2, 2, figsize=(10, 10))
+    for col, name in enumerate(['dog', 'sheep']):
+        count = np.ma.masked_equal(hist[name], 0)
+        image = axes[0, col].imshow(count.T, extent=hist['extent'],
+                                    norm=LogNorm(), cmap='viridis')
+        fig.colorbar(image, ax=axes[0, col], label='Samples')
+        axes[0, col].set_title(f"{name.capitalize()} occupancy")
+
+        image = axes[1, col].imshow(hist[name + '_time'].T,
+                                    extent=hist['extent'], vmin=0, vmax=1,
+                                    cmap='plasma')
+        fig.colorbar(image, ax=axes[1, col], label='Episode time')
+        axes[1, col].set_title(f"{name.capitalize()} mean time")
+
+    # Goals of the episodes used
+    goals = hist['goals']
+    for ax in axes.ravel():
+        ax.scatter(goals[:, 0], goals[:, 1], c='black', s=4)
+        ax.set_xlim(-PADDING[0], FIELD_LENGTH + PADDING[0])
+        ax.set_ylim(FIELD_LENGTH + PADDING[1], -PADDING[1])
+        ax.set_aspect('equal', 'box')
+        ax.set_xlabel("X Position")
+        ax.set_ylabel("Y Position")
+
+    fig.suptitle(f"Trajectory density of {len(goals)} episodes")
+    fig.tight_layout()
+    if output is not None:
+        fig.savefig(output)
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+if __name__ == "__main__":
+    main("data/", output="density.png")
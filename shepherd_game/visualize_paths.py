@@ -1,13 +1,13 @@
-import os
-
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.collections import LineCollection
 
+from shepherd_game.catalog import Catalog
 from shepherd_game.parameters import FIELD_LENGTH, PADDING
 
 
-def main(data_dir: str, start: int = 0, end: int = None):
+def main(data_dir: str, start: int = 0, end: int = None,
+         output: str = None):
     """
     Generate an image showcasing the paths of the shepherds
 
@@ -16,34 +16,36 @@ def main(data_dir: str, start: int = 0, end: int = None):
         start (int): Which data folder to start at. Defaults to 0
         end (int or None): Which data folder to stop at. If none, it will use
             all of the data. Defaults to None
+        output (str or None): Save the figure to this file, such as a PNG,
+            without opening a window. If None, it is shown. Defaults to None
     """
+    if output is not None:
+        # Draw without a display
+        plt.switch_backend('Agg')
     fig, ax = plt.subplots()
 
     # Colormap for the paths drawn
     cmap = plt.get_cmap('plasma')  # Choose a colormap
     norm = plt.Normalize(0, 1)  # Normalize to [0, 1]
 
-    # Build a list of data directories to check
-    dir_list = sorted(os.listdir(data_dir), key=int)
-    if end is not None:
-        dir_list = dir_list[start:end]
-    else:
-        dir_list = dir_list[start:]
+    # Pick the trials to draw from the cached catalog
+    catalog = Catalog(data_dir)
 
-    # Draw each path
-    for dir in dir_list:
-        # Read the points and convert into line segments
-        data = np.loadtxt(data_dir + dir + "/pos.csv",
-                          delimiter=',', skiprows=0)[:, :2]
-        points = np.array([data[:, 0], data[:, 1]]).T.reshape(-1, 1, 2)
-        segments = np.concatenate([points[:-1], points[1:]], axis=1)
+    # Line segments of the path of every dog, drawn as one collection
+    segments = []
+    colors = []
+    for idx in catalog.select(start, end):
+        points = catalog.dog(idx).transpose(1, 0, 2)
+        segments.append(np.stack([points[:, :-1], points[:, 1:]],
+                                 axis=2).reshape(-1, 2, 2))
 
         # Normalized values
-        colors = np.linspace(0, 1, segments.shape[0])
+        steps = points.shape[1] - 1
+        colors.append(np.tile(np.linspace(0, 1, steps), len(points)))
 
-        # Create a LineCollection
-        lc = LineCollection(segments, cmap=cmap, norm=norm)
-        lc.set_array(colors)
+    if segments:
+        lc = LineCollection(np.concatenate(segments), cmap=cmap, norm=norm)
+        lc.set_array(np.concatenate(colors))
         lc.set_linewidth(1)
         ax.add_collection(lc)
 
@@ -60,7 +62,11 @@ def main(data_dir: str, start: int = 0, end: int = None):
 
     # Display the plot
     ax.invert_yaxis()
-    plt.show()
+    if output is not None:
+        fig.savefig(output)
+        plt.close(fig)
+    else:
+        plt.show()
 
 
 if __name__ == "__main__":
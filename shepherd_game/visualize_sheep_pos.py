@@ -1,9 +1,8 @@
-import os
-
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
 import numpy as np
 
+from shepherd_game.catalog import Catalog
 from shepherd_game.parameters import FIELD_LENGTH, PADDING
 
 
@@ -17,20 +16,11 @@ def main(data_dir: str, start: int = 0, end: int = None):
         end (int or None): Which data folder to stop at. If none, it will use
             all of the data. Defaults to None
     """
-    # Build a list of data directories to check
-    dir_list = sorted(os.listdir(data_dir), key=int)
-    if end is not None:
-        dir_list = dir_list[start:end]
-    else:
-        dir_list = dir_list[start]
-
-    goals = []
-    sheep = []
-    for dir in dir_list:
-        goals.append(np.loadtxt(data_dir + dir + "/pos.csv",
-                                delimiter=',', skiprows=0)[0, 7:9])
-        sheep.append(np.loadtxt(data_dir + dir + "/sheep_pos.csv",
-                                delimiter=',', skiprows=0)[0, :])
+    # Pick the trials to draw from the cached catalog
+    catalog = Catalog(data_dir)
+    idx = catalog.select(start, end)
+    goals = catalog.targets[idx]
+    sheep = [catalog.start_sheep[i, :2*catalog.num_sheep[i]] for i in idx]
 
     # # Plot and display goals
     fig, ax = plt.subplots()
@@ -0,0 +1,5 @@
+import os
+
+# Games with a window use SDL dummy drivers, so tests run without a display
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
@@ -0,0 +1,28 @@
+import time
+
+from shepherd_game import benchmark
+
+
+def test_measure_skips_warmup():
+    calls = []
+
+    def call():
+        # Only the first call is slow, like compiling the kernels
+        if not calls:
+            time.sleep(0.2)
+        calls.append(1)
+
+    stats = benchmark.measure(call, 10, warmup=1)
+    assert stats['p99_ms'] < 100
+    assert len(calls) == 1 + 10 + 10
+
+
+def test_compare_keeps_backends_apart():
+    case = {'benchmark': 'step', 'field_length': 150, 'num_obstacles': 0,
+            'num_sheep': 5, 'num_dog': 1}
+    baseline = {'results': [dict(case, jit=True, per_sec=1000.0)]}
+    results = {'results': [dict(case, jit=False, per_sec=100.0)]}
+    assert benchmark.compare(results, baseline) == []
+
+    results['results'].append(dict(case, jit=True, per_sec=100.0))
+    assert [r['jit'] for r in benchmark.compare(results, baseline)] == [True]
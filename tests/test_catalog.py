@@ -0,0 +1,37 @@
+import os
+import shutil
+
+import numpy as np
+
+from shepherd_game.catalog import Catalog, load_trial
+from shepherd_game.generate import generate
+
+
+def test_spawn_and_success(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    generate(data_dir, 3, workers=1, seed=0, max_steps=400, frame_scale=None,
+             save_frames=False, random_goal=True)
+
+    # A trial saved before spawn.csv, and one that missed the goal
+    os.remove(os.path.join(data_dir, '1', 'spawn.csv'))
+    path = os.path.join(data_dir, '2', 'sheep_pos.csv')
+    rows = np.loadtxt(path, delimiter=',', ndmin=2)
+    rows[-1] = rows[0] + 1000
+    np.savetxt(path, rows, delimiter=',')
+
+    catalog = Catalog(data_dir, workers=1)
+    assert catalog.success.tolist() == [True, True, False]
+
+    spawn = load_trial(os.path.join(data_dir, '0'))['spawn']
+    assert np.array_equal(catalog.start_sheep[0], spawn['sheep'].ravel())
+    assert np.array_equal(catalog.start_dog[0], spawn['dog'].ravel())
+    assert not np.array_equal(catalog.start_sheep[0], catalog.sheep(0)[0])
+    assert np.array_equal(catalog.start_sheep[1], catalog.sheep(1)[0].ravel())
+
+    # Reused and newly parsed trials agree
+    shutil.copytree(os.path.join(data_dir, '0'),
+                    os.path.join(data_dir, '3'))
+    cached = Catalog(data_dir, workers=1)
+    assert cached.success.tolist() == [True, True, False, True]
+    assert np.array_equal(cached.start_sheep[:3], catalog.start_sheep)
+    assert np.array_equal(cached.start_sheep[3], catalog.start_sheep[0])
@@ -0,0 +1,108 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from shepherd_game.controller import PolicyController
+
+HORIZON = 10
+
+
+class GatedPolicy:
+    """
+    Policy whose chunk for step t is 100*t + i at index i. The first call
+    returns at once, later ones wait for a release.
+    """
+
+    def __init__(self):
+        self.gate = threading.Semaphore(0)
+        self.calls = 0
+
+    def __call__(self, step):
+        self.calls += 1
+        if self.calls > 1:
+            self.gate.acquire()
+        return np.full((HORIZON, 1, 2), 100*step) + \
+            np.arange(HORIZON)[:, None, None]
+
+
+def make_controller(**kwargs):
+    policy = GatedPolicy()
+    controller = PolicyController(policy, observe=lambda game: game.step,
+                                  **kwargs)
+    return policy, controller
+
+
+def act(controller, game, step):
+    game.step = step
+    return controller.get_input(game)[0, 0]
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline, "policy thread did not answer"
+        time.sleep(1e-3)
+
+
+def chunk_starts(controller):
+    with controller.lock:
+        return [start for start, _ in controller.chunks]
+
+
+@pytest.mark.parametrize('ensemble', [None, 1.0])
+def test_late_chunk_skips_past_steps(ensemble):
+    policy, controller = make_controller(ensemble=ensemble)
+    game = SimpleNamespace(dog=np.zeros((1, 2)), step=0)
+    # The game keeps stepping on the first chunk while step 1 is inferred
+    assert [act(controller, game, step) for step in range(2)] == [0, 1]
+    wait_for(lambda: policy.calls == 2)
+    assert [act(controller, game, step) for step in range(2, 4)] == [2, 3]
+
+    policy.gate.release()
+    wait_for(lambda: chunk_starts(controller) == [0, 1])
+    action = act(controller, game, 4)
+    if ensemble is None:
+        # Steps 1 to 3 of the late chunk already passed
+        assert action == 103
+    else:
+        weights = np.exp(-ensemble * np.arange(2))
+        assert np.isclose(action, weights @ [4, 103] / weights.sum())
+
+    policy.gate.release(10)
+    controller.close()
+
+
+def test_reset_drops_chunks():
+    policy, controller = make_controller(wait_first=False)
+    game = SimpleNamespace(dog=np.zeros((1, 2)), step=0)
+    controller.get_input(game)
+    wait_for(lambda: chunk_starts(controller) == [0])
+    act(controller, game, 1)
+    wait_for(lambda: policy.calls == 2)
+
+    # The chunk for step 1 arrives after the reset and is dropped
+    controller.reset()
+    assert chunk_starts(controller) == []
+    assert act(controller, game, 0) == 0
+    policy.gate.release()
+    # Once the policy starts on the new episode, the old chunk is handled
+    wait_for(lambda: policy.calls == 3)
+    assert chunk_starts(controller) == []
+
+    policy.gate.release(10)
+    controller.close()
+
+
+def test_policy_error_raised_in_game_thread():
+    def policy(observation):
+        raise ValueError("bad observation")
+
+    controller = PolicyController(policy)
+    game = SimpleNamespace(dog=np.zeros((1, 2)), sheep=np.zeros((3, 2)),
+                           target=np.zeros(2))
+    with pytest.raises(ValueError, match="bad observation"):
+        controller.get_input(game)
+    controller.close()
@@ -0,0 +1,31 @@
+import os
+
+import numpy as np
+
+from shepherd_game.catalog import Catalog
+from shepherd_game.generate import generate
+from shepherd_game.visualize_density import density, main
+
+
+def test_density_counts_every_sample(tmp_path):
+    data_dir = str(tmp_path / 'data')
+    generate(data_dir, 4, workers=1, seed=0, max_steps=400, frame_scale=None,
+             save_frames=False, random_goal=True)
+    catalog = Catalog(data_dir)
+
+    hist = density(data_dir, workers=1)
+    assert hist['dog'].sum() == catalog.lengths.sum()
+    assert hist['sheep'].sum() == catalog.lengths.sum() * 5
+    assert np.array_equal(hist['goals'], catalog.targets)
+    time = hist['sheep_time'][hist['sheep'] > 0]
+    assert np.all((time >= 0) & (time <= 1))
+
+    # Trial range and goal filters
+    assert len(density(data_dir, 1, 3, workers=1)['goals']) == 2
+    near = density(data_dir, target=catalog.targets[0], radius=1e-6,
+                   workers=1)
+    assert np.array_equal(near['goals'], catalog.targets[:1])
+
+    output = str(tmp_path / 'density.png')
+    main(data_dir, output=output)
+    assert os.path.getsize(output) > 0
@@ -0,0 +1,14 @@
+import os
+
+import numpy as np
+
+from shepherd_game.generate import run_worker
+
+
+def test_worker_gives_up_after_max_failures(tmp_path):
+    # No episode can reach the goal in one step
+    stats = run_worker(str(tmp_path), 0, 5, np.random.SeedSequence(0),
+                       max_steps=1, game_kwargs={'save_frames': False},
+                       max_failures=3)
+    assert stats == {'episodes': 0, 'dropped': 3, 'missing': 5, 'steps': 3}
+    assert not [name for name in os.listdir(tmp_path) if name.isdigit()]
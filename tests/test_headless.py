@@ -0,0 +1,28 @@
+import numpy as np
+import pygame
+
+from shepherd_game.game import Game
+
+
+def test_headless_game_skips_display_and_sprites():
+    game = Game(headless=True, seed=0)
+    assert not pygame.display.get_init()
+    assert game.sprites.atlas is None
+
+    game.step(np.ones((1, 2)))
+    frame = game.observe()
+    assert frame.shape[2] == 3
+    assert game.sprites.atlas is not None
+    assert not pygame.display.get_init()
+
+
+def test_window_capture_redraws_skipped_renders():
+    game = Game(seed=0)
+    game.render()
+    for _ in range(3):
+        # Steps run without a render, as with render_every in run
+        game.step(np.ones((1, 2)))
+        frame = game.capture()
+        game.render(draw=False)
+        assert np.array_equal(frame, pygame.surfarray.array3d(game.screen))
+    pygame.quit()
@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+import pytest
+
+from shepherd_game.obstacles import Broadphase, Circle, Line
+from shepherd_game.utils import circle_intersects, line_intersects, unit_vect
+
+
+def random_layout(num: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    lines = [Line(start=list(rng.random(2) * 100),
+                  end=list(rng.random(2) * 100)) for _ in range(num // 2)]
+    circles = [Circle(center=tuple(rng.random(2) * 100),
+                      radius=float(rng.uniform(2, 10)))
+               for _ in range(num - num // 2)]
+    return lines, circles
+
+
+def brute_hits(grid: Broadphase, start: np.ndarray, end: np.ndarray) -> list:
+    """Every obstacle the segment crosses, checked one by one."""
+    hits = []
+    for idx in range(grid.num_lines):
+        if line_intersects(start, end, grid.starts[idx], grid.ends[idx]):
+            hits.append(idx)
+    for idx, (center, radius) in enumerate(zip(grid.centers, grid.radii)):
+        if circle_intersects(start, end, center, radius):
+            hits.append(grid.num_lines + idx)
+    return hits
+
+
+def brute_move(grid: Broadphase, start: np.ndarray,
+               movement: np.ndarray) -> np.ndarray:
+    """Game.calculate_movement against every obstacle."""
+    end = start + movement
+    hits = brute_hits(grid, start, end)
+    if not hits:
+        return end
+    idx = hits[0]
+    if idx < grid.num_lines:
+        along = grid.ends[idx] - grid.starts[idx]
+        proj = np.dot(movement, along) / np.linalg.norm(along)
+        return start + proj * unit_vect(along)
+    center, radius = grid.centers[idx - grid.num_lines], \
+        grid.radii[idx - grid.num_lines]
+    angle = math.atan2(end[1] - center[1], end[0] - center[0])
+    return center + radius * np.array([math.cos(angle), math.sin(angle)])
+
+
+@pytest.mark.parametrize('num', [1, 10, 100])
+@pytest.mark.parametrize('cell_size', [None, 3.0])
+def test_broadphase_matches_brute_force(num, cell_size):
+    grid = Broadphase(*random_layout(num), cell_size=cell_size)
+    rng = np.random.default_rng(1)
+    starts = rng.random((300, 2)) * 120 - 10
+    movements = rng.normal(0, 8, (300, 2))
+    ends = starts + movements
+
+    expected = [brute_hits(grid, start, end)
+                for start, end in zip(starts, ends)]
+    assert np.array_equal(grid.blocked(starts, ends),
+                          [bool(hits) for hits in expected])
+    for start, end, hits in zip(starts, ends, expected):
+        assert set(hits) <= set(grid.query(start, end))
+
+    moved = np.array([brute_move(grid, start, movement)
+                      for start, movement in zip(starts, movements)])
+    assert np.allclose(grid.move(starts, movements), moved)
+
+
+def test_empty_broadphase():
+    grid = Broadphase([], [])
+    starts = np.zeros((3, 2))
+    movements = np.ones((3, 2))
+    assert grid.query(starts[0], movements[0]) == []
+    assert not grid.blocked(starts, movements).any()
+    assert np.array_equal(grid.move(starts, movements), movements)
@@ -0,0 +1,45 @@
+import json
+import os
+
+import numpy as np
+
+from shepherd_game.game import PROFILE_FILE, Game
+from shepherd_game.profiler import PhaseTimer
+
+
+def test_episode_totals_start_over():
+    timer = PhaseTimer(True, window=2)
+    for seconds in [1, 2, 3]:
+        timer.add('herd', seconds)
+    summary = timer.end_episode(trial=0)
+    assert summary['trial'] == 0
+    assert summary['phases']['herd']['count'] == 3
+    assert np.isclose(summary['phases']['herd']['total_ms'], 6e3)
+    assert len(timer.recent['herd']) == 2
+
+    timer.add('herd', 4)
+    assert timer.end_episode()['phases']['herd']['count'] == 1
+    assert not timer.end_episode()['phases']
+
+
+def test_summaries_go_to_profile_file(tmp_path):
+    game = Game(save_dir=str(tmp_path), headless=True, profile=True,
+                save_frames=False)
+    for _ in range(3):
+        game.step(np.zeros((1, 2)))
+        game.save_data()
+    game.close()
+
+    with open(os.path.join(str(tmp_path), PROFILE_FILE)) as file:
+        trials = [json.loads(line)['trial'] for line in file]
+    assert trials == [0, 1, 2]
+    assert not hasattr(game.profiler, 'episodes')
+
+
+def test_summary_kept_without_saving():
+    game = Game(headless=True, profile=True, jit=False)
+    assert game.profile_summary is None
+    for _ in range(4):
+        game.step(np.zeros((1, 2)))
+    game.save_profile()
+    assert game.profile_summary['phases']['herd']['count'] == 4
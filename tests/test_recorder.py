@@ -0,0 +1,82 @@
+import atexit
+import os
+
+import numpy as np
+import pytest
+
+from shepherd_game.recorder import EpisodeRecorder, TrialWriter
+
+
+class FlakyWriter(TrialWriter):
+    """TrialWriter that fails on one step of the first episode."""
+
+    def __init__(self, save_dir, fail_at):
+        super().__init__(save_dir)
+        self.fail_at = fail_at
+
+    def step(self, *args):
+        if self.num_frames == self.fail_at:
+            self.fail_at = None
+            raise OSError("disk full")
+        super().step(*args)
+
+
+def record_episode(recorder, trial, steps=5):
+    recorder.start(trial)
+    for step in range(steps):
+        recorder.record(np.full((1, 2), step), np.zeros((3, 2)))
+    recorder.finish(np.zeros(2))
+
+
+def test_failed_episode_is_discarded(tmp_path):
+    recorder = EpisodeRecorder(FlakyWriter(str(tmp_path), fail_at=2))
+    record_episode(recorder, 1)
+    with pytest.raises(OSError):
+        recorder.flush()
+
+    # The error is raised once and the broken trial leaves nothing behind
+    assert os.listdir(tmp_path) == []
+    record_episode(recorder, 2)
+    recorder.flush()
+    assert sorted(os.listdir(tmp_path)) == ['2']
+    dog = np.loadtxt(tmp_path / '2' / 'pos.csv', delimiter=',')
+    assert dog[:, 0].tolist() == [0, 1, 2, 3, 4]
+    recorder.close()
+
+
+def test_close_unregisters_exit_hook(tmp_path, monkeypatch):
+    hooks = []
+    monkeypatch.setattr(atexit, 'register', hooks.append)
+    monkeypatch.setattr(atexit, 'unregister', hooks.remove)
+    recorder = EpisodeRecorder(TrialWriter(str(tmp_path)))
+    assert hooks == [recorder.close]
+    recorder.close()
+    assert hooks == []
+    assert not recorder.thread.is_alive()
+
+
+def test_record_after_close_raises(tmp_path):
+    recorder = EpisodeRecorder(TrialWriter(str(tmp_path)))
+    recorder.close()
+    with pytest.raises(RuntimeError):
+        record_episode(recorder, 0)
+
+
+def test_game_starts_each_trial_once(tmp_path, monkeypatch):
+    from shepherd_game.game import Game
+
+    starts = []
+    start = TrialWriter.start
+    monkeypatch.setattr(TrialWriter, 'start', lambda self, trial, spawn=None:
+                        starts.append(trial) or start(self, trial, spawn))
+    game = Game(save_dir=str(tmp_path), headless=True, save_frames=False)
+    for _ in range(3):
+        game.step(np.zeros((1, 2)))
+        game.save_data()
+        game.reset()
+    game.reset()
+    game.close()
+    assert starts == [0, 1, 2]
+    assert sorted(os.listdir(tmp_path)) == ['0', '1', '2']
+    with pytest.raises(RuntimeError):
+        game.step(np.zeros((1, 2)))
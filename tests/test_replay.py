@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pygame
+import pytest
+
+from shepherd_game.catalog import load_trial
+from shepherd_game.game import Game
+from shepherd_game.policies import StrombomShepherd
+from shepherd_game.replay import EpisodeReplay
+from shepherd_game.storage import EpisodeReader
+
+
+def record(save_dir: str, save_format: str, episodes: int = 2):
+    game = Game(save_dir=save_dir, headless=True, seed=0, frame_scale=1,
+                save_format=save_format, sample_every=3)
+    policy = StrombomShepherd(np.random.default_rng(0))
+    for _ in range(episodes):
+        for _ in range(60):
+            if game.step(policy.act(game.dog, game.sheep, game.target)):
+                break
+        game.save_data()
+        game.reset()
+    game.close()
+
+
+def read_bmp(path: str) -> np.ndarray:
+    return pygame.surfarray.array3d(pygame.image.load(path))
+
+
+def saved_frames(save_dir: str, save_format: str, replay: EpisodeReplay,
+                 idx: int) -> np.ndarray:
+    if save_format == 'trials':
+        # Trial folders number their frames from 1
+        path = os.path.join(save_dir, str(replay.source.trials[idx]), 'img')
+        return np.stack([
+            read_bmp(os.path.join(path, f'{k + 1}.bmp'))
+            for k in range(len(os.listdir(path)))])
+    return EpisodeReader(save_dir).episode(idx, ['frames'])['frames']
+
+
+@pytest.mark.parametrize('save_format', ['trials', 'chunks'])
+def test_replay_matches_saved_frames(tmp_path, save_format):
+    save_dir = str(tmp_path / 'data')
+    record(save_dir, save_format)
+    replay = EpisodeReplay(save_dir)
+    assert len(replay) == 2
+    for idx in range(len(replay)):
+        saved = saved_frames(save_dir, save_format, replay, idx)
+        frames = replay.frames(idx)
+        # One more frame than samples, showing the final state
+        assert len(frames) == len(saved) + 1
+        assert np.array_equal(frames[:-1], saved)
+
+
+def test_trial_headings_round_trip(tmp_path):
+    save_dir = str(tmp_path / 'data')
+    record(save_dir, 'trials', episodes=1)
+    data = load_trial(os.path.join(save_dir, '0'), headings=True)
+    assert data['dog_dir'].shape == data['dog'].shape
+    assert data['sheep_dir'].shape == data['sheep'].shape
+    assert set(data['spawn']) == {'dog', 'sheep', 'dog_dir', 'sheep_dir'}
+    assert 'dog_dir' not in load_trial(os.path.join(save_dir, '0'))
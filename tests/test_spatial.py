@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from shepherd_game.spatial import SpatialGrid
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    # A dense clump and a sparse spread, with points in negative cells
+    return np.concatenate([rng.normal(50, 3, (150, 2)),
+                           rng.uniform(-20, 150, (100, 2))])
+
+
+@pytest.mark.parametrize('radius', [0.5, 2, 7, 40])
+def test_query_radius_matches_brute_force(points, radius):
+    queries = np.random.default_rng(1).uniform(-20, 150, (60, 2))
+    grid = SpatialGrid(2)
+    grid.build(points)
+    query_idx, point_idx, dists = grid.query_radius(queries, radius)
+
+    all_dists = np.linalg.norm(queries[:, None] - points, axis=-1)
+    expected = set(zip(*np.nonzero(all_dists <= radius)))
+    assert set(zip(query_idx.tolist(), point_idx.tolist())) == expected
+    assert np.allclose(dists, all_dists[query_idx, point_idx])
+    assert np.all(np.diff(query_idx) >= 0)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from shepherd_game.game import Game
+from shepherd_game.policies import StrombomShepherd
+from shepherd_game.state import GameState
+from shepherd_game.vec_game import VecGame
+
+
+def rollout(game: Game, steps: int, seed: int = 0) -> np.ndarray:
+    """Sheep positions after each step of a seeded scripted shepherd."""
+    policy = StrombomShepherd(np.random.default_rng(seed))
+    trajectory = []
+    for _ in range(steps):
+        game.step(policy.act(game.dog, game.sheep, game.target))
+        trajectory.append(game.sheep.copy())
+    return np.array(trajectory)
+
+
+@pytest.mark.parametrize('jit', [False, True])
+def test_restore_repeats_the_rollout(jit):
+    if jit:
+        pytest.importorskip('numba')
+    game = Game(headless=True, seed=0, num_sheep=20, num_dog=2, jit=jit)
+    rollout(game, 10)
+    state = game.snapshot()
+
+    # Grazing draws are part of the state, so the rollouts match exactly
+    first = rollout(game, 40)
+    game.restore(state)
+    assert np.array_equal(rollout(game, 40), first)
+
+    # The snapshot is a copy, stepping does not change it
+    assert not np.array_equal(state.sheep, game.sheep)
+    game.restore(state)
+    assert np.array_equal(game.sheep, state.sheep)
+
+
+def test_restore_checks_shapes():
+    state = Game(headless=True, seed=0, num_sheep=5).snapshot()
+    with pytest.raises(ValueError):
+        Game(headless=True, seed=0, num_sheep=6).restore(state)
+    with pytest.raises(ValueError):
+        VecGame(2, seed=0, num_sheep=5).restore(state)
+
+
+def test_vec_game_restore_repeats_the_rollout():
+    games = VecGame(4, seed=0, num_sheep=10, max_steps=30)
+    rng = np.random.default_rng(0)
+    actions = rng.normal(size=(60, 4, 1, 2))
+    for action in actions[:10]:
+        games.step(action)
+    state = games.snapshot()
+
+    # Games that hit max_steps are reset from the generators in the state
+    first = []
+    for action in actions[10:]:
+        games.step(action)
+        first.append(games.sheep.copy())
+    games.restore(state)
+    for action, sheep in zip(actions[10:], first):
+        games.step(action)
+        assert np.array_equal(games.sheep, sheep)
+
+
+def test_expand_starts_games_from_a_game():
+    game = Game(headless=True, seed=0, num_sheep=10)
+    rollout(game, 5)
+    state = game.snapshot()
+
+    games = VecGame(4, seed=1, num_sheep=10)
+    before = games.snapshot()
+    mask = np.array([True, False, True, False])
+    games.expand(state, mask)
+    for name in GameState.ARRAYS:
+        current = getattr(games, name)
+        assert np.array_equal(current[mask], np.broadcast_to(
+            getattr(state, name), current[mask].shape))
+        assert np.array_equal(current[~mask], getattr(before, name)[~mask])
+    assert np.array_equal(games.steps, [0, before.steps[1], 0,
+                                        before.steps[3]])
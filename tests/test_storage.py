@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from shepherd_game.storage import ChunkWriter, EpisodeReader
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_chunk_round_trip(tmp_path, compress):
+    rng = np.random.default_rng(0)
+    writer = ChunkWriter(str(tmp_path), chunk_size=4, compress=compress)
+    written = []
+    for trial, length in enumerate([3, 6, 2, 9]):
+        episode = {name: [] for name in ['dog', 'sheep', 'action', 'frames']}
+        writer.start(trial)
+        for _ in range(length):
+            step = {'dog': rng.random((2, 2)), 'sheep': rng.random((5, 2)),
+                    'action': rng.random((2, 2)),
+                    'frames': rng.integers(0, 255, (6, 4, 3), np.uint8)}
+            writer.step(step['dog'], step['sheep'], step['frames'],
+                        step['action'])
+            for name, value in step.items():
+                episode[name].append(value)
+        if trial == 2:
+            # Dropped episodes never reach the index
+            writer.discard()
+            continue
+        writer.finish(np.array([trial, 1.0]), success=trial != 3)
+        written.append(episode)
+
+    # A new episode that is never finished is not indexed either
+    writer.start(9)
+    writer.step(np.zeros((2, 2)), np.zeros((5, 2)), np.zeros((6, 4, 3)))
+    writer.close()
+
+    reader = EpisodeReader(str(tmp_path))
+    assert len(reader) == len(written)
+    for idx, episode in enumerate(written):
+        data = reader[idx]
+        for name, values in episode.items():
+            dtype = np.uint8 if name == 'frames' else np.float32
+            assert np.array_equal(data[name], np.array(values, dtype=dtype))
+        assert data['target'][1] == 1
+    assert [reader[idx]['success'] for idx in range(3)] == [True, True, False]
+
+
+def test_run_directory_is_not_overwritten(tmp_path):
+    writer = ChunkWriter(str(tmp_path))
+    writer.start(0)
+    writer.step(np.zeros((1, 2)), np.zeros((1, 2)))
+    writer.finish(np.zeros(2))
+    writer.close()
+    with pytest.raises(FileExistsError):
+        ChunkWriter(str(tmp_path))
@@ -0,0 +1,95 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from shepherd_game import game as game_module
+from shepherd_game.subproc_vec_game import SubprocVecGame
+
+# Workers are forked, so they see attributes patched in the test
+KWARGS = {'workers': 2, 'seed': 0, 'num_sheep': 4, 'jit': False,
+          'start_method': 'fork'}
+
+
+@pytest.fixture
+def games():
+    games = SubprocVecGame(3, max_steps=3, **KWARGS)
+    yield games
+    games.close()
+
+
+def test_step_and_auto_reset(games):
+    assert games.frames.shape[0] == 3
+    action = np.zeros((3, 1, 2))
+    for steps in [1, 2]:
+        done = games.step(action)
+        assert not done.any()
+        assert games.steps.tolist() == [steps] * 3
+
+    # Games are reset in place once they hit max_steps
+    dog = games.dog.copy()
+    assert games.step(action).all()
+    assert games.steps.tolist() == [0] * 3
+    assert not np.array_equal(games.dog, dog)
+
+
+def test_reset_mask(games):
+    games.step(np.ones((3, 1, 2)))
+    sheep = games.sheep.copy()
+    games.reset(np.array([True, False, True]))
+    assert games.steps.tolist() == [0, 1, 0]
+    assert np.array_equal(games.sheep[1], sheep[1])
+    assert not np.array_equal(games.sheep[0], sheep[0])
+
+
+def test_step_async(games):
+    dog = games.dog.copy()
+    games.step_async(np.ones((3, 1, 2)))
+    done = games.step_wait()
+    assert not done.any()
+    assert np.allclose(games.dog, dog + 1)
+
+
+def test_close_frees_shared_memory():
+    games = SubprocVecGame(2, frame_scale=None, **KWARGS)
+    names = [block.name for block in games.blocks.values()]
+    processes = games.processes
+    games.close()
+    games.close()
+    assert not any(process.is_alive() for process in processes)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=names[0])
+
+
+def test_failed_startup_cleans_up(monkeypatch):
+    created = []
+    init = shared_memory.SharedMemory.__init__
+
+    def track(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        if kwargs.get('create'):
+            created.append(self.name)
+
+    monkeypatch.setattr(shared_memory.SharedMemory, '__init__', track)
+    with pytest.raises(RuntimeError, match='Unknown save format'):
+        SubprocVecGame(2, save_dir='unused/', save_format='bogus',
+                       frame_scale=None, **KWARGS)
+    monkeypatch.undo()
+    for name in created:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+def test_games_save_to_own_dirs(tmp_path, monkeypatch):
+    # Every step reaches the goal, so every step ends an episode
+    monkeypatch.setattr(game_module, 'TARGET_RADIUS', 1000)
+    games = SubprocVecGame(4, save_dir=str(tmp_path), frame_scale=None,
+                           save_frames=False, **KWARGS)
+    for _ in range(3):
+        assert games.step(np.zeros((4, 1, 2))).all()
+    games.close()
+
+    assert sorted(os.listdir(tmp_path)) == [f'env{env}' for env in range(4)]
+    for env in range(4):
+        assert sorted(os.listdir(tmp_path / f'env{env}')) == ['0', '1', '2']
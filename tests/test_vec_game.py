@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from shepherd_game import game as game_module
+from shepherd_game import obstacles
+from shepherd_game import parameters
+from shepherd_game import vec_game as vec_game_module
+from shepherd_game.benchmark import lockstep_errors, random_obstacles
+from shepherd_game.game import Game
+from shepherd_game.vec_game import VecGame
+
+
+@pytest.fixture
+def no_grazing(monkeypatch):
+    """Turn off grazing, the only draw Game and VecGame make differently."""
+    monkeypatch.setattr(game_module, 'GRAZE', 0)
+    monkeypatch.setattr(vec_game_module, 'GRAZE', 0)
+
+
+@pytest.mark.parametrize('num_obstacles', [0, 4, 100])
+@pytest.mark.parametrize('num_dog,multi_dog', [(1, 'nearest'),
+                                               (3, 'sum'),
+                                               (2, 'sequential')])
+def test_matches_game(no_grazing, num_obstacles, num_dog, multi_dog):
+    with random_obstacles(num_obstacles, parameters.FIELD_LENGTH):
+        game = Game(headless=True, seed=0, num_sheep=20, num_dog=num_dog,
+                    multi_dog=multi_dog, jit=False)
+        vec = VecGame(3, seed=0, num_sheep=20, num_dog=num_dog,
+                      multi_dog=multi_dog)
+        [error] = lockstep_errors(game, [vec], 60)
+    assert error <= 1e-9
+
+
+def test_obstacles_block_movement():
+    with random_obstacles(0, parameters.FIELD_LENGTH):
+        obstacles.circles.append(obstacles.Circle(center=(50, 50),
+                                                  radius=10))
+        vec = VecGame(4, seed=0)
+        starts = np.array([[30., 50.], [70., 50.], [50., 30.], [5., 5.]])
+        ends = vec.move_all(starts, np.array([[15., 0.], [-15., 0.],
+                                              [0., 15.], [1., 1.]]))
+        # Agents heading into the circle stop on its edge
+        radius = np.hypot(*(ends[:3] - [50, 50]).T)
+        assert np.allclose(radius, 10)
+        assert np.allclose(ends[3], [6, 6])
+
+        seen = vec.visibility(np.array([[30., 50.], [30., 30.]]),
+                              np.array([[70., 50.], [30., 70.]]))
+        assert seen.tolist() == [False, True]
+
+
+def test_step_writes_state_in_place():
+    games = VecGame(4, seed=0, num_sheep=10, max_steps=15)
+    arrays = {name: getattr(games, name)
+              for name in ['sheep', 'dog', 'target', 'sheep_dir', 'dog_dir']}
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        games.step(rng.normal(size=(4, 1, 2)))
+        for name, array in arrays.items():
+            assert getattr(games, name) is array
+
+
+def test_reset_picks_up_obstacle_changes():
+    with random_obstacles(0, parameters.FIELD_LENGTH):
+        vec = VecGame(2, seed=0)
+        assert vec.broadphase.num == 0
+        obstacles.circles.append(obstacles.Circle(center=(50, 50),
+                                                  radius=10))
+        vec.reset(np.array([True, False]))
+        assert vec.broadphase.num == 1
+        ends = vec.move_all(np.array([[30., 50.]]), np.array([[15., 0.]]))
+        assert np.allclose(np.hypot(*(ends - [50, 50]).T), 10)
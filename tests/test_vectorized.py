@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from shepherd_game.benchmark import TRAJECTORY_CASES, trajectory_check
+from shepherd_game.game import Game
+from shepherd_game.policies import StrombomShepherd
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'jit'])
+@pytest.mark.parametrize('case', TRAJECTORY_CASES, ids=str)
+def test_matches_reference(case, backend):
+    if backend == 'jit':
+        pytest.importorskip('numba')
+    steps = 20 if case['num_sheep'] > 50 else 60
+    [result] = trajectory_check(steps, cases=[case], backends=[backend])
+    assert result['passed'], result
+
+
+def test_profiling_keeps_numpy_phases():
+    assert not Game(headless=True, profile=True).jit
+    game = Game(headless=True, profile=True)
+    game.step(np.ones((1, 2)))
+    assert {'visibility', 'graze', 'move'} <= set(game.profiler.recent)
+
+
+def test_same_seed_same_episode():
+    games = [Game(headless=True, seed=3, num_sheep=10, jit=False)
+             for _ in range(2)]
+    policy = StrombomShepherd(np.random.default_rng(0))
+    for _ in range(50):
+        action = policy.act(games[0].dog, games[0].sheep, games[0].target)
+        for game in games:
+            game.step(action.copy())
+    assert np.array_equal(games[0].sheep, games[1].sheep)
+
+
+def test_step_writes_state_in_place():
+    game = Game(headless=True, seed=0, num_sheep=20, jit=False)
+    arrays = {name: getattr(game, name)
+              for name in ['sheep', 'dog', 'target', 'sheep_dir', 'dog_dir']}
+    headings = {id(game.heading), id(game.next_heading)}
+    policy = StrombomShepherd(np.random.default_rng(0))
+    for _ in range(20):
+        game.step(policy.act(game.dog, game.sheep, game.target))
+        for name, array in arrays.items():
+            assert getattr(game, name) is array
+        assert {id(game.heading), id(game.next_heading)} == headings
+    with pytest.raises(AttributeError):
+        game.sheep = np.zeros((20, 2))
+
+
+def test_scratch_grows_with_use():
+    game = Game(headless=True, seed=0, num_sheep=40, jit=False)
+    assert len(game.scratch.dists) == 0
+    policy = StrombomShepherd(np.random.default_rng(0))
+    for _ in range(50):
+        game.step(policy.act(game.dog, game.sheep, game.target))
+    # Doubling never overshoots the pairs needed by more than 2x
+    assert 0 < len(game.scratch.dists) <= 2 * 40**2